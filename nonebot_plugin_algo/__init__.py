@@ -21,6 +21,7 @@ __plugin_meta__ = PluginMetadata(
     mycf : 查询自己 CF 信息
     cf [uid]: 查询指定用户cf简略信息
     cf -f [uid] 查询指定用户cf详细信息
+    cf排行 : 查询本群已绑定用户的 rating 排行
 
     **订阅功能:**
     比赛订阅(订阅比赛) [比赛id] : 订阅比赛提醒
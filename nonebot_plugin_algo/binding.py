@@ -0,0 +1,249 @@
+import json
+import time
+import asyncio
+from pathlib import Path
+from typing import Dict
+
+from nonebot import get_bots, get_driver
+from nonebot.adapters import Bot
+from nonebot.log import logger
+
+from .util import Util
+from .singleflight import SingleFlight
+
+# 群成员名单的有效期（秒），过期后使用群成员索引前重新拉取
+ROSTER_TTL = 600
+
+
+class BindingRegistry:
+    """QQ 与平台账号的绑定表
+
+    users.json 保持原有的 {QQ: 账号} 格式，另用同目录的 groups.json 记录
+    用户在哪些群里绑定或查询过。启动时读入内存，之后的查询都不访问磁盘；
+    内存中同时维护 账号 -> QQ 的反向索引与 群 -> QQ 的成员索引。
+    写入在线程中通过临时文件替换完成，进程崩溃不会留下写了一半的文件。
+
+    群成员索引只是缓存：refresh_group 用 OneBot 的群成员列表与绑定求交集，
+    补上在群里从未使用过命令的已绑定用户，并移除已退群的成员；
+    退群通知到达时也会立即移除。
+    """
+
+    instances: dict[str, "BindingRegistry"] = {}
+    # 群号 -> 上次拉取成员名单的时间
+    _synced: Dict[str, float] = {}
+    _roster_flight = SingleFlight("group-roster")
+
+    def __init__(self, name: str, path: Path):
+        self.name = name
+        self.path = path
+        self.groups_path = path.with_name("groups.json")
+        self._users: Dict[str, str | int] | None = None
+        # 账号（小写） -> QQ
+        self._owners: Dict[str, set[str]] = {}
+        # 群号 -> QQ
+        self._members: Dict[str, set[str]] = {}
+        # QQ -> 群号
+        self._groups: Dict[str, set[str]] = {}
+        self._lock = asyncio.Lock()
+        BindingRegistry.instances[name] = self
+
+    @staticmethod
+    def _key(account: str | int) -> str:
+        return str(account).lower()
+
+    @staticmethod
+    def _read(path: Path) -> dict:
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            logger.error(f"读取绑定数据失败: {path} ({e})")
+            return {}
+
+    def load(self) -> None:
+        """读取绑定数据并建立索引，只在首次访问时执行"""
+        if self._users is not None:
+            return
+        users = self._read(self.path)
+        owners: Dict[str, set[str]] = {}
+        for qq, account in users.items():
+            owners.setdefault(self._key(account), set()).add(qq)
+        members = {
+            group: {qq for qq in qqs if qq in users}
+            for group, qqs in self._read(self.groups_path).items()
+        }
+        self._owners = owners
+        self._members = {group: qqs for group, qqs in members.items() if qqs}
+        self._groups = {}
+        for group, qqs in self._members.items():
+            for qq in qqs:
+                self._groups.setdefault(qq, set()).add(group)
+        self._users = users
+
+    def _ensure(self) -> Dict[str, str | int]:
+        if self._users is None:
+            self.load()
+        return self._users  # type: ignore
+
+    @staticmethod
+    def _write(path: Path, data: dict) -> None:
+        Util.write_atomic(path, json.dumps(data, ensure_ascii=False, indent=4))
+
+    async def _save(self, users: bool = True, groups: bool = False) -> None:
+        # 在事件循环中取快照，线程只负责写文件
+        async with self._lock:
+            if users:
+                await asyncio.to_thread(self._write, self.path, dict(self._ensure()))
+            if groups:
+                snapshot = {group: sorted(qqs) for group, qqs in self._members.items()}
+                await asyncio.to_thread(self._write, self.groups_path, snapshot)
+
+    def get(self, qq: str) -> str | int | None:
+        return self._ensure().get(qq)
+
+    def owners(self, account: str | int) -> set[str]:
+        """绑定了该账号的 QQ"""
+        self._ensure()
+        return set(self._owners.get(self._key(account), ()))
+
+    def members(self, group_id: str) -> Dict[str, str | int]:
+        """在该群中绑定或查询过的用户，返回 {QQ: 账号}"""
+        users = self._ensure()
+        members = self._members.get(str(group_id), ())
+        return {qq: users[qq] for qq in members if qq in users}
+
+    def groups_of(self, qq: str) -> set[str]:
+        self._ensure()
+        return set(self._groups.get(qq, ()))
+
+    async def bind(
+        self, qq: str, account: str | int, group_id: str | None = None
+    ) -> None:
+        users = self._ensure()
+        old = users.get(qq)
+        if old is not None:
+            owners = self._owners.get(self._key(old))
+            if owners is not None:
+                owners.discard(qq)
+                if not owners:
+                    del self._owners[self._key(old)]
+        users[qq] = account
+        self._owners.setdefault(self._key(account), set()).add(qq)
+        joined = self._join(qq, group_id)
+        await self._save(users=True, groups=joined)
+
+    def _join(self, qq: str, group_id: str | None) -> bool:
+        if not group_id:
+            return False
+        members = self._members.setdefault(str(group_id), set())
+        if qq in members:
+            return False
+        members.add(qq)
+        self._groups.setdefault(qq, set()).add(str(group_id))
+        return True
+
+    async def join(self, qq: str, group_id: str | None) -> None:
+        """记录已绑定用户所在的群，成员没有变化时不写盘"""
+        if qq in self._ensure() and self._join(qq, group_id):
+            await self._save(users=False, groups=True)
+
+    def _leave(self, qq: str, group_id: str) -> None:
+        members = self._members.get(group_id)
+        if members is not None:
+            members.discard(qq)
+            if not members:
+                del self._members[group_id]
+        groups = self._groups.get(qq)
+        if groups is not None:
+            groups.discard(group_id)
+            if not groups:
+                del self._groups[qq]
+
+    async def leave(self, qq: str, group_id: str) -> None:
+        """用户退群后从群成员索引中移除"""
+        self._ensure()
+        group_id = str(group_id)
+        if qq in self._members.get(group_id, ()):
+            self._leave(qq, group_id)
+            await self._save(users=False, groups=True)
+
+    async def sync_group(self, group_id: str, member_ids: set[str]) -> None:
+        """用群成员名单重建该群的成员索引，没有变化时不写盘"""
+        users = self._ensure()
+        group_id = str(group_id)
+        current = self._members.get(group_id, set())
+        actual = {qq for qq in member_ids if qq in users}
+        if actual == current:
+            return
+        for qq in current - actual:
+            self._leave(qq, group_id)
+        for qq in actual - current:
+            self._join(qq, group_id)
+        await self._save(users=False, groups=True)
+
+    @classmethod
+    async def refresh_group(cls, group_id: str, bot: Bot | None = None) -> bool:
+        """拉取群成员名单并同步到所有绑定表，名单仍在有效期内时跳过，返回是否可用"""
+        group_id = str(group_id)
+        if time.time() - cls._synced.get(group_id, 0.0) < ROSTER_TTL:
+            return True
+        return await cls._roster_flight.do(
+            group_id, lambda: cls._refresh_group(group_id, bot)
+        )
+
+    @classmethod
+    async def _refresh_group(cls, group_id: str, bot: Bot | None) -> bool:
+        candidates = [bot] if bot is not None else list(get_bots().values())
+        for candidate in candidates:
+            try:
+                members = await candidate.call_api(
+                    "get_group_member_list", group_id=int(group_id)
+                )
+            except Exception as e:
+                logger.debug(f"获取群成员列表失败: {group_id} ({type(e).__name__}: {e})")
+                continue
+            member_ids = {str(member["user_id"]) for member in members}
+            for registry in cls.instances.values():
+                await registry.sync_group(group_id, member_ids)
+            cls._synced[group_id] = time.time()
+            return True
+        logger.warning(f"无法获取群 {group_id} 的成员列表，使用已记录的群成员")
+        return False
+
+    @classmethod
+    async def refresh_groups(cls) -> None:
+        """同步所有 Bot 所在群的成员名单，供面向全部群的推送使用"""
+        for bot in list(get_bots().values()):
+            try:
+                groups = await bot.call_api("get_group_list")
+            except Exception as e:
+                logger.warning(f"获取群列表失败: {bot.self_id} ({type(e).__name__}: {e})")
+                continue
+            for group in groups:
+                await cls.refresh_group(str(group["group_id"]), bot)
+
+    @classmethod
+    async def forget_group(cls, group_id: str) -> None:
+        """Bot 退出群聊后清空该群的成员索引"""
+        cls._synced.pop(str(group_id), None)
+        for registry in cls.instances.values():
+            await registry.sync_group(group_id, set())
+
+    def stats(self) -> dict:
+        self._ensure()
+        return {
+            "users": len(self._users or {}),
+            "accounts": len(self._owners),
+            "groups": len(self._members),
+        }
+
+
+driver = get_driver()
+
+
+@driver.on_startup
+async def load_bindings():
+    for registry in BindingRegistry.instances.values():
+        await asyncio.to_thread(registry.load)
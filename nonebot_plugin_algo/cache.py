@@ -0,0 +1,231 @@
+import json
+import time
+import asyncio
+import hashlib
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Hashable
+
+from nonebot import get_driver
+
+from .config import algo_config
+from .render import Renderer
+from .delivery import CardDelivery
+from .util import Util
+
+# 内存模式下每个缓存保留的图片总字节数上限
+MEMORY_LIMIT = 64 * 1024 * 1024
+
+
+class CardCache:
+    """卡片缓存
+
+    图片以渲染输入的摘要命名，相同输入直接复用已生成的文件；
+    另外记录「请求键 -> 摘要」的别名，TTL 内相同请求连数据都不必重新获取。
+
+    algo_card_delivery 为 file 时图片保存在目录中，目录总大小不超过 algo_card_dir_size，
+    超出时按最近发送时间逐个淘汰，超过 algo_card_dir_max_age 的文件由定时任务删除；
+    为 memory / url 时只保存在内存，按最近使用淘汰，总大小不超过 MEMORY_LIMIT。
+    """
+
+    instances: dict[str, "CardCache"] = {}
+
+    def __init__(self, name: str, directory: Path):
+        self.name = name
+        self.directory = directory
+        self._aliases: dict[Hashable, tuple[str, float]] = {}
+        # 摘要 -> (图片字节, 生成时间)
+        self._images: OrderedDict[str, tuple[bytes, float]] = OrderedDict()
+        self._image_bytes = 0
+        # 文件名 -> (文件大小, 生成时间)，按最近发送排序
+        self._files: OrderedDict[str, tuple[int, float]] = OrderedDict()
+        self._file_bytes = 0
+        self.evicted = 0
+        self.hits = 0
+        self.misses = 0
+        CardCache.instances[name] = self
+
+    @property
+    def ttl(self) -> int:
+        return algo_config.algo_card_cache_ttl
+
+    @staticmethod
+    def digest(*parts: Any) -> str:
+        """计算渲染输入的摘要"""
+        raw = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:24]
+
+    @staticmethod
+    def in_memory() -> bool:
+        return CardDelivery.mode() != "file"
+
+    def path_for(self, digest: str) -> Path:
+        return self.directory / f"{digest}.{Renderer.output_format()}"
+
+    def _load(self, digest: str) -> Path | bytes | None:
+        """取出有效期内的卡片：文件模式返回路径，内存模式返回图片字节"""
+        if self.in_memory():
+            entry = self._images.get(digest)
+            if entry is None or time.time() - entry[1] >= self.ttl:
+                return None
+            self._images.move_to_end(digest)
+            return entry[0]
+        path = self.path_for(digest)
+        try:
+            if time.time() - path.stat().st_mtime < self.ttl:
+                if path.name in self._files:
+                    self._files.move_to_end(path.name)
+                return path
+        except OSError:
+            pass
+        return None
+
+    async def save(self, digest: str, data: bytes) -> Path | bytes:
+        """保存新渲染的卡片，返回可直接发送的路径或图片字节"""
+        if not self.in_memory():
+            path = self.path_for(digest)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            await asyncio.to_thread(path.write_bytes, data)
+            self._track(path.name, len(data), time.time())
+            evicted = self._evict_files()
+            if evicted:
+                await asyncio.to_thread(Util.unlink_all, evicted)
+            return path
+        if self.ttl > 0:
+            old = self._images.pop(digest, None)
+            if old is not None:
+                self._image_bytes -= len(old[0])
+            self._images[digest] = (data, time.time())
+            self._image_bytes += len(data)
+            while self._image_bytes > MEMORY_LIMIT and len(self._images) > 1:
+                _, (evicted, _) = self._images.popitem(last=False)
+                self._image_bytes -= len(evicted)
+        return data
+
+    def lookup(self, key: Hashable) -> Path | bytes | None:
+        """按请求键查找仍在有效期内的卡片"""
+        if self.ttl <= 0:
+            return None
+        alias = self._aliases.get(key)
+        if alias is None:
+            return None
+        digest, expire_at = alias
+        card = self._load(digest) if expire_at >= time.time() else None
+        if card is None:
+            self._aliases.pop(key, None)
+            return None
+        self.hits += 1
+        return card
+
+    def get(self, digest: str) -> Path | bytes | None:
+        """按渲染输入摘要查找卡片，未命中计入 miss"""
+        card = self._load(digest) if self.ttl > 0 else None
+        if card is not None:
+            self.hits += 1
+            return card
+        self.misses += 1
+        return None
+
+    def put(self, key: Hashable, digest: str) -> None:
+        """记录请求键对应的卡片摘要"""
+        if self.ttl <= 0:
+            return
+        now = time.time()
+        if len(self._aliases) >= 1024:
+            self._aliases = {k: v for k, v in self._aliases.items() if v[1] > now}
+        self._aliases[key] = (digest, now + self.ttl)
+
+    def _track(self, name: str, size: int, created_at: float) -> None:
+        old = self._files.pop(name, None)
+        if old is not None:
+            self._file_bytes -= old[0]
+        self._files[name] = (size, created_at)
+        self._file_bytes += size
+
+    def _drop(self, name: str) -> Path:
+        size, _ = self._files.pop(name)
+        self._file_bytes -= size
+        self.evicted += 1
+        return self.directory / name
+
+    def _evict_files(self) -> list[Path]:
+        """目录超出大小上限时淘汰最久未发送的文件，刚写入的文件保留，返回待删除的文件"""
+        limit = algo_config.algo_card_dir_size * 1024 * 1024
+        evicted: list[Path] = []
+        while self._file_bytes > limit and len(self._files) > 1:
+            evicted.append(self._drop(next(iter(self._files))))
+        return evicted
+
+    def _scan(self) -> list[tuple[str, int, float]]:
+        """读取目录中已有的卡片，按修改时间排序"""
+        entries = []
+        if self.directory.exists():
+            for path in self.directory.iterdir():
+                if path.is_file():
+                    stat = path.stat()
+                    entries.append((path.name, stat.st_size, stat.st_mtime))
+        entries.sort(key=lambda entry: entry[2])
+        return entries
+
+    async def load_directory(self) -> None:
+        """启动时登记目录中已有的卡片，并按预算淘汰"""
+        entries = await asyncio.to_thread(self._scan)
+        known = self._files
+        self._files, self._file_bytes = OrderedDict(), 0
+        for name, size, created_at in entries:
+            self._track(name, size, created_at)
+        # 扫描期间新写入的卡片排在最后
+        for name, (size, created_at) in known.items():
+            self._track(name, size, created_at)
+        await self.sweep()
+
+    async def sweep(self) -> int:
+        """删除超过保留时间的卡片并按大小上限淘汰，返回删除数量"""
+        expire_before = time.time() - algo_config.algo_card_dir_max_age
+        evicted = [
+            self._drop(name)
+            for name, (_, created_at) in list(self._files.items())
+            if created_at < expire_before
+        ]
+        evicted += self._evict_files()
+        if evicted:
+            await asyncio.to_thread(Util.unlink_all, evicted)
+        return len(evicted)
+
+    def clear(self) -> None:
+        self._aliases.clear()
+        self._images.clear()
+        self._image_bytes = 0
+
+    async def purge(self) -> int:
+        """清空全部卡片，包括目录中的文件，返回删除的文件数"""
+        self.clear()
+        entries = await asyncio.to_thread(self._scan)
+        self._files.clear()
+        self._file_bytes = 0
+        paths = [self.directory / name for name, _, _ in entries]
+        await asyncio.to_thread(Util.unlink_all, paths)
+
+        return len(entries)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "ratio": self.hits / total if total else 0.0,
+            "aliases": len(self._aliases),
+            "memory_bytes": self._image_bytes,
+            "files": len(self._files),
+            "file_bytes": self._file_bytes,
+            "evicted": self.evicted,
+        }
+
+
+driver = get_driver()
+
+
+@driver.on_startup
+async def load_card_directories():
+    for cache in CardCache.instances.values():
+        await cache.load_directory()
@@ -1,4 +1,6 @@
-from nonebot import require, get_driver
+import asyncio
+from datetime import datetime
+from nonebot import require, get_driver, on_notice
 require("nonebot_plugin_alconna")
 require("nonebot_plugin_localstore")
 require("nonebot_plugin_apscheduler")
@@ -6,14 +8,32 @@ require("nonebot_plugin_uninfo")
 from arclet.alconna import Arparma
 from nonebot_plugin_alconna import Alconna, Args, Option, on_alconna, UniMessage
 from nonebot_plugin_uninfo import Uninfo
-from nonebot.adapters.onebot.v11 import Event, GroupMessageEvent, PrivateMessageEvent
+from nonebot.adapters.onebot.v11 import (
+    Bot,
+    Event,
+    GroupMessageEvent,
+    PrivateMessageEvent,
+    GroupDecreaseNoticeEvent,
+)
 from nonebot.log import logger
+from nonebot.permission import SUPERUSER
 from .config import algo_config
 from .query import Query as ContestQuery
 from .subscribe import Subscribe
 from .oj.luogu import Luogu
 from .oj.cf import Codeforces
-from .scheduler import cleanup_luogu_cards, cleanup_cf_cards
+from .render import Renderer
+from .cache import CardCache
+from .delivery import CardDelivery
+from .singleflight import SingleFlight
+from .http_client import HttpClients
+from .image_cache import RemoteImageCache
+from .subscribe_store import SubscribeManager
+from .outbox import Outbox
+from .binding import BindingRegistry
+from .oj.cf.ratings import RatingWatcher
+from .util import ContestIndex
+from .ratelimit import TokenBucket
 
 # 查询今日比赛
 query_today_contest = on_alconna(
@@ -126,6 +146,13 @@ my_cf = on_alconna(
     block=True,
 )
 
+cf_rank = on_alconna(
+    Alconna("cf排行"),
+    aliases={"cf排名"},
+    priority=5,
+    block=True,
+)
+
 clear_cards = on_alconna(
     Alconna("清空卡片"),
     aliases={"清理卡片"},
@@ -133,18 +160,147 @@ clear_cards = on_alconna(
     block=True,
 )
 
+# 运行状态（仅超级用户）
+algo_status = on_alconna(
+    Alconna("algo状态"),
+    permission=SUPERUSER,
+    priority=5,
+    block=True,
+)
+
+# 退群时更新绑定的群成员索引
+group_decrease = on_notice(priority=5, block=False)
+
+@group_decrease.handle()
+async def handle_group_decrease(event: GroupDecreaseNoticeEvent):
+    """成员退群时移出群成员索引，Bot 自己退群时清空该群"""
+    if event.user_id == event.self_id:
+        await BindingRegistry.forget_group(str(event.group_id))
+        return
+    for registry in BindingRegistry.instances.values():
+        await registry.leave(str(event.user_id), str(event.group_id))
+
+@algo_status.handle()
+async def handle_algo_status():
+    """查看渲染队列等运行状态"""
+    render = Renderer.stats()
+    msg = (
+        "🖼渲染服务\n"
+        f"状态: {'运行中' if render['running'] else '未启动'}"
+        f" (第{render['generation']}代)\n"
+
+        f"页面池: {render['idle']}/{render['pool_size']} 空闲\n"
+        f"排队: {render['waiting']}/{render['queue_size']}\n"
+        f"已渲染: {render['rendered']} 已拒绝: {render['rejected']}"
+        f" 超时: {render['timeouts']}\n"
+
+        f"已拦截外部请求: {render['blocked']}\n"
+        f"排队耗时: 平均 {render['avg_wait']:.2f}s 最长 {render['max_wait']:.2f}s"
+    )
+    if render["stages"]:
+        msg += "\n渲染阶段: " + " ".join(
+            f"{name} {cost * 1000:.0f}ms" for name, cost in render["stages"].items()
+        )
+    for name, cache in CardCache.instances.items():
+        stats = cache.stats()
+        msg += (
+            f"\n\n🗂卡片缓存({name})\n"
+            f"命中: {stats['hits']} 未命中: {stats['misses']}"
+            f" 命中率: {stats['ratio']:.0%}"
+
+        )
+        if stats["memory_bytes"]:
+            msg += f"\n内存占用: {stats['memory_bytes'] / 1024 / 1024:.1f} MiB"
+        if stats["files"]:
+            msg += (
+                f"\n磁盘占用: {stats['file_bytes'] / 1024 / 1024:.1f}"
+                f"/{algo_config.algo_card_dir_size} MiB ({stats['files']} 张)"
+                f" 已淘汰: {stats['evicted']}"
+
+            )
+    subs = SubscribeManager.stats()
+    msg += (
+        "\n\n🔔订阅\n"
+        f"会话: {subs['chats']} 订阅: {subs['subscribes']}\n"
+        f"待写入: {subs['dirty']} 已批量写入: {subs['flushes']} 次"
+    )
+    outbox, queued = Outbox.stats(), await Outbox.counts()
+    msg += (
+        "\n\n📮发件箱\n"
+        f"待发送: {queued.get('pending', 0)} 发送中: {outbox['sending']}\n"
+        f"已送达: {outbox['sent']} 重试: {outbox['retried']} 放弃: {outbox['failed']}\n"
+        f"中断续发: {outbox['resumed']}\n"
+        f"送达耗时: 平均 {outbox['avg_latency']:.1f}s 最长 {outbox['max_latency']:.1f}s"
+    )
+    ratings = RatingWatcher.stats()
+    msg += (
+        "\n\n📈CF rating 通知\n"
+        f"监听比赛: {ratings['watching']} 已通知: {ratings['notified']} 个群次"
+    )
+    msg += "\n\n👥账号绑定"
+    for name, registry in BindingRegistry.instances.items():
+        stats = registry.stats()
+        msg += (
+            f"\n{name}: 用户 {stats['users']} 账号 {stats['accounts']}"
+            f" 群 {stats['groups']}"
+        )
+    images = RemoteImageCache.stats()
+    msg += (
+        "\n\n🧩远程图片缓存\n"
+        f"图片: {images['entries']} 张 {images['bytes'] / 1024 / 1024:.1f} MiB\n"
+        f"命中: {images['hits']} 重新验证: {images['revalidated']}"
+        f" 下载: {images['downloads']}"
+
+    )
+    msg += "\n\n🔀请求合并"
+    for name, flight in SingleFlight.instances.items():
+        stats = flight.stats()
+        msg += (
+            f"\n{name}: 执行 {stats['executed']} 合并 {stats['shared']}"
+            f" 进行中 {stats['in_flight']}"
+        )
+
+    msg += "\n\n🔗HTTP 连接池"
+    for host, stats in HttpClients.stats().items():
+        msg += (
+            f"\n{host}: 连接 {stats['connections']}"
+            f" (活跃 {stats['active']} 空闲 {stats['idle']})"
+        )
+
+    for name, bucket in TokenBucket.instances.items():
+        stats = bucket.stats()
+        msg += (
+            f"\n\n⏳限流({name})\n"
+            f"已放行: {stats['acquired']} 排队: {stats['waiting']}\n"
+            f"等待: 平均 {stats['avg_wait']:.2f}s 最长 {stats['max_wait']:.2f}s"
+        )
+    index = ContestIndex.stats()
+    updated = (
+        datetime.fromtimestamp(index["updated_at"]).strftime("%m-%d %H:%M")
+        if index["updated_at"] else "未加载"
+    )
+    stale = " (已过期)" if index["stale"] else ""
+    msg += (
+        "\n\n📅比赛索引\n"
+        f"比赛数: {index['contests']} 更新于: {updated}{stale}"
+    )
+
+    await algo_status.finish(msg)
+
 @clear_cards.handle()
 async def handle_clear_cards():
     """清空所有卡片缓存"""
-    await cleanup_luogu_cards()
-    await cleanup_cf_cards()
+    for cache in CardCache.instances.values():
+        removed = await cache.purge()
+        logger.info(f"已清空卡片缓存({cache.name})，删除 {removed} 个文件")
     await clear_cards.finish("已清空所有卡片缓存")
 
 @bind_cf.handle()
 async def handle_bind_cf(session: Uninfo, handle: str):
     """绑定 CF 用户"""
     user_qq = session.user.id
-    result = await Codeforces.bind_cf_user(str(user_qq), handle)
+    group_id = session.group.id if session.group else None
+    result = await Codeforces.bind_cf_user(str(user_qq), handle, group_id)
     if isinstance(result, str):
         await bind_cf.finish(result, reply_to=True)
     if result:
@@ -156,12 +312,15 @@ async def handle_bind_cf(session: Uninfo, handle: str):
 async def handle_my_cf(session: Uninfo, params: Arparma):
     """查询自己的 CF 信息"""
     user_qq = session.user.id
+    group_id = session.group.id if session.group else None
+    await Codeforces.bindings.join(str(user_qq), group_id)
+
     card = await Codeforces.build_bind_user_info(str(user_qq), full=params.find("f"))
     if isinstance(card, str):
         await UniMessage(card).finish(reply_to=True)
     if card is None:
         await UniMessage("你还未绑定 CF 账号捏~\n发送「绑定cf <handle>」来绑定吧~").finish(reply_to=True)
-    await UniMessage.image(path=card).finish(reply_to=True)
+    await CardDelivery.image(card).finish(reply_to=True)
 
 @cf_info.handle()
 async def handle_cf_info(handle: str, params: Arparma):
@@ -171,13 +330,29 @@ async def handle_cf_info(handle: str, params: Arparma):
         await cf_info.finish(card)
     if card is None:
         await cf_info.finish(f"用户 {handle} 不存在或网络请求失败捏~")
-    await UniMessage.image(path=card).finish()
+    await CardDelivery.image(card).finish()
+
+@cf_rank.handle()
+async def handle_cf_rank(bot: Bot, session: Uninfo):
+    """查询本群已绑定用户的 CF rating 排行"""
+    if session.group is None:
+        await cf_rank.finish("请在群聊中使用 cf排行 捏~")
+    card = await Codeforces.build_group_rank(session.group.id, bot)
+    if isinstance(card, str):
+        await cf_rank.finish(card)
+    if card is None:
+        await cf_rank.finish(
+            "本群还没有绑定 CF 的成员捏~\n发送「bindcf <handle>」即可加入排行"
+        )
+
+    await CardDelivery.image(card).finish()
 
 @bind_luogu.handle()
 async def handle_bind_luogu(session:Uninfo,user: str| int):
     """绑定洛谷用户"""
     user_qq = session.user.id
-    if await Luogu.bind_luogu_user(user_qq,user):
+    group_id = session.group.id if session.group else None
+    if await Luogu.bind_luogu_user(user_qq,user,group_id):
         await bind_luogu.finish("绑定成功!",reply_to=True)
     else:
         await bind_luogu.finish("绑定失败!",reply_to=True)
@@ -186,18 +361,23 @@ async def handle_bind_luogu(session:Uninfo,user: str| int):
 async def handle_my_luogu(session:Uninfo, params: Arparma):
     """查询自己的洛谷信息"""
     user_qq = session.user.id
+    await Luogu.bindings.join(user_qq, session.group.id if session.group else None)
     card = await Luogu.build_bind_user_info(user_qq, full=params.find("f"))
+    if isinstance(card, str):
+        await UniMessage(card).finish(reply_to=True)
     if card is None:
         await UniMessage("你还未绑定洛谷账号捏~").finish(reply_to=True)
-    await UniMessage.image(path=card).finish(reply_to=True)
+    await CardDelivery.image(card).finish(reply_to=True)
 
 @luogu_info.handle()
 async def handle_luogu_info(user: str| int, params: Arparma):
     """查询指定用户洛谷信息"""
     card = await Luogu.build_user_info(user, full=params.find("f"))
+    if isinstance(card, str):
+        await luogu_info.finish(card)
     if card is None:
         await luogu_info.finish("该用户不存在或未通过实名认证捏~")
-    await UniMessage.image(path=card).finish()
+    await CardDelivery.image(card).finish()
 
 @query_today_contest.handle()
 async def handle_today_match():
@@ -284,15 +464,21 @@ async def handle_clear_subscribes(event: Event):
         await clear_subscribes.finish(str(e))
 
 # Bot 启动时恢复定时任务
-@get_driver().on_startup
-async def restore_scheduled_jobs():
-    """Bot启动时恢复所有定时任务"""
+_restore_task: asyncio.Task | None = None
+
+async def _restore_jobs():
     try:
         restored_count = await Subscribe.restore_scheduled_jobs()
         logger.info(f"AlgoHelper启动完成，恢复了 {restored_count} 个定时任务")
     except Exception as e:
         logger.error(f"恢复定时任务失败: {e}")
 
+@get_driver().on_startup
+async def restore_scheduled_jobs():
+    """Bot启动时在后台恢复定时任务，不阻塞启动"""
+    global _restore_task
+    _restore_task = asyncio.create_task(_restore_jobs())
+
 def parse_event_info(event: Event) -> tuple[str, str]:
     """解析事件信息，返回group_id和user_id"""
     if isinstance(event, GroupMessageEvent):
@@ -16,8 +16,61 @@ class AlgoConfig(BaseModel):
     algo_limit: int =20
     # 提醒提前时间
     algo_remind_pre: int = 30
+    # 提前注册提醒任务的时间窗口（小时），窗口外的订阅每 30 分钟补充一次
+    algo_remind_window: int = 12
+    # 主动消息（比赛提醒等）同时发送的会话数
+    algo_send_concurrency: int = 5
+    # 每个 Bot 每秒最多发送的主动消息数
+    algo_send_bot_rate: float = 1
+    # 同一会话两条主动消息的最小间隔（秒）
+    algo_send_target_interval: float = 3
+    # 主动消息发送失败后的最大尝试次数
+    algo_send_max_attempts: int = 5
+    # CF 比赛结束后向群推送已绑定成员的 rating 变化（依赖比赛索引）
+    algo_cf_rating_notify: bool = True
     # 排序字段
     algo_order_by: str = "start"
+    # 比赛索引刷新间隔（分钟），0 为关闭索引、每次实时查询
+    algo_contest_refresh: int = 30
+    # 比赛索引覆盖的天数
+    algo_contest_index_days: int = 14
+    # 卡片渲染页面池大小（同时渲染的卡片数）
+    algo_render_pool_size: int = 2
+    # 渲染排队上限，超出后直接拒绝
+    algo_render_queue_size: int = 8
+    # 单张卡片渲染超时（秒），超时的页面会被关闭
+    algo_render_timeout: float = 15
+    # 卡片缓存有效期（秒），0 为不缓存
+    algo_card_cache_ttl: int = 600
+    # 每个卡片目录的大小上限（MiB），超出时淘汰最久未发送的卡片
+    algo_card_dir_size: int = 128
+    # 卡片文件最长保留时间（秒）
+    algo_card_dir_max_age: int = 86400
+    # 卡片图片格式：png / jpeg / webp（webp 需安装 Pillow）
+    algo_card_format: str = "png"
+    # jpeg / webp 的压缩质量（1-100）
+    algo_card_quality: int = 85
+    # 完整卡片与简略卡片的缩放倍数
+    algo_full_card_scale: float = 2
+    algo_sample_card_scale: float = 2
+    # 对 png 卡片做 256 色调色板量化（需安装 Pillow）
+    algo_card_quantize: bool = False
+    # 卡片发送方式：file / memory / url
+    algo_card_delivery: str = "file"
+    # url 模式下 OneBot 实现访问 Bot 的地址，默认使用 NoneBot 的 HOST 与 PORT
+    algo_card_base_url: str = ""
+    # 远程图片（头像、主页背景）缓存有效期（秒），过期后重新验证
+    algo_image_cache_ttl: int = 21600
+    # 远程图片缓存总大小上限（MiB）
+    algo_image_cache_size: int = 64
+    # 按文件修改时间自动重新加载模板与静态资源（调试模板时开启）
+    algo_asset_reload: bool = False
+    # 是否启用 HTTP/2（需安装 httpx[http2]）
+    algo_http2: bool = False
+    # 每个上游主机的最大连接数
+    algo_http_max_connections: int = 10
+    # 空闲连接保持时间（秒）
+    algo_http_keepalive: float = 30
     
 
     @property
@@ -32,10 +85,12 @@ class AlgoConfig(BaseModel):
 
 # 获取插件存储
 plugin_data_dir: Path = store.get_plugin_data_dir()
+plugin_cache_dir: Path = store.get_plugin_cache_dir()
 
 algo_config:AlgoConfig = get_plugin_config(AlgoConfig)
 
 subscribe_save_path: Path = plugin_data_dir / "subscribes.json"
+subscribe_db_path: Path = plugin_data_dir / "subscribes.db"
 luogu_save_path: Path = plugin_data_dir / "luogu"
 cf_save_path: Path = plugin_data_dir / "codeforces"
 
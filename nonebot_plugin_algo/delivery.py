@@ -0,0 +1,127 @@
+import time
+import hashlib
+import ipaddress
+from collections import OrderedDict
+from pathlib import Path
+
+from nonebot import get_driver
+from nonebot.drivers import URL, HTTPServerSetup, Request, Response, ReverseDriver
+from nonebot.log import logger
+from nonebot_plugin_alconna import UniMessage
+
+from .config import algo_config
+from .render import Renderer
+
+DELIVERY_MODES = ("file", "memory", "url")
+CARD_ROUTE = "/algo/card"
+# url 模式下卡片链接的有效期（秒）
+URL_TTL = 600
+# url 模式下同时保留的卡片数
+URL_LIMIT = 128
+
+
+class CardDelivery:
+    """卡片发送方式
+
+    file: 卡片保存在本地目录，按路径发送；
+    memory: 卡片只保存在内存，图片字节直接放入消息段；
+    url: 卡片由 NoneBot 驱动器上的 HTTP 路由提供，OneBot 实现按链接拉取，
+    适合 OneBot 实现与 Bot 不在同一台机器的部署。
+    """
+
+    # 卡片 id -> (图片字节, MIME, 过期时间)
+    _served: OrderedDict[str, tuple[bytes, str, float]] = OrderedDict()
+    _mode: str | None = None
+
+    @classmethod
+    def mode(cls) -> str:
+        """实际使用的发送方式，配置无效或驱动器不支持 HTTP 服务时回退"""
+        if cls._mode is None:
+            mode = algo_config.algo_card_delivery.lower()
+            if mode not in DELIVERY_MODES:
+                logger.warning(
+                    f"不支持的卡片发送方式 {algo_config.algo_card_delivery}，"
+                    "已回退到 file"
+                )
+                mode = "file"
+            elif mode == "url" and not isinstance(get_driver(), ReverseDriver):
+                logger.warning("当前驱动器不支持 HTTP 服务，卡片发送方式已回退到 memory")
+                mode = "memory"
+            cls._mode = mode
+        return cls._mode
+
+    @staticmethod
+    def base_url() -> str:
+        if algo_config.algo_card_base_url:
+            return algo_config.algo_card_base_url.rstrip("/")
+        config = get_driver().config
+        host = str(config.host)
+        if host in ("0.0.0.0", "::"):
+            host = "127.0.0.1"
+        return f"http://{host}:{config.port}"
+
+    @classmethod
+    def check_base_url(cls) -> None:
+        """url 模式下只能推导出本机地址时提醒配置 algo_card_base_url"""
+        if algo_config.algo_card_base_url:
+            return
+        host = str(get_driver().config.host)
+        try:
+            loopback = host == "localhost" or ipaddress.ip_address(host).is_loopback
+        except ValueError:
+            loopback = False
+        if loopback or host in ("0.0.0.0", "::"):
+            logger.warning(
+                "卡片发送方式为 url 但未配置 algo_card_base_url，"
+                f"卡片链接将使用 {cls.base_url()}，OneBot 实现不在本机时无法访问，"
+                "请配置 Bot 的外部可访问地址"
+            )
+
+    @classmethod
+    def publish(cls, data: bytes) -> str:
+        """登记卡片并返回可供 OneBot 实现拉取的链接"""
+        card_id = hashlib.sha1(data).hexdigest()[:24]
+        now = time.time()
+        cls._served[card_id] = (data, Renderer.mimetype(), now + URL_TTL)
+        cls._served.move_to_end(card_id)
+        while cls._served and (
+            len(cls._served) > URL_LIMIT or next(iter(cls._served.values()))[2] < now
+        ):
+            cls._served.popitem(last=False)
+        return f"{cls.base_url()}{CARD_ROUTE}?id={card_id}"
+
+    @classmethod
+    def image(cls, card: Path | bytes) -> UniMessage:
+        """按发送方式构造卡片图片消息"""
+        if isinstance(card, Path):
+            return UniMessage.image(path=card)
+        if cls.mode() == "url":
+            return UniMessage.image(url=cls.publish(card))
+        return UniMessage.image(raw=card, mimetype=Renderer.mimetype())
+
+    @classmethod
+    async def handle_request(cls, request: Request) -> Response:
+        card_id = request.url.query.get("id", "")
+        entry = cls._served.get(card_id)
+        if entry is None or entry[2] < time.time():
+            return Response(404, content="card not found")
+        data, mimetype, _ = entry
+        return Response(
+            200,
+            headers={"Content-Type": mimetype, "Cache-Control": f"max-age={URL_TTL}"},
+            content=data,
+        )
+
+
+driver = get_driver()
+
+if CardDelivery.mode() == "url":
+    driver.setup_http_server(
+        HTTPServerSetup(
+            path=URL(CARD_ROUTE),
+            method="GET",
+            name="algo_card",
+            handle_func=CardDelivery.handle_request,
+        )
+    )
+    CardDelivery.check_base_url()
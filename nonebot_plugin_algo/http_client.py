@@ -0,0 +1,102 @@
+from importlib.util import find_spec
+
+import httpx
+from nonebot import get_driver
+from nonebot.log import logger
+
+from .config import algo_config
+
+# 启动时预先建立客户端的上游
+UPSTREAMS = (
+    "https://clist.by",
+    "https://codeforces.com",
+    "https://www.luogu.com.cn",
+)
+
+
+class HttpClients:
+    """按上游主机复用的 httpx.AsyncClient
+
+    每个主机一个长连接客户端，连接数与 keep-alive 由配置控制，
+    Bot 关闭时统一释放。
+    """
+
+    _clients: dict[str, httpx.AsyncClient] = {}
+    _http2: bool | None = None
+
+    @classmethod
+    def _use_http2(cls) -> bool:
+        if cls._http2 is None:
+            cls._http2 = algo_config.algo_http2
+            if cls._http2 and find_spec("h2") is None:
+                logger.warning("未安装 h2，已回退到 HTTP/1.1 (pip install httpx[http2])")
+                cls._http2 = False
+        return cls._http2
+
+    @classmethod
+    def _create(cls) -> httpx.AsyncClient:
+        limits = httpx.Limits(
+            max_connections=algo_config.algo_http_max_connections,
+            max_keepalive_connections=algo_config.algo_http_max_connections,
+            keepalive_expiry=algo_config.algo_http_keepalive,
+        )
+        return httpx.AsyncClient(
+            http2=cls._use_http2(),
+            limits=limits,
+            timeout=httpx.Timeout(10.0),
+        )
+
+    @classmethod
+    def get(cls, url: str) -> httpx.AsyncClient:
+        """获取目标 URL 所在主机的共享客户端"""
+        host = httpx.URL(url).host
+        client = cls._clients.get(host)
+        if client is None or client.is_closed:
+            client = cls._create()
+            cls._clients[host] = client
+        return client
+
+    @classmethod
+    async def start(cls) -> None:
+        for url in UPSTREAMS:
+            cls.get(url)
+        logger.info(f"HTTP 连接池已就绪 (HTTP/2: {cls._use_http2()})")
+
+    @classmethod
+    async def close(cls) -> None:
+        clients, cls._clients = cls._clients, {}
+        for client in clients.values():
+            try:
+                await client.aclose()
+            except Exception as e:
+                logger.warning(f"关闭 HTTP 客户端失败: {e}")
+
+    @classmethod
+    def stats(cls) -> dict[str, dict]:
+        """各主机连接池状态"""
+        result: dict[str, dict] = {}
+        for host, client in cls._clients.items():
+            # httpx 未公开连接池，读取 httpcore 连接池的内部状态
+            pool = getattr(getattr(client, "_transport", None), "_pool", None)
+            connections = list(getattr(pool, "connections", []) or [])
+            idle = sum(1 for conn in connections if conn.is_idle())
+            result[host] = {
+                "connections": len(connections),
+                "idle": idle,
+                "active": len(connections) - idle,
+                "closed": client.is_closed,
+            }
+        return result
+
+
+driver = get_driver()
+
+
+@driver.on_startup
+async def start_http_clients():
+    await HttpClients.start()
+
+
+@driver.on_shutdown
+async def close_http_clients():
+    await HttpClients.close()
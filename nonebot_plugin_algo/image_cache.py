@@ -0,0 +1,206 @@
+import json
+import time
+import asyncio
+import hashlib
+from pathlib import Path
+
+import httpx
+from nonebot import get_driver
+from nonebot.log import logger
+
+from .config import algo_config, plugin_cache_dir
+from .http_client import HttpClients
+from .singleflight import SingleFlight
+from .util import Util
+
+IMAGE_CACHE_DIR = plugin_cache_dir / "images"
+INDEX_PATH = IMAGE_CACHE_DIR / "index.json"
+
+
+class RemoteImageCache:
+    """远程图片（头像、主页背景）磁盘缓存
+
+    以 URL 为键保存图片内容及其 ETag / Last-Modified。有效期内直接使用本地副本；
+    过期后发送条件请求重新验证，未变化时只刷新检查时间。
+    总大小超过 algo_image_cache_size 时按最近使用时间淘汰，下载失败时用过期副本兜底。
+    """
+
+    # 摘要 -> {url, mime, size, etag, last_modified, checked_at, used_at}
+    _index: dict[str, dict] | None = None
+    _index_lock = asyncio.Lock()
+    _flight = SingleFlight("remote-image")
+    hits = 0
+    revalidated = 0
+    downloads = 0
+
+    @staticmethod
+    def key(url: str) -> str:
+        return hashlib.sha1(url.encode("utf-8")).hexdigest()[:20]
+
+    @staticmethod
+    def _read_index() -> dict[str, dict]:
+        index: dict[str, dict] = {}
+        try:
+            with open(INDEX_PATH, "r", encoding="utf-8") as f:
+                index = json.load(f)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.warning(f"读取远程图片缓存索引失败，将重新下载: {e}")
+        index = {k: v for k, v in index.items() if (IMAGE_CACHE_DIR / k).exists()}
+        if IMAGE_CACHE_DIR.exists():
+            # 不在索引中的图片不计入容量，也不会被淘汰，直接删除
+            Util.unlink_all([
+                path for path in IMAGE_CACHE_DIR.iterdir()
+                if path.is_file() and path.name not in index and path != INDEX_PATH
+            ])
+        return index
+
+    @classmethod
+    async def load_index(cls) -> dict[str, dict]:
+        """读取磁盘上的索引，只执行一次；并发的调用等待同一次读取，不会互相覆盖"""
+        if cls._index is None:
+            async with cls._index_lock:
+                if cls._index is None:
+                    cls._index = await asyncio.to_thread(cls._read_index)
+        return cls._index
+
+    @classmethod
+    async def save_index(cls) -> None:
+        if cls._index is None:
+            return
+        raw = json.dumps(cls._index, ensure_ascii=False)
+        await asyncio.to_thread(Util.write_atomic, INDEX_PATH, raw)
+
+    @classmethod
+    def touch(cls, url: str) -> bool:
+        """图片仍在有效期内时记一次命中并返回 True，供已在内存中的图片跳过磁盘读取"""
+        if cls._index is None:
+            return False
+        entry = cls._index.get(cls.key(url))
+        now = time.time()
+        if entry is None or now - entry["checked_at"] >= algo_config.algo_image_cache_ttl:
+            return False
+        entry["used_at"] = now
+        cls.hits += 1
+        return True
+
+    @classmethod
+    async def get(cls, url: str) -> tuple[bytes, str] | None:
+        """取得图片内容与 MIME，并发的相同 URL 只下载一次"""
+        return await cls._flight.do(cls.key(url), lambda: cls._get(url))
+
+    @staticmethod
+    def _read(path: Path) -> bytes | None:
+        try:
+            return path.read_bytes()
+        except OSError:
+            return None
+
+    @classmethod
+    async def _get(cls, url: str) -> tuple[bytes, str] | None:
+        index = await cls.load_index()
+        key = cls.key(url)
+        path = IMAGE_CACHE_DIR / key
+        entry = index.get(key)
+        cached = await asyncio.to_thread(cls._read, path) if entry is not None else None
+        if entry is not None and cached is None:
+            index.pop(key, None)
+            entry = None
+
+        now = time.time()
+        ttl = algo_config.algo_image_cache_ttl
+        if entry is not None and now - entry["checked_at"] < ttl:
+            entry["used_at"] = now
+            cls.hits += 1
+            return cached, entry["mime"]
+
+        headers = {}
+        if entry is not None:
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+        try:
+            response = await HttpClients.get(url).get(
+                url, headers=headers, timeout=httpx.Timeout(10.0), follow_redirects=True
+            )
+            if response.status_code == 304 and entry is not None:
+                cls.revalidated += 1
+                entry["checked_at"] = entry["used_at"] = now
+                await cls.save_index()
+                return cached, entry["mime"]
+            response.raise_for_status()
+        except httpx.HTTPError as e:
+            if entry is not None:
+                logger.warning(
+                    f"远程图片重新验证失败，使用本地副本: {url}"
+                    f" ({type(e).__name__}: {e!r})"
+
+                )
+
+                return cached, entry["mime"]
+            logger.warning(f"读取远程图片失败: {url} ({type(e).__name__}: {e!r})")
+            return None
+
+        content = response.content
+        mime = response.headers.get("content-type", "image/png").split(";")[0]
+        cls.downloads += 1
+        IMAGE_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        await asyncio.to_thread(path.write_bytes, content)
+        index[key] = {
+            "url": url,
+            "mime": mime,
+            "size": len(content),
+            "etag": response.headers.get("etag"),
+            "last_modified": response.headers.get("last-modified"),
+            "checked_at": now,
+            "used_at": now,
+        }
+        evicted = cls._evict(key)
+        if evicted:
+            await asyncio.to_thread(Util.unlink_all, evicted)
+        await cls.save_index()
+        return content, mime
+
+    @classmethod
+    def _evict(cls, keep: str) -> list[Path]:
+        """总大小超过上限时按最近使用时间淘汰，刚写入的图片保留，返回待删除的文件"""
+        index = cls._index or {}
+        limit = algo_config.algo_image_cache_size * 1024 * 1024
+        total = sum(entry["size"] for entry in index.values())
+        evicted: list[Path] = []
+        for key, entry in sorted(index.items(), key=lambda item: item[1]["used_at"]):
+            if total <= limit:
+                break
+            if key == keep:
+                continue
+            index.pop(key, None)
+            evicted.append(IMAGE_CACHE_DIR / key)
+            total -= entry["size"]
+        return evicted
+
+    @classmethod
+    def stats(cls) -> dict:
+        index = cls._index or {}
+        return {
+            "entries": len(index),
+            "bytes": sum(entry["size"] for entry in index.values()),
+            "hits": cls.hits,
+            "revalidated": cls.revalidated,
+            "downloads": cls.downloads,
+        }
+
+
+driver = get_driver()
+
+
+@driver.on_startup
+async def load_image_index():
+    await RemoteImageCache.load_index()
+
+
+@driver.on_shutdown
+async def save_image_index():
+    # 命中只更新内存中的使用时间，关闭时统一落盘
+    await RemoteImageCache.save_index()
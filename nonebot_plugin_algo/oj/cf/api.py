@@ -1,18 +1,41 @@
-import json
+import random
 import asyncio
-from pathlib import Path
 from typing import Dict
 
 import httpx
 from nonebot.log import logger
 
 from ...config import cf_save_path
+from ...singleflight import SingleFlight
+from ...http_client import HttpClients
+from ...binding import BindingRegistry
+from ...ratelimit import TokenBucket
+from .submissions import SubmissionStore
 
 users_save_path = cf_save_path / "users.json"
 RATE_LIMIT_MESSAGE = "请求频繁,请稍候"
+UNAVAILABLE_MESSAGE = "Codeforces 连接失败,请稍后再试"
 
+# 提交记录增量同步每页拉取数与最大翻页数，超过后改为全量同步
+SYNC_PAGE_SIZE = 100
+SYNC_MAX_PAGES = 20
+# 全量同步拉取的提交数
+FULL_COUNT = 10000
+# 批量 user.info 中 handles 参数的最大长度（编码后），避免 URL 超出上游限制
+BATCH_HANDLES_LENGTH = 1800
+# 网络错误的重试间隔：RETRY_BASE * 2^(次数-1)，带随机抖动
+RETRY_BASE = 1.0
 
-class CodeforcesRateLimitError(Exception):
+
+class CodeforcesAPIError(Exception):
+    """CF API 重试后仍失败，异常信息可直接回复给用户"""
+
+
+class CodeforcesRateLimitError(CodeforcesAPIError):
+    pass
+
+
+class CodeforcesUnavailableError(CodeforcesAPIError):
     pass
 
 
@@ -21,17 +44,30 @@ class CodeforcesAPI:
         "user-agent": "nonebot-plugin-algo/0.2.7",
     }
     base_url = "https://codeforces.com/api"
-    _request_lock = asyncio.Lock()
+    # Codeforces 要求约每 2 秒 1 次请求，允许少量突发
+    _rate_limiter = TokenBucket("codeforces", rate=0.5, capacity=3)
+    _user_flight = SingleFlight("codeforces-user")
+    bindings = BindingRegistry("codeforces", users_save_path)
 
     @classmethod
-    async def request(cls, url: str, params: dict = None) -> Dict | None:
+    async def request(
+        cls, url: str, params: dict = None, background: bool = False
+    ) -> Dict | None:
+        """请求 CF API，所有请求共享令牌桶限流，后台任务让位于交互命令"""
+        priority = TokenBucket.BACKGROUND if background else TokenBucket.INTERACTIVE
         last_error = ""
         for attempt in range(1, 4):
+            rate_limited = False
             try:
-                async with cls._request_lock:
-                    timeout = httpx.Timeout(15.0)
-                    async with httpx.AsyncClient(timeout=timeout, follow_redirects=True) as client:
-                        response = await client.get(url, params=params)
+                wait = await cls._rate_limiter.acquire(priority)
+                if wait > 0:
+                    logger.debug(f"CF API 等待令牌 {wait:.2f}s: {url}")
+                response = await HttpClients.get(url).get(
+                    url,
+                    params=params,
+                    timeout=httpx.Timeout(15.0),
+                    follow_redirects=True,
+                )
 
                 response.raise_for_status()
                 data = response.json()
@@ -43,20 +79,34 @@ class CodeforcesAPI:
                     logger.error(f"CF API 返回错误: {comment}")
                     return None
                 last_error = comment
+                rate_limited = True
             except httpx.HTTPStatusError as e:
                 if e.response.status_code != 429:
                     logger.error(f"CF API 请求失败: {url} ({e.response.status_code})")
                     return None
                 last_error = f"HTTP {e.response.status_code}"
+                rate_limited = True
             except (httpx.HTTPError, ValueError) as e:
                 last_error = f"{type(e).__name__}: {e}"
 
+            if rate_limited:
+                # 被上游限流时清空令牌，后续请求按补充速率重新排队
+                cls._rate_limiter.drain()
             if attempt < 3:
-                logger.warning(f"CF API 请求频率受限，2 秒后重试({attempt}/3): {url}")
-                await asyncio.sleep(2)
+                logger.warning(
+                    f"CF API 请求失败，重新排队重试({attempt}/3): {url} ({last_error})"
+                )
+                if not rate_limited:
+                    # 网络错误时退避，避免三次重试连续耗尽令牌桶的突发额度
+                    delay = RETRY_BASE * 2 ** (attempt - 1)
+                    await asyncio.sleep(delay * random.uniform(0.5, 1.5))
+
 
-        logger.error(f"CF API 请求频繁，重试后仍失败: {url} ({last_error})")
-        raise CodeforcesRateLimitError(RATE_LIMIT_MESSAGE)
+        if rate_limited:
+            logger.error(f"CF API 请求频繁，重试后仍失败: {url} ({last_error})")
+            raise CodeforcesRateLimitError(RATE_LIMIT_MESSAGE)
+        logger.error(f"CF API 连接失败，重试后仍失败: {url} ({last_error})")
+        raise CodeforcesUnavailableError(UNAVAILABLE_MESSAGE)
 
     @staticmethod
     def _is_rate_limited(comment: str = "") -> bool:
@@ -64,53 +114,172 @@ class CodeforcesAPI:
         return "limit" in text or "too many" in text or "frequent" in text
 
     @classmethod
-    async def get_user_info(cls, handle: str, include_submissions: bool = True) -> Dict | None:
-        url = cls.base_url + "/user.info"
-        result = await cls.request(url, {"handles": handle})
+    async def get_user_basic(cls, handle: str) -> Dict | None:
+        """获取 user.info 基本信息，并发的相同查询只请求一次"""
+        return await cls._user_flight.do(
+            ("info", handle.lower()), lambda: cls._fetch_user_basic(handle)
+        )
+
+    @classmethod
+    async def _fetch_user_basic(cls, handle: str) -> Dict | None:
+        result = await cls.request(cls.base_url + "/user.info", {"handles": handle})
         if not result or not isinstance(result, list) or len(result) == 0:
             return None
-        user_data = result[0]
+        return result[0]
+
+    @staticmethod
+    def _chunk_handles(handles: list[str]) -> list[list[str]]:
+        """按编码后的长度把 handle 分组，分号编码为 %3B"""
+        chunks: list[list[str]] = []
+        chunk: list[str] = []
+        length = 0
+        for handle in handles:
+            cost = len(handle) + (3 if chunk else 0)
+            if chunk and length + cost > BATCH_HANDLES_LENGTH:
+                chunks.append(chunk)
+                chunk, length, cost = [], 0, len(handle)
+            chunk.append(handle)
+            length += cost
+        if chunk:
+            chunks.append(chunk)
+        return chunks
+
+    @classmethod
+    async def get_users_basic(
+        cls, handles: list[str], background: bool = False
+    ) -> Dict[str, Dict]:
+        """用分号分隔的 user.info 批量获取用户信息，返回 小写 handle -> 信息"""
+        chunks = cls._chunk_handles(handles)
+        results = await asyncio.gather(
+            *(cls._fetch_users_chunk(chunk, background) for chunk in chunks)
+        )
+        return {user["handle"].lower(): user for chunk in results for user in chunk}
+
+    @classmethod
+    async def _fetch_users_chunk(
+        cls, handles: list[str], background: bool
+    ) -> list[Dict]:
+        params = {"handles": ";".join(handles)}
+        result = await cls.request(
+            cls.base_url + "/user.info", params, background=background
+        )
+
+        if isinstance(result, list):
+            return result
+        if len(handles) == 1:
+            logger.warning(f"CF 用户不存在或查询失败: {handles[0]}")
+            return []
+        # 整批请求会因为一个 handle 不存在而失败，二分后分别重试
+        middle = len(handles) // 2
+        left = await cls._fetch_users_chunk(handles[:middle], background)
+        right = await cls._fetch_users_chunk(handles[middle:], background)
+        return left + right
+
+    @classmethod
+    async def get_user_info(cls, handle: str, include_submissions: bool = True) -> Dict | None:
+        """获取用户信息，并发的相同查询只请求一次"""
+        key = ("full", handle.lower(), include_submissions)
+        return await cls._user_flight.do(
+            key, lambda: cls._fetch_user_info(handle, include_submissions)
+        )
 
-        rating_result = await cls.request(cls.base_url + "/user.rating", {"handle": handle})
-        user_data["ratingHistory"] = rating_result if isinstance(rating_result, list) else []
+    @classmethod
+    async def _fetch_user_info(
+        cls, handle: str, include_submissions: bool
+    ) -> Dict | None:
+
+        basic = await cls.get_user_basic(handle)
+        if basic is None:
+            return None
+        user_data = dict(basic)
 
+        # user.info 之后 rating 与提交统计互不依赖，并发请求
+        requests = [cls.request(cls.base_url + "/user.rating", {"handle": handle})]
         if include_submissions:
-            status_result = await cls.request(
-                cls.base_url + "/user.status",
-                {"handle": handle, "from": 1, "count": 10000},
-            )
-            user_data["submissions"] = status_result if isinstance(status_result, list) else []
-        else:
-            user_data["submissions"] = []
+            requests.append(cls.sync_submissions(handle))
+        rating_result, *stats_results = await asyncio.gather(*requests)
+        if not isinstance(rating_result, list):
+            rating_result = []
+        user_data["ratingHistory"] = rating_result
+
+        user_data["submissionStats"] = stats_results[0] if stats_results else None
         return user_data
 
     @classmethod
-    async def bind_cf_user(cls, user_qq: str, handle: str) -> bool | str:
+    async def sync_submissions(cls, handle: str) -> Dict | None:
+        """增量同步提交记录并返回统计，并发的相同 handle 只同步一次"""
+        return await cls._user_flight.do(
+            ("submissions", handle.lower()), lambda: cls._sync_submissions(handle)
+        )
+
+    @classmethod
+    async def _sync_submissions(cls, handle: str) -> Dict | None:
+        state = await SubmissionStore.load(handle)
+        try:
+            submissions = None
+            if state is not None:
+                submissions = await cls._fetch_new_submissions(handle, state["watermark"])
+            if submissions is None:
+                # 首次同步或新提交过多，全量拉取并重建统计
+                submissions = await cls._fetch_submissions(handle, 1, FULL_COUNT)
+                state = None
+        except CodeforcesAPIError as e:
+            if state is None:
+                raise
+            logger.warning(f"CF 提交同步失败，使用本地统计: {handle} ({e})")
+            return SubmissionStore.summary(state)
+        except ValueError as e:
+            if state is None:
+                return None
+            logger.warning(f"CF 提交同步失败，使用本地统计: {handle} ({e})")
+            return SubmissionStore.summary(state)
+
+        if submissions or state is None:
+            state = await SubmissionStore.update(handle, state, submissions)
+        logger.debug(f"CF 提交同步完成: {handle} 新增 {len(submissions)} 条")
+        return SubmissionStore.summary(state)
+
+    @classmethod
+    async def _fetch_submissions(
+        cls, handle: str, start: int, count: int
+    ) -> list[Dict]:
+        params = {"handle": handle, "from": start, "count": count}
+        result = await cls.request(cls.base_url + "/user.status", params)
+        if not isinstance(result, list):
+            raise ValueError("user.status 返回异常")
+        return result
+
+    @classmethod
+    async def _fetch_new_submissions(
+        cls, handle: str, watermark: int
+    ) -> list[Dict] | None:
+        """从最新提交往回翻页直到 watermark，翻页过多时返回 None"""
+        fresh: list[Dict] = []
+        for page in range(SYNC_MAX_PAGES):
+            start = page * SYNC_PAGE_SIZE + 1
+            result = await cls._fetch_submissions(handle, start, SYNC_PAGE_SIZE)
+
+            new = [sub for sub in result if sub.get("id", 0) > watermark]
+            fresh.extend(new)
+            if len(new) < len(result) or len(result) < SYNC_PAGE_SIZE:
+                return fresh
+        return None
+
+    @classmethod
+    async def bind_cf_user(
+        cls, user_qq: str, handle: str, group_id: str | None = None
+    ) -> bool | str:
+
         try:
             user_info = await cls.get_user_info(handle)
-        except CodeforcesRateLimitError:
-            return RATE_LIMIT_MESSAGE
+        except CodeforcesAPIError as e:
+            return str(e)
         if user_info is None:
             return False
 
-        users = cls._load_bound_users()
-        users[user_qq] = handle
-        cls._save_bound_users(users)
+        await cls.bindings.bind(user_qq, handle, group_id)
         return True
 
     @classmethod
     def get_bound_handle(cls, user_qq: str) -> str | None:
-        return cls._load_bound_users().get(user_qq)
-
-    @staticmethod
-    def _load_bound_users() -> dict:
-        if not users_save_path.exists():
-            return {}
-        with open(users_save_path, "r", encoding="utf-8") as f:
-            return json.load(f)
-
-    @staticmethod
-    def _save_bound_users(users: dict) -> None:
-        users_save_path.parent.mkdir(parents=True, exist_ok=True)
-        with open(users_save_path, "w", encoding="utf-8") as f:
-            json.dump(users, f, ensure_ascii=False, indent=4)
+        return cls.bindings.get(user_qq)
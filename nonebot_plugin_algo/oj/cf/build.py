@@ -1,33 +1,40 @@
-import random
-import base64
-import httpx
+import asyncio
 from typing import Dict
+from nonebot.adapters import Bot
 from nonebot.log import logger
-from jinja2 import Template
-from ...config import cf_save_path, Mapper
-from .api import CodeforcesAPI, CodeforcesRateLimitError, RATE_LIMIT_MESSAGE
+from ...config import algo_config, cf_save_path, Mapper
+from .api import CodeforcesAPI, CodeforcesAPIError
+from ...render import Renderer, RenderQueueFullError, RENDER_BUSY_MESSAGE
+from ...cache import CardCache
+from ...binding import BindingRegistry
+from ...singleflight import SingleFlight
+from ...util import StageTimer, Util
+from ...resources import AssetRegistry
 from pathlib import Path
 import html
 from datetime import datetime, date, timedelta
-from uuid import uuid4
-
-ASSETS_PATH = Path(__file__).resolve().parents[2] / "assets"
-TEMPLATE_PATH = ASSETS_PATH / "template" / "cf_card.html"
-SAMPLE_TEMPLATE_PATH = ASSETS_PATH / "template" / "sample_card.html"
-FULL_STYLE_PATH = ASSETS_PATH / "template" / "full-style.css"
-SAMPLE_STYLE_PATH = ASSETS_PATH / "template" / "sample-style.css"
-LOGO_PATH = ASSETS_PATH / "cf.webp"
-BACKGROUND_DIR = ASSETS_PATH / "background"
-FONT_DIR = ASSETS_PATH / "fonts"
+
+TEMPLATE_NAME = "cf_card.html"
+SAMPLE_TEMPLATE_NAME = "sample_card.html"
+FULL_STYLE_NAME = "full-style.css"
+SAMPLE_STYLE_NAME = "sample-style.css"
+RANK_TEMPLATE_NAME = "cf_rank_card.html"
+RANK_STYLE_NAME = "rank-style.css"
+LOGO_NAME = "cf.webp"
 cards_save_path = cf_save_path / "cards"
 
 DEFAULT_WIDTH = 1440
 DEFAULT_HEIGHT = 900
 
+card_cache = CardCache("codeforces", cards_save_path)
+card_flight = SingleFlight("codeforces-card")
+
 
 class Codeforces(CodeforcesAPI):
     @classmethod
-    async def build_bind_user_info(cls, user_qq: str, full: bool = False) -> Path | str | None:
+    async def build_bind_user_info(
+        cls, user_qq: str, full: bool = False
+    ) -> Path | bytes | str | None:
         """根据绑定的 QQ 号构建用户卡片"""
         handle = cls.get_bound_handle(user_qq)
         if handle is None:
@@ -35,27 +42,151 @@ class Codeforces(CodeforcesAPI):
         return await cls.build_user_info(handle, full=full)
 
     @classmethod
-    async def build_user_info(cls, handle: str, full: bool = False) -> Path | str | None:
+    async def build_group_rank(
+        cls, group_id: str, bot: Bot | None = None
+    ) -> Path | bytes | str | None:
+        """构建群内已绑定用户的 rating 排行卡片，群内没有绑定用户时返回 None"""
+        # 按群成员名单补全已绑定但没在群里用过命令的成员，并移除已退群的成员
+        await BindingRegistry.refresh_group(group_id, bot)
+        members = cls.bindings.members(group_id)
+        if not members:
+            return None
+        cache_key = ("rank", str(group_id))
+        cached = card_cache.lookup(cache_key)
+        if cached is not None:
+            return cached
+        # 多人绑定同一账号时只查询一次
+        unique = {str(handle).lower(): str(handle) for handle in members.values()}
+        handles = sorted(unique.values(), key=str.lower)
+        return await card_flight.do(
+            cache_key, lambda: cls._build_group_rank(handles, cache_key)
+        )
+
+    @classmethod
+    async def _build_group_rank(
+        cls, handles: list[str], cache_key: tuple
+    ) -> Path | bytes | str | None:
+        if Renderer.is_busy():
+            return RENDER_BUSY_MESSAGE
+        timer = StageTimer()
+        try:
+            users = await timer.track("user.info", cls.get_users_basic(handles))
+        except CodeforcesAPIError as e:
+            return str(e)
+        if not users:
+            return None
+
+        ranked = sorted(
+            users.values(),
+            key=lambda user: (-user.get("rating", -1), user["handle"].lower()),
+        )
+        rows = []
+        for place, user in enumerate(ranked, start=1):
+            rank = user.get("rank", "unrated").lower()
+            rows.append({
+                "place": place,
+                "handle": user["handle"],
+                "rank_display": Mapper.cf_rank_names.get(rank, rank.capitalize()),
+                "color": Mapper.cf_rank_color.get(rank, "#808080"),
+                "rating": user.get("rating", "--"),
+                "max_rating": user.get("maxRating", "--"),
+            })
+        digest = card_cache.digest("rank", rows, Renderer.output_settings())
+        cached = card_cache.get(digest)
+        if cached is not None:
+            card_cache.put(cache_key, digest)
+            return cached
+
+        try:
+            context = {
+                "title": "Codeforces Rating 排行",
+                "subtitle": f"本群共 {len(rows)} 位已绑定用户",
+                "rows": rows,
+                "logo_src": AssetRegistry.logo(LOGO_NAME),
+                "font_faces": AssetRegistry.font_faces(),
+                "accent": rows[0]["color"],
+                "accent_soft": cls._adjust_color(rows[0]["color"], 0.72),
+                "current_time": datetime.now().strftime("%Y-%m-%d %H:%M"),
+            }
+            context["rank_style"] = AssetRegistry.render_style(RANK_STYLE_NAME, context)
+            html_rendered = AssetRegistry.template(RANK_TEMPLATE_NAME).render(**context)
+        except Exception as e:
+            logger.error(f"读取模板失败: {e}")
+            return None
+
+        try:
+            scale = algo_config.algo_sample_card_scale
+            data = await timer.track(
+                "render", cls.render_card(html_rendered, 600, None, scale)
+            )
+
+        except RenderQueueFullError:
+            return RENDER_BUSY_MESSAGE
+        logger.info(f"CF 排行卡片({len(rows)} 人) 阶段耗时: {timer.summary()}")
+        if data is not None:
+            card = await card_cache.save(digest, data)
+            card_cache.put(cache_key, digest)
+            return card
+        logger.error("Playwright 截图失败，未生成卡片")
+        return None
+
+    @classmethod
+    async def build_user_info(
+        cls, handle: str, full: bool = False
+    ) -> Path | bytes | str | None:
         """构建 CF 用户信息卡片"""
+        cache_key = (handle.lower(), full)
+        cached = card_cache.lookup(cache_key)
+        if cached is not None:
+            return cached
+        # 同一用户、同一模式的并发请求共享一次获取与渲染
+        return await card_flight.do(
+            cache_key, lambda: cls._build_user_info(handle, full, cache_key)
+        )
+
+
+    @classmethod
+    async def _build_user_info(
+        cls, handle: str, full: bool, cache_key: tuple
+    ) -> Path | bytes | str | None:
+        if Renderer.is_busy():
+            return RENDER_BUSY_MESSAGE
+        timer = StageTimer()
+        # 模板与静态资源的准备不依赖用户数据，和接口请求同时进行
+        assets_task = asyncio.create_task(
+            timer.track("assets", asyncio.to_thread(cls._prepare_assets, full))
+        )
+        info_task = asyncio.create_task(
+            timer.track("fetch", cls.get_user_info(handle, include_submissions=True))
+        )
+        avatar_task = None
         try:
-            info = await cls.get_user_info(handle, include_submissions=True)
-        except CodeforcesRateLimitError:
-            return RATE_LIMIT_MESSAGE
+            # 与 info_task 内部的 user.info 请求合并为一次
+            basic = await timer.track("user.info", cls.get_user_basic(handle))
+            if basic:
+                # 拿到头像地址后立即开始下载，不必等 rating 与提交记录
+                avatar_url = basic.get("titlePhoto") or basic.get("avatar", "")
+                avatar_task = asyncio.create_task(
+                    timer.track("avatar", AssetRegistry.fetch_remote(avatar_url))
+                )
+            info = await info_task
+        except CodeforcesAPIError as e:
+            Util.discard_tasks(assets_task, info_task, avatar_task)
+            return str(e)
         if not info:
+            Util.discard_tasks(assets_task, avatar_task)
             return None
-        img_output: Path = cards_save_path / f"{handle}.png"
-        sample_output: Path = cards_save_path / f"{handle}_sample.png"
-        img_output.parent.mkdir(parents=True, exist_ok=True)
+        digest = card_cache.digest(full, info, Renderer.output_settings())
+        cached = card_cache.get(digest)
+        if cached is not None:
+            Util.discard_tasks(assets_task, avatar_task)
+            card_cache.put(cache_key, digest)
+            return cached
 
         context = cls._build_user_card_context(info)
         try:
-            if full:
-                with open(TEMPLATE_PATH, encoding="utf-8") as f:
-                    template = Template(f.read())
-            else:
-                with open(SAMPLE_TEMPLATE_PATH, encoding="utf-8") as f:
-                    template = Template(f.read())
-            background = cls._random_background_uri()
+            assets = await assets_task
+            template = assets["template"]
             handle_safe = html.escape(context["handle"])
             if context["rank"] == "legendary grandmaster" and handle_safe:
                 name_styled = (
@@ -67,98 +198,65 @@ class Codeforces(CodeforcesAPI):
             context = {
                 **context,
                 "name_styled": name_styled,
-                "logo_src": cls._image_data_uri(LOGO_PATH),
-                "background": background,
-                "avatar": await cls._remote_image_data_uri(context["avatar"]),
-                "font_faces": cls._font_faces(),
+                "logo_src": assets["logo_src"],
+                "background": assets["background"],
+                "avatar": await avatar_task if avatar_task else "",
+                "font_faces": assets["font_faces"],
                 **cls._theme_vars(context["rank_color"]),
             }
             if full:
                 render_context = {
                     **context,
-                    "full_style": cls._render_style(FULL_STYLE_PATH, context),
+                    "full_style": AssetRegistry.render_style(FULL_STYLE_NAME, context),
                 }
                 html_rendered = template.render(**render_context)
-                output, width, height = img_output, DEFAULT_WIDTH, DEFAULT_HEIGHT
+                width, height = DEFAULT_WIDTH, DEFAULT_HEIGHT
+                scale = algo_config.algo_full_card_scale
             else:
                 render_context = {
                     **cls._build_sample_context(context),
                     "font_faces": context["font_faces"],
                 }
-                render_context = {
-                    **render_context,
-                    "sample_style": cls._render_style(SAMPLE_STYLE_PATH, render_context),
-                }
+                sample_style = AssetRegistry.render_style(
+                    SAMPLE_STYLE_NAME, render_context
+                )
+
+                render_context = {**render_context, "sample_style": sample_style}
                 html_rendered = template.render(**render_context)
-                output, width, height = sample_output, 600, 800
+                width, height = 600, 800
+                scale = algo_config.algo_sample_card_scale
         except Exception as e:
+            Util.discard_tasks(assets_task, avatar_task)
             logger.error(f"读取模板失败: {e}")
             return None
 
-        ok = await cls.html_to_pic(html_rendered, output, width, height)
-        if ok:
-            return output
-        logger.error("Playwright 截图失败，未生成卡片")
-        return None
-
-    @staticmethod
-    def _image_data_uri(path: Path) -> str:
         try:
-            return "data:image/webp;base64," + base64.b64encode(path.read_bytes()).decode("ascii")
-        except Exception as e:
-            logger.warning(f"读取本地图片失败: {path} ({e})")
-            return ""
-
-    @staticmethod
-    def _font_url(path: Path) -> str:
-        return path.resolve().as_uri()
-
-    @staticmethod
-    def _font_data_uri(path: Path) -> str:
-        return "data:font/ttf;base64," + base64.b64encode(path.read_bytes()).decode(
-            "ascii"
-        )
-
-    @classmethod
-    def _font_faces(cls) -> str:
-        return (
-            "@font-face{font-family:'Baloo 2';src:url('"
-            f"{cls._font_data_uri(FONT_DIR / 'Baloo2-Regular.ttf')}"
-            "') format('truetype');font-weight:400 800;font-style:normal;font-display:block;}"
-            "@font-face{font-family:'Noto Sans CJK SC';src:url('"
-            f"{cls._font_url(FONT_DIR / 'NotoSansSC-Regular.ttf')}"
-            "') format('truetype');font-weight:400;font-style:normal;font-display:block;}"
-            "@font-face{font-family:'Noto Sans CJK SC';src:url('"
-            f"{cls._font_url(FONT_DIR / 'NotoSansSC-Bold.ttf')}"
-            "') format('truetype');font-weight:700;font-style:normal;font-display:block;}"
-        )
+            data = await timer.track(
+                "render", cls.render_card(html_rendered, width, height, scale)
+            )
 
-    @staticmethod
-    async def _remote_image_data_uri(url: str) -> str:
-        if not url:
-            return ""
-        timeout = httpx.Timeout(10.0)
-        try:
-            async with httpx.AsyncClient(timeout=timeout, follow_redirects=True) as client:
-                response = await client.get(url)
-            response.raise_for_status()
-        except httpx.HTTPError as e:
-            logger.warning(f"读取远程头像失败: {url} ({e})")
-            return url
-        content_type = response.headers.get("content-type", "image/png").split(";")[0]
-        return f"data:{content_type};base64," + base64.b64encode(response.content).decode("ascii")
+        except RenderQueueFullError:
+            return RENDER_BUSY_MESSAGE
+        logger.info(f"CF 卡片 {handle} 阶段耗时: {timer.summary()}")
+        if data is not None:
+            card = await card_cache.save(digest, data)
+            card_cache.put(cache_key, digest)
+            return card
+        logger.error("Playwright 截图失败，未生成卡片")
+        return None
 
     @staticmethod
-    def _render_style(path: Path, context: Dict) -> str:
-        with open(path, encoding="utf-8") as f:
-            return Template(f.read()).render(**context)
+    def _prepare_assets(full: bool) -> Dict:
+        """取出预编译的模板与预编码的静态资源"""
+        return {
+            "template": AssetRegistry.template(
+                TEMPLATE_NAME if full else SAMPLE_TEMPLATE_NAME
+            ),
 
-    @classmethod
-    def _random_background_uri(cls) -> str:
-        backgrounds = sorted(BACKGROUND_DIR.glob("*.webp"))
-        if not backgrounds:
-            return ""
-        return cls._image_data_uri(random.choice(backgrounds))
+            "logo_src": AssetRegistry.logo(LOGO_NAME),
+            "background": AssetRegistry.random_background(),
+            "font_faces": AssetRegistry.font_faces(),
+        }
 
     @staticmethod
     def _theme_vars(color: str) -> dict[str, str]:
@@ -193,48 +291,11 @@ class Codeforces(CodeforcesAPI):
         }
 
     @staticmethod
-    async def html_to_pic(html: str, out_path: Path, width: int, height: int | None) -> bool:
-        """将 HTML 渲染为 PNG 图片"""
-        try:
-            from playwright.async_api import TimeoutError as PlaywrightTimeoutError, async_playwright
-        except Exception as e:
-            logger.warning(f"未安装 Playwright：{e}")
-            return False
-        html_path = out_path.with_name(f".{out_path.stem}-{uuid4().hex}.html")
-        try:
-            # set_content() 的页面地址是 about:blank，会被 Chromium 拒绝加载
-            # file:// 字体。通过同目录临时 HTML 文件导航，字体与页面保持同源。
-            html_path.write_text(html, encoding="utf-8")
-            async with async_playwright() as pw:
-                browser = await pw.chromium.launch()
-                context = await browser.new_context(
-                    viewport={"width": int(width), "height": int(height or 1)},
-                    device_scale_factor=2,
-                )
-                page = await context.new_page()
-                await page.goto(html_path.as_uri(), wait_until="domcontentloaded")
-                try:
-                    await page.wait_for_load_state("load", timeout=3000)
-                except PlaywrightTimeoutError:
-                    pass
-                await page.evaluate("document.fonts ? document.fonts.ready : Promise.resolve()")
-                await page.wait_for_timeout(120)
-                if height is None:
-                    await page.screenshot(path=str(out_path), full_page=True, type="png")
-                else:
-                    await page.screenshot(
-                        path=str(out_path),
-                        clip={"x": 0, "y": 0, "width": width, "height": height},
-                        type="png",
-                    )
-                await context.close()
-                await browser.close()
-                return True
-        except Exception as e:
-            logger.error(f"Playwright 截图失败: {e}")
-            return False
-        finally:
-            html_path.unlink(missing_ok=True)
+    async def render_card(
+        html: str, width: int, height: int | None, scale: float = 2
+    ) -> bytes | None:
+        """将 HTML 渲染为卡片图片"""
+        return await Renderer.render(html, width, height, scale)
 
     @classmethod
     def _build_user_card_context(cls, data: Dict) -> Dict:
@@ -386,9 +447,9 @@ class Codeforces(CodeforcesAPI):
 
         # 参赛场次
         contest_count = len(rating_history)
-        heatmap_rows, heatmap_months = cls._build_heatmap(data["submissions"])
-        submissions = data["submissions"]
-        solved_count = cls._count_solved(submissions) if submissions else "--"
+        stats = data.get("submissionStats") or {}
+        heatmap_rows, heatmap_months = cls._build_heatmap(stats.get("daily", {}))
+        solved_count = stats["solved"] if stats.get("submitted") else "--"
 
         return {
             "handle": handle,
@@ -429,7 +490,7 @@ class Codeforces(CodeforcesAPI):
         accent = context["rank_color"]
         return {
             "short_name": "CF",
-            "logo_src": cls._image_data_uri(LOGO_PATH),
+            "logo_src": context["logo_src"],
             "accent": accent,
             "accent_dark": cls._adjust_color(accent, -0.14),
             "accent_soft": cls._adjust_color(accent, 0.38),
@@ -460,23 +521,11 @@ class Codeforces(CodeforcesAPI):
         return "#" + "".join(f"{c:02x}" for c in mixed)
 
     @staticmethod
-    def _count_solved(submissions: list[dict]) -> int:
-        solved: set[str] = set()
-        for sub in submissions:
-            if sub.get("verdict") != "OK":
-                continue
-            problem = sub.get("problem") or {}
-            contest_id = problem.get("contestId", "")
-            index = problem.get("index", "")
-            name = problem.get("name", "")
-            key = f"{contest_id}:{index}:{name}" if contest_id or index else name
-            if key:
-                solved.add(key)
-        return len(solved)
+    def _build_heatmap(daily: dict[str, int]) -> tuple[list[list[int]], list[dict]]:
+        """根据每日提交数构建最近 26 周公开提交热力图。
 
-    @staticmethod
-    def _build_heatmap(submissions: list[dict]) -> tuple[list[list[int]], list[dict]]:
-        """构建最近 26 周公开提交热力图。"""
+        daily 示例：{"2025-07-16": 3}，由 SubmissionStore 增量维护。
+        """
         today = date.today()
         end = today + timedelta(days=(5 - today.weekday()) % 7 + 1)
         start = end - timedelta(days=7 * 26 - 1)
@@ -484,13 +533,13 @@ class Codeforces(CodeforcesAPI):
         end = start + timedelta(days=7 * 26 - 1)
 
         daily_counts: dict[date, int] = {}
-        for sub in submissions:
-            ts = sub.get("creationTimeSeconds")
-            if not ts:
+        for ds, count in daily.items():
+            try:
+                d = date.fromisoformat(ds)
+            except ValueError:
                 continue
-            d = datetime.fromtimestamp(ts).date()
             if start <= d <= end:
-                daily_counts[d] = daily_counts.get(d, 0) + 1
+                daily_counts[d] = count
 
         max_count = max(daily_counts.values()) if daily_counts else 0
         row_order = [6, 0, 1, 2, 3, 4, 5]
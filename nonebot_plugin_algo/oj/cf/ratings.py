@@ -0,0 +1,174 @@
+import re
+import json
+import time
+import asyncio
+from datetime import datetime, timezone
+from typing import Dict, List
+
+from nonebot.log import logger
+
+from ...config import cf_save_path
+from ...binding import BindingRegistry
+from ...outbox import Outbox
+from ...util import ContestIndex, Util
+from .api import CodeforcesAPI, CodeforcesAPIError
+
+watch_save_path = cf_save_path / "rating_watch.json"
+
+# clist 中 Codeforces 的平台 id
+CF_RESOURCE_ID = 1
+# 兼容 /contest/<id> 与 /contests/<id>，gym 比赛不计 rating 不在此列
+CONTEST_HREF = re.compile(r"codeforces\.com/contests?/(\d+)")
+# 比赛结束后首次查询的等待时间与重试间隔（秒）
+FIRST_DELAY = 30 * 60
+BACKOFF_BASE = 15 * 60
+BACKOFF_MAX = 4 * 3600
+# 比赛结束后超过该时间仍未公布 rating 变化（如 unrated 比赛）则放弃
+GIVE_UP_AFTER = 3 * 24 * 3600
+
+
+class RatingWatcher:
+    """CF 赛后 rating 变化通知
+
+    从比赛索引中记录 Codeforces 比赛，结束后用一次 contest.ratingChanges 取得全部变化，
+    在本地与绑定账号求交集，按群汇总后写入发件箱，每个群一条消息。
+    rating 尚未公布时按指数退避重新查询；
+    待查询的比赛保存在 rating_watch.json，重启后继续。
+    """
+
+    # CF 比赛 id -> {name, end_at, attempts, next_at}
+    _watching: Dict[str, Dict] | None = None
+    _lock = asyncio.Lock()
+    notified = 0
+
+    @classmethod
+    def _load(cls) -> Dict[str, Dict]:
+        if cls._watching is None:
+            try:
+                with open(watch_save_path, "r", encoding="utf-8") as f:
+                    cls._watching = json.load(f)
+            except FileNotFoundError:
+                cls._watching = {}
+            except Exception as e:
+                logger.warning(f"读取 rating 监听列表失败: {e}")
+                cls._watching = {}
+        return cls._watching  # type: ignore
+
+    @classmethod
+    async def _save(cls) -> None:
+        raw = json.dumps(cls._load(), ensure_ascii=False)
+        await asyncio.to_thread(Util.write_atomic, watch_save_path, raw)
+
+    @classmethod
+    async def discover(cls) -> bool:
+        """把索引中的 Codeforces 比赛加入监听列表，返回是否有新增"""
+        watching = await asyncio.to_thread(cls._load)
+        added = False
+        for contest in await ContestIndex.contests(CF_RESOURCE_ID):
+            href = contest.get("href") or ""
+            match = CONTEST_HREF.search(href)
+            if match is None:
+                logger.debug(
+                    f"无法从比赛链接解析 CF 比赛 id，跳过: {contest.get('event')} {href}"
+                )
+                continue
+            if match.group(1) in watching:
+                continue
+            end = datetime.fromisoformat(contest["end"]).replace(tzinfo=timezone.utc)
+            end_at = end.timestamp()
+            watching[match.group(1)] = {
+                "name": contest["event"],
+                "end_at": end_at,
+                "attempts": 0,
+                "next_at": end_at + FIRST_DELAY,
+            }
+            added = True
+        return added
+
+    @classmethod
+    async def tick(cls) -> None:
+        """定时任务：发现新比赛并查询已到时间的比赛"""
+        if cls._lock.locked():
+            return
+        async with cls._lock:
+            changed = await cls.discover()
+            now = time.time()
+            for contest_id, watch in list(cls._load().items()):
+                if watch["next_at"] > now:
+                    continue
+                changed = True
+                try:
+                    done = await cls._check(contest_id, watch)
+                except CodeforcesAPIError:
+                    done = False
+                if done or now - watch["end_at"] > GIVE_UP_AFTER:
+                    if not done:
+                        logger.info(f"比赛 {watch['name']} 未公布 rating 变化，停止查询")
+                    cls._load().pop(contest_id, None)
+                    continue
+                watch["attempts"] += 1
+                delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (watch["attempts"] - 1))
+                watch["next_at"] = now + delay
+            if changed:
+                await cls._save()
+
+    @classmethod
+    async def _check(cls, contest_id: str, watch: Dict) -> bool:
+        """查询一场比赛的 rating 变化，已公布并通知时返回 True"""
+        changes = await CodeforcesAPI.request(
+            CodeforcesAPI.base_url + "/contest.ratingChanges",
+            {"contestId": contest_id},
+            background=True,
+        )
+        if not changes:
+            # 尚未公布时返回空列表；unrated 或未结束的比赛返回错误
+            return False
+        # 群成员索引只记录用过命令的成员，推送前按群成员名单补全
+        await BindingRegistry.refresh_groups()
+        messages = cls.build_messages(contest_id, watch["name"], changes)
+        queued = await Outbox.enqueue(messages)
+        cls.notified += queued
+        logger.info(
+            f"比赛 {watch['name']} rating 已公布，"
+            f"共 {len(changes)} 人，通知 {queued} 个群"
+        )
+        return True
+
+    @staticmethod
+    def build_messages(contest_id: str, name: str, changes: List[Dict]) -> List[Dict]:
+        """按群汇总绑定用户的 rating 变化"""
+        bindings = CodeforcesAPI.bindings
+        by_group: Dict[str, List[Dict]] = {}
+        for change in changes:
+            groups: set[str] = set()
+            for qq in bindings.owners(change["handle"]):
+                groups |= bindings.groups_of(qq)
+            for group in groups:
+                by_group.setdefault(group, []).append(change)
+
+        messages = []
+        for group, group_changes in by_group.items():
+            group_changes.sort(
+                key=lambda c: c["newRating"] - c["oldRating"], reverse=True
+            )
+            lines = []
+            for change in group_changes:
+                delta = change["newRating"] - change["oldRating"]
+                lines.append(
+                    f"{change['handle']}: {change['oldRating']} → {change['newRating']} "
+                    f"({delta:+d}) 排名 {change['rank']}"
+                )
+            messages.append({
+                "target_type": "group",
+                "target_id": group,
+                "message": f"📈{name} rating 变化\n\n" + "\n".join(lines),
+                "dedup_key": f"cf-rating:{contest_id}:{group}",
+            })
+        return messages
+
+    @classmethod
+    def stats(cls) -> dict:
+        return {
+            "watching": len(cls._watching or {}),
+            "notified": cls.notified,
+        }
@@ -0,0 +1,119 @@
+import re
+import json
+import asyncio
+from pathlib import Path
+from datetime import date, datetime, timedelta
+from typing import Dict
+
+from nonebot.log import logger
+
+from ...config import cf_save_path
+from ...util import Util
+
+submissions_save_path = cf_save_path / "submissions"
+
+# 每日提交数保留的天数（热力图只展示最近 26 周）
+DAILY_KEEP_DAYS = 400
+# 尚未出结果的评测状态
+PENDING_VERDICTS = {None, "TESTING"}
+
+
+class SubmissionStore:
+    """按 handle 保存的 CF 提交统计
+
+    本地只保存聚合结果（通过题目集合、每日提交数）和同步位置 watermark，
+    之后每次查询只需拉取 id 大于 watermark 的提交。
+
+    同步位置取最早一条仍在评测中的提交之前，保证评测结果出来后能被重新读到；
+    每日提交数按已计数的最大提交 id 去重，不会重复累加。
+    """
+
+    @staticmethod
+    def _path(handle: str) -> Path:
+        name = re.sub(r"[^0-9a-z_.-]", "_", handle.lower())
+        return submissions_save_path / f"{name}.json"
+
+    @classmethod
+    def _load(cls, handle: str) -> Dict | None:
+        path = cls._path(handle)
+        if not path.exists():
+            return None
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except Exception as e:
+            logger.warning(f"读取 CF 提交统计失败，将重新全量同步: {path} ({e})")
+            return None
+
+    @classmethod
+    def _save(cls, handle: str, state: Dict) -> None:
+        Util.write_atomic(cls._path(handle), json.dumps(state, ensure_ascii=False))
+
+    @staticmethod
+    def _solved_key(sub: Dict) -> str:
+        problem = sub.get("problem") or {}
+        contest_id = problem.get("contestId", "")
+        index = problem.get("index", "")
+        name = problem.get("name", "")
+        return f"{contest_id}:{index}:{name}" if contest_id or index else name
+
+    @classmethod
+    def _apply(cls, state: Dict, submissions: list[Dict]) -> Dict:
+        """把新拉取的提交合并进聚合结果"""
+        solved: set[str] = set(state["solved"])
+        daily: dict[str, int] = state["daily"]
+        counted_max = state["counted_max"]
+        pending_ids: list[int] = []
+        for sub in submissions:
+            sub_id = sub.get("id", 0)
+            if sub.get("verdict") in PENDING_VERDICTS:
+                pending_ids.append(sub_id)
+            if sub.get("verdict") == "OK":
+                key = cls._solved_key(sub)
+                if key:
+                    solved.add(key)
+            ts = sub.get("creationTimeSeconds")
+            if sub_id > counted_max and ts:
+                day = datetime.fromtimestamp(ts).date().isoformat()
+                daily[day] = daily.get(day, 0) + 1
+
+        max_id = max((sub.get("id", 0) for sub in submissions), default=0)
+        state["counted_max"] = max(counted_max, max_id)
+        # 仍在评测的提交下次需要重新读取
+        state["watermark"] = min(pending_ids) - 1 if pending_ids else state["counted_max"]
+        state["solved"] = sorted(solved)
+        cutoff = (date.today() - timedelta(days=DAILY_KEEP_DAYS)).isoformat()
+        state["daily"] = {d: c for d, c in daily.items() if d >= cutoff}
+        return state
+
+    @staticmethod
+    def _empty_state(handle: str) -> Dict:
+        return {
+            "handle": handle,
+            "watermark": 0,
+            "counted_max": 0,
+            "solved": [],
+            "daily": {},
+        }
+
+    @classmethod
+    async def load(cls, handle: str) -> Dict | None:
+        return await asyncio.to_thread(cls._load, handle)
+
+    @classmethod
+    async def update(
+        cls, handle: str, state: Dict | None, submissions: list[Dict]
+    ) -> Dict:
+
+        """合并新提交并落盘，返回新的聚合结果"""
+        state = cls._apply(state or cls._empty_state(handle), submissions)
+        await asyncio.to_thread(cls._save, handle, state)
+        return state
+
+    @staticmethod
+    def summary(state: Dict) -> Dict:
+        return {
+            "submitted": state["counted_max"] > 0,
+            "solved": len(state["solved"]),
+            "daily": state["daily"],
+        }
@@ -1,11 +1,13 @@
-import json
-from pathlib import Path
+import asyncio
 from typing import Dict
 
 import httpx
 from nonebot.log import logger
 
 from ...config import luogu_save_path
+from ...singleflight import SingleFlight
+from ...http_client import HttpClients
+from ...binding import BindingRegistry
 
 users_save_path = luogu_save_path / "users.json"
 
@@ -17,13 +19,18 @@ class LuoguAPI:
         "x-requested-with": "XMLHttpRequest",
     }
     base_url = "https://www.luogu.com.cn"
+    _user_flight = SingleFlight("luogu-user")
+    bindings = BindingRegistry("luogu", users_save_path)
 
     @staticmethod
     async def request(url: str, headers: dict = headers) -> Dict | None:
         try:
-            timeout = httpx.Timeout(10.0)
-            async with httpx.AsyncClient(timeout=timeout, follow_redirects=True, headers=headers) as client:
-                response = await client.get(url)
+            response = await HttpClients.get(url).get(
+                url,
+                headers=headers,
+                timeout=httpx.Timeout(10.0),
+                follow_redirects=True,
+            )
             response.raise_for_status()
             return response.json()
         except (httpx.HTTPError, ValueError) as e:
@@ -41,50 +48,58 @@ class LuoguAPI:
             return None
 
     @classmethod
-    async def get_user_info(cls, user: str | int) -> Dict | None:
+    async def resolve_uid(cls, user: str | int) -> int | None:
         if isinstance(user, int):
-            user_id = user
-        else:
-            user_id = await cls.search_user_id(user)
+            return user
+        return await cls.search_user_id(user)
+
+    @classmethod
+    async def get_user_profile(cls, user_id: int) -> Dict | None:
+        """获取用户主页数据，并发的相同查询只请求一次"""
+        return await cls._user_flight.do(
+            ("profile", user_id), lambda: cls.request(cls.base_url + f"/user/{user_id}")
+        )
+
+    @classmethod
+    async def get_user_info(cls, user: str | int) -> Dict | None:
+        """获取用户信息，并发的相同查询只请求一次"""
+        return await cls._user_flight.do(
+            ("info", user), lambda: cls._fetch_user_info(user)
+        )
+
+
+    @classmethod
+    async def _fetch_user_info(cls, user: str | int) -> Dict | None:
+        user_id = await cls.resolve_uid(user)
         if user_id is None:
             return None
 
-        user_info = await cls.request(cls.base_url + f"/user/{user_id}")
-        if user_info:
-            passed_detail_url = cls.base_url + f"/user/{user_id}/practice"
-            headers = {**cls.headers, "referer": f"{cls.base_url}/user/{user_id}"}
-            passed_detail = await cls.request(passed_detail_url, headers=headers)
-            if passed_detail:
-                user_info["data"]["passed"] = passed_detail["data"]["passed"]
+        passed_detail_url = cls.base_url + f"/user/{user_id}/practice"
+        headers = {**cls.headers, "referer": f"{cls.base_url}/user/{user_id}"}
+        # 主页与练习记录都只依赖 uid，并发请求
+        user_info, passed_detail = await asyncio.gather(
+            cls.get_user_profile(user_id),
+            cls.request(passed_detail_url, headers=headers),
+        )
+        if user_info and passed_detail:
+            user_info = {
+                **user_info,
+                "data": {**user_info["data"], "passed": passed_detail["data"]["passed"]},
+            }
         return user_info
 
     @classmethod
-    async def bind_luogu_user(cls, user_qq: str, user: str | int) -> bool:
-        if isinstance(user, int):
-            user_id = user
-        else:
-            user_id = await cls.search_user_id(user)
+    async def bind_luogu_user(
+        cls, user_qq: str, user: str | int, group_id: str | None = None
+    ) -> bool:
+
+        user_id = await cls.resolve_uid(user)
         if user_id is None:
             return False
 
-        users = cls._load_bound_users()
-        users[user_qq] = user_id
-        cls._save_bound_users(users)
+        await cls.bindings.bind(user_qq, user_id, group_id)
         return True
 
     @classmethod
     def get_bound_user(cls, user_qq: str) -> int | str | None:
-        return cls._load_bound_users().get(user_qq)
-
-    @staticmethod
-    def _load_bound_users() -> dict:
-        if not users_save_path.exists():
-            return {}
-        with open(users_save_path, "r", encoding="utf-8") as f:
-            return json.load(f)
-
-    @staticmethod
-    def _save_bound_users(users: dict) -> None:
-        users_save_path.parent.mkdir(parents=True, exist_ok=True)
-        with open(users_save_path, "w", encoding="utf-8") as f:
-            json.dump(users, f, ensure_ascii=False, indent=4)
+        return cls.bindings.get(user_qq)
@@ -1,158 +1,178 @@
-import random
-import base64
-import httpx
+import asyncio
 from typing import Dict
 from nonebot.log import logger
-from jinja2 import Template
-from ...config import luogu_save_path, Mapper
+from ...config import algo_config, luogu_save_path, Mapper
 from .api import LuoguAPI
+from ...render import Renderer, RenderQueueFullError, RENDER_BUSY_MESSAGE
+from ...cache import CardCache
+from ...singleflight import SingleFlight
+from ...util import StageTimer, Util
+from ...resources import AssetRegistry
 from pathlib import Path
 from collections import Counter
 import html
 from datetime import datetime
-from uuid import uuid4
-ASSETS_PATH = Path(__file__).resolve().parents[2] / "assets"
-TEMPLATE_PATH = ASSETS_PATH / "template" / "lougu_card.html"
-SAMPLE_TEMPLATE_PATH = ASSETS_PATH / "template" / "sample_card.html"
-FULL_STYLE_PATH = ASSETS_PATH / "template" / "full-style.css"
-SAMPLE_STYLE_PATH = ASSETS_PATH / "template" / "sample-style.css"
-LOGO_PATH = ASSETS_PATH / "luogu.webp"
-BACKGROUND_DIR = ASSETS_PATH / "background"
-FONT_DIR = ASSETS_PATH / "fonts"
+TEMPLATE_NAME = "lougu_card.html"
+SAMPLE_TEMPLATE_NAME = "sample_card.html"
+FULL_STYLE_NAME = "full-style.css"
+SAMPLE_STYLE_NAME = "sample-style.css"
+LOGO_NAME = "luogu.webp"
 cards_save_path = luogu_save_path / "cards"
 
 DEFAULT_WIDTH = 1440
 DEFAULT_HEIGHT = 900
 
+card_cache = CardCache("luogu", cards_save_path)
+card_flight = SingleFlight("luogu-card")
+
 class Luogu(LuoguAPI):
     @classmethod
-    async def build_bind_user_info(cls, user_qq: str, full: bool = False)-> Path | None:
+    async def build_bind_user_info(
+        cls, user_qq: str, full: bool = False
+    ) -> Path | bytes | str | None:
         user_id = cls.get_bound_user(user_qq)
         if user_id is None:
             return None
         return await cls.build_user_info(user_id, full=full)
 
     @classmethod
-    async def build_user_info(cls, user: str|int, full: bool = False)-> Path | None:
-        info = await cls.get_user_info(user)
+    async def build_user_info(
+        cls, user: str | int, full: bool = False
+    ) -> Path | bytes | str | None:
+        cache_key = (str(user).lower(), full)
+        cached = card_cache.lookup(cache_key)
+        if cached is not None:
+            return cached
+        # 同一用户、同一模式的并发请求共享一次获取与渲染
+        return await card_flight.do(
+            cache_key, lambda: cls._build_user_info(user, full, cache_key)
+        )
+
+
+    @classmethod
+    async def _build_user_info(
+        cls, user: str | int, full: bool, cache_key: tuple
+    ) -> Path | bytes | str | None:
+        if Renderer.is_busy():
+            return RENDER_BUSY_MESSAGE
+        timer = StageTimer()
+        # 模板与静态资源的准备不依赖用户数据，和接口请求同时进行
+        assets_task = asyncio.create_task(
+            timer.track("assets", asyncio.to_thread(cls._prepare_assets, full))
+        )
+        user_id = await timer.track("search", cls.resolve_uid(user))
+        if user_id is None:
+            Util.discard_tasks(assets_task)
+            return None
+        info_task = asyncio.create_task(timer.track("fetch", cls.get_user_info(user_id)))
+        avatar_task = None
+        background_task = None
+        # 与 info_task 内部的主页请求合并为一次
+        profile = await timer.track("profile", cls.get_user_profile(user_id))
+        try:
+            profile_user = profile["data"]["user"] if profile else {}
+            avatar_url = profile_user.get("avatar") or ""
+            background_url = profile_user.get("background") or ""
+        except (KeyError, TypeError, AttributeError):
+            avatar_url = background_url = ""
+        if avatar_url:
+            # 拿到头像地址后立即开始下载，不必等练习记录
+            avatar_task = asyncio.create_task(
+                timer.track("avatar", AssetRegistry.fetch_remote(avatar_url))
+            )
+        if background_url:
+            # 个人主页背景同样预先下载，渲染时页面不再访问外网
+            background_task = asyncio.create_task(
+                timer.track("user_background", AssetRegistry.fetch_remote(background_url))
+            )
+        info = await info_task
         if not info:
+            Util.discard_tasks(assets_task, avatar_task, background_task)
             return None
         username = info['data']['user']['name']    
         if username is None:
+            Util.discard_tasks(assets_task, avatar_task, background_task)
             return None
-        img_output: Path = cards_save_path / f"{username}.png"
-        sample_output: Path = cards_save_path / f"{username}_sample.png"
-        img_output.parent.mkdir(parents=True, exist_ok=True)
+        digest = card_cache.digest(full, info, Renderer.output_settings())
+        cached = card_cache.get(digest)
+        if cached is not None:
+            Util.discard_tasks(assets_task, avatar_task, background_task)
+            card_cache.put(cache_key, digest)
+            return cached
 
         # 渲染模板
         context = cls._build_user_card_context(info)
         try:
-            if full:
-                with open(TEMPLATE_PATH, encoding="utf-8") as f:
-                    template = Template(f.read())
-            else:
-                with open(SAMPLE_TEMPLATE_PATH, encoding="utf-8") as f:
-                    template = Template(f.read())
-            background = context["background"] or cls._random_background_uri()
+            assets = await assets_task
+            template = assets["template"]
+            user_background = await background_task if background_task else ""
+            background = user_background or assets["background"]
             # 预构建彩色名称
-            avatar = await cls._remote_image_data_uri(context["avatar"])
+            avatar = await avatar_task if avatar_task else ""
             context = {
                 **context,
                 "background": background,
-                "logo_src": cls._image_data_uri(LOGO_PATH),
+                "logo_src": assets["logo_src"],
                 "avatar": avatar,
-                "font_faces": cls._font_faces(),
+                "font_faces": assets["font_faces"],
                 "name_styled": f"<span style='color:{context['name_color']}'>{context['name']}</span>",
                 **cls._theme_vars(context["name_color"]),
             }
             if full:
                 render_context = {
                     **context,
-                    "full_style": cls._render_style(FULL_STYLE_PATH, context),
+                    "full_style": AssetRegistry.render_style(FULL_STYLE_NAME, context),
                 }
                 html_rendered = template.render(**render_context)
-                output, width, height = img_output, DEFAULT_WIDTH, DEFAULT_HEIGHT
+                width, height = DEFAULT_WIDTH, DEFAULT_HEIGHT
+                scale = algo_config.algo_full_card_scale
             else:
                 render_context = {
                     **cls._build_sample_context(context),
                     "font_faces": context["font_faces"],
                 }
-                render_context = {
-                    **render_context,
-                    "sample_style": cls._render_style(SAMPLE_STYLE_PATH, render_context),
-                }
+                sample_style = AssetRegistry.render_style(
+                    SAMPLE_STYLE_NAME, render_context
+                )
+
+                render_context = {**render_context, "sample_style": sample_style}
                 html_rendered = template.render(**render_context)
-                output, width, height = sample_output, 600, 800
+                width, height = 600, 800
+                scale = algo_config.algo_sample_card_scale
         except Exception as e:
+            Util.discard_tasks(assets_task, avatar_task, background_task)
             logger.error(f"读取模板失败: {e}，改用内置模板渲染")
             return None
         
         # 仅使用 Playwright 渲染
         # 初次按动态高度渲染（让页面自适应内容），再截图整个页面
-        ok = await cls.html_to_pic(html_rendered, output, width, height)
-        if ok:
-            return output
-        logger.error("Playwright 截图失败，未生成卡片")
-        return None
-
-    @staticmethod
-    def _image_data_uri(path: Path) -> str:
         try:
-            return "data:image/webp;base64," + base64.b64encode(path.read_bytes()).decode("ascii")
-        except Exception as e:
-            logger.warning(f"读取本地图片失败: {path} ({e})")
-            return ""
-
-    @staticmethod
-    def _font_url(path: Path) -> str:
-        return path.resolve().as_uri()
-
-    @staticmethod
-    def _font_data_uri(path: Path) -> str:
-        return "data:font/ttf;base64," + base64.b64encode(path.read_bytes()).decode(
-            "ascii"
-        )
-
-    @classmethod
-    def _font_faces(cls) -> str:
-        return (
-            "@font-face{font-family:'Baloo 2';src:url('"
-            f"{cls._font_data_uri(FONT_DIR / 'Baloo2-Regular.ttf')}"
-            "') format('truetype');font-weight:400 800;font-style:normal;font-display:block;}"
-            "@font-face{font-family:'Noto Sans CJK SC';src:url('"
-            f"{cls._font_url(FONT_DIR / 'NotoSansSC-Regular.ttf')}"
-            "') format('truetype');font-weight:400;font-style:normal;font-display:block;}"
-            "@font-face{font-family:'Noto Sans CJK SC';src:url('"
-            f"{cls._font_url(FONT_DIR / 'NotoSansSC-Bold.ttf')}"
-            "') format('truetype');font-weight:700;font-style:normal;font-display:block;}"
-        )
+            data = await timer.track(
+                "render", cls.render_card(html_rendered, width, height, scale)
+            )
 
-    @staticmethod
-    async def _remote_image_data_uri(url: str) -> str:
-        if not url:
-            return ""
-        timeout = httpx.Timeout(10.0)
-        try:
-            async with httpx.AsyncClient(timeout=timeout, follow_redirects=True) as client:
-                response = await client.get(url)
-            response.raise_for_status()
-        except httpx.HTTPError as e:
-            logger.warning(f"读取远程头像失败: {url} ({type(e).__name__}: {e!r})")
-            return url
-        content_type = response.headers.get("content-type", "image/png").split(";")[0]
-        return f"data:{content_type};base64," + base64.b64encode(response.content).decode("ascii")
+        except RenderQueueFullError:
+            return RENDER_BUSY_MESSAGE
+        logger.info(f"洛谷卡片 {username} 阶段耗时: {timer.summary()}")
+        if data is not None:
+            card = await card_cache.save(digest, data)
+            card_cache.put(cache_key, digest)
+            return card
+        logger.error("Playwright 截图失败，未生成卡片")
+        return None
 
     @staticmethod
-    def _render_style(path: Path, context: Dict) -> str:
-        with open(path, encoding="utf-8") as f:
-            return Template(f.read()).render(**context)
+    def _prepare_assets(full: bool) -> Dict:
+        """取出预编译的模板与预编码的静态资源"""
+        return {
+            "template": AssetRegistry.template(
+                TEMPLATE_NAME if full else SAMPLE_TEMPLATE_NAME
+            ),
 
-    @classmethod
-    def _random_background_uri(cls) -> str:
-        backgrounds = sorted(BACKGROUND_DIR.glob("*.webp"))
-        if not backgrounds:
-            return ""
-        return cls._image_data_uri(random.choice(backgrounds))
+            "logo_src": AssetRegistry.logo(LOGO_NAME),
+            "background": AssetRegistry.random_background(),
+            "font_faces": AssetRegistry.font_faces(),
+        }
 
     @staticmethod
     def _theme_vars(color: str) -> dict[str, str]:
@@ -187,42 +207,11 @@ class Luogu(LuoguAPI):
         }
 
     @staticmethod
-    async def html_to_pic(html: str, out_path: Path, width: int, height: int | None) -> bool:
-        try:
-            from playwright.async_api import TimeoutError as PlaywrightTimeoutError, async_playwright
-        except Exception as e:
-            logger.warning(f"未安装 Playwright：{e}")
-            return False
-        html_path = out_path.with_name(f".{out_path.stem}-{uuid4().hex}.html")
-        try:
-            # set_content() 的页面地址是 about:blank，会被 Chromium 拒绝加载
-            # file:// 字体。通过同目录临时 HTML 文件导航，字体与页面保持同源。
-            html_path.write_text(html, encoding="utf-8")
-            async with async_playwright() as pw:
-                browser = await pw.chromium.launch()
-                context = await browser.new_context(viewport={"width": int(width), "height": int(height or 1)}, device_scale_factor=2)
-                page = await context.new_page()
-                await page.goto(html_path.as_uri(), wait_until="domcontentloaded")
-                try:
-                    await page.wait_for_load_state("load", timeout=3000)
-                except PlaywrightTimeoutError:
-                    pass
-                await page.evaluate("document.fonts ? document.fonts.ready : Promise.resolve()")
-                await page.wait_for_timeout(120)
-                # 若未指定高度，则截图整页
-                if height is None:
-                    await page.screenshot(path=str(out_path), full_page=True, type="png")
-                else:
-                    await page.screenshot(path=str(out_path), clip={"x": 0, "y": 0, "width": width, "height": height}, type="png")
-                await context.close()
-                await browser.close()
-                return True
-        except Exception as e:
-            logger.error(f"Playwright 截图失败: {e}")
-            return False
-        finally:
-            html_path.unlink(missing_ok=True)
-
+    async def render_card(
+        html: str, width: int, height: int | None, scale: float = 2
+    ) -> bytes | None:
+        """将 HTML 渲染为卡片图片"""
+        return await Renderer.render(html, width, height, scale)
 
     @classmethod
     def _build_user_card_context(cls, data: Dict) -> Dict:
@@ -343,7 +332,7 @@ class Luogu(LuoguAPI):
 
         return {
             "short_name": "LG",
-            "logo_src": cls._image_data_uri(LOGO_PATH),
+            "logo_src": context["logo_src"],
             "accent": accent,
             "accent_dark": cls._adjust_color(accent, -0.14),
             "accent_soft": cls._adjust_color(accent, 0.38),
@@ -0,0 +1,393 @@
+import time
+import random
+import sqlite3
+import asyncio
+from datetime import datetime
+from collections import deque
+from typing import Dict, List
+
+from nonebot import get_bots, get_driver
+from nonebot.adapters import Bot
+from nonebot.log import logger
+
+from .config import algo_config
+from .ratelimit import TokenBucket
+from .subscribe_store import SubscribeStore, close_subscribe_store
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    dedup_key TEXT UNIQUE,
+    bot_id TEXT,
+    target_type TEXT NOT NULL,
+    target_id TEXT NOT NULL,
+    message TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    next_at REAL NOT NULL,
+    attempted_at REAL,
+    sent_at REAL,
+    last_error TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox (status, next_at);
+CREATE INDEX IF NOT EXISTS idx_outbox_target ON outbox (target_type, target_id, status);
+"""
+
+# 单次取出的待发送消息数
+BATCH_SIZE = 50
+# 没有到期消息时的最长等待（秒）
+POLL_INTERVAL = 30
+# 重试间隔：BACKOFF_BASE * 2^(次数-1)，不超过 BACKOFF_MAX
+BACKOFF_BASE = 5
+BACKOFF_MAX = 600
+# 已发送与已放弃的消息保留时间（秒），期间相同去重键不会再次入队
+RETENTION = 7 * 24 * 3600
+# 关闭时等待发送中消息的时间（秒）
+STOP_TIMEOUT = 5
+
+
+class Outbox:
+    """持久化的消息发件箱
+
+    比赛提醒等主动消息先写入订阅数据库中的 outbox 表再由后台任务发送，
+    每个 Bot 共享一个令牌桶，同一会话的消息按 algo_send_target_interval 间隔串行发送，
+    失败后按指数退避重试，超过 algo_send_max_attempts 次后放弃。
+    入队时可指定去重键，相同键的消息只会入队一次；重启后未发送的消息继续发送。
+
+    投递保证为至少一次：进程在调用发送接口期间退出时无法得知 OneBot 是否已接收，
+    这些消息重启后一律重新发送并逐条记录警告，因此可能重复，但不会丢失。
+    正常关闭时会先等待发送中的消息得到结果，尽量缩小这一窗口。
+    """
+
+    _ready = False
+    _worker: asyncio.Task | None = None
+    _wake_event: asyncio.Event | None = None
+    _tasks: set[asyncio.Task] = set()
+    # 正在发送的会话
+    _busy: set[str] = set()
+    # 会话 -> 上次发送时间
+    _last_sent: Dict[str, float] = {}
+    _bot_buckets: Dict[str, TokenBucket] = {}
+    # 入队到送达的耗时（秒）
+    _latency: deque = deque(maxlen=100)
+    sent = 0
+    retried = 0
+    failed = 0
+    # 启动时发现并重新发送的中断消息
+    resumed = 0
+
+    @classmethod
+    async def _prepare(cls) -> None:
+        if cls._ready:
+            return
+
+        def prepare(conn: sqlite3.Connection) -> list[sqlite3.Row]:
+            conn.executescript(SCHEMA)
+            cls._migrate(conn)
+            conn.execute(
+                "DELETE FROM outbox WHERE status IN ('sent', 'failed') "
+                "AND created_at < ?",
+                (time.time() - RETENTION,),
+            )
+            # 上次关闭时仍在发送中的消息无法确认是否送达，按至少一次的约定全部重新发送
+            # （unknown 为旧版本标记的中断消息，同样处理）
+            interrupted = conn.execute(
+                "SELECT id, target_type, target_id, attempted_at FROM outbox "
+                "WHERE status IN ('sending', 'unknown')"
+            ).fetchall()
+            conn.execute(
+                "UPDATE outbox SET status = 'pending' "
+                "WHERE status IN ('sending', 'unknown')"
+            )
+            return interrupted
+
+        interrupted = await SubscribeStore._run(prepare)
+        cls.resumed += len(interrupted)
+        for row in interrupted:
+            attempted = (
+                datetime.fromtimestamp(row["attempted_at"]).strftime("%Y-%m-%d %H:%M:%S")
+                if row["attempted_at"]
+                else "未知"
+            )
+            logger.warning(
+                f"发件箱消息 {row['id']} 在上次关闭时未确认送达(发出于 {attempted})，"
+                f"将重新发送，可能重复: {row['target_type']}:{row['target_id']}"
+            )
+        cls._ready = True
+
+    @staticmethod
+    def _migrate(conn: sqlite3.Connection) -> None:
+        """为旧版发件箱补充发送时间列"""
+        columns = {row["name"] for row in conn.execute("PRAGMA table_info(outbox)")}
+        if "attempted_at" not in columns:
+            with conn:
+                conn.execute("ALTER TABLE outbox ADD COLUMN attempted_at REAL")
+
+    @classmethod
+    async def enqueue(cls, messages: List[Dict]) -> int:
+        """写入一批待发送消息，返回实际入队的数量
+
+        每条消息包含 target_type（group / private）、target_id、message，
+        可选 dedup_key 与 bot_id；去重键已存在的消息会被忽略。
+        """
+        await cls._prepare()
+        now = time.time()
+        rows = [
+            (
+                msg.get("dedup_key"),
+                msg.get("bot_id"),
+                msg["target_type"],
+                str(msg["target_id"]),
+                msg["message"],
+                now,
+                now,
+            )
+            for msg in messages
+        ]
+
+        def insert(conn: sqlite3.Connection) -> int:
+            before = conn.total_changes
+            conn.executemany(
+                """
+                INSERT OR IGNORE INTO outbox
+                    (dedup_key, bot_id, target_type, target_id, message,
+                     created_at, next_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                """,
+                rows,
+            )
+            return conn.total_changes - before
+
+        queued = await SubscribeStore._run(insert)
+        if queued < len(rows):
+            logger.info(f"发件箱忽略 {len(rows) - queued} 条重复消息")
+        cls.wake()
+        return queued
+
+    @classmethod
+    def wake(cls) -> None:
+        if cls._wake_event is not None:
+            cls._wake_event.set()
+
+    @classmethod
+    def _pick_bot(cls, bot_id: str | None) -> Bot | None:
+        bots = get_bots()
+        if bot_id and bot_id in bots:
+            return bots[bot_id]
+        return next(iter(bots.values()), None)
+
+    @classmethod
+    def _bucket(cls, bot: Bot) -> TokenBucket:
+        bucket = cls._bot_buckets.get(bot.self_id)
+        if bucket is None:
+            rate = max(algo_config.algo_send_bot_rate, 0.01)
+            bucket = TokenBucket(
+                f"send:{bot.self_id}", rate=rate, capacity=max(1.0, rate * 3)
+            )
+            cls._bot_buckets[bot.self_id] = bucket
+        return bucket
+
+    @classmethod
+    async def _run_worker(cls) -> None:
+        await cls._prepare()
+        while True:
+            cls._wake_event.clear()  # type: ignore
+            timeout = POLL_INTERVAL
+            if get_bots() and len(cls._tasks) < max(1, algo_config.algo_send_concurrency):
+                timeout = await cls._dispatch()
+            try:
+                await asyncio.wait_for(cls._wake_event.wait(), timeout)  # type: ignore
+            except asyncio.TimeoutError:
+                pass
+
+    @classmethod
+    async def _dispatch(cls) -> float:
+        """启动到期消息的发送任务，返回距下一条消息到期的秒数"""
+        now = time.time()
+
+        def due(conn: sqlite3.Connection) -> tuple[list[sqlite3.Row], float | None]:
+            # 只取每个会话最早入队的未完成消息，重试中的消息会挡住同一会话的后续消息
+            rows = conn.execute(
+                """
+                SELECT * FROM outbox
+                WHERE status = 'pending' AND next_at <= ?
+                  AND NOT EXISTS (
+                      SELECT 1 FROM outbox AS prev
+                      WHERE prev.target_type = outbox.target_type
+                        AND prev.target_id = outbox.target_id
+                        AND prev.status IN ('pending', 'sending')
+                        AND prev.id < outbox.id
+                  )
+                ORDER BY next_at, id LIMIT ?
+                """,
+                (now, BATCH_SIZE),
+            ).fetchall()
+            upcoming = conn.execute(
+                "SELECT MIN(next_at) FROM outbox "
+                "WHERE status = 'pending' AND next_at > ?",
+                (now,),
+            ).fetchone()[0]
+            return rows, upcoming
+
+        rows, upcoming = await SubscribeStore._run(due)
+        limit = max(1, algo_config.algo_send_concurrency)
+        for row in rows:
+            if len(cls._tasks) >= limit:
+                break
+            target = f"{row['target_type']}:{row['target_id']}"
+            if target in cls._busy:
+                # 同一会话的消息串行发送，保持顺序
+                continue
+            cls._busy.add(target)
+            task = asyncio.create_task(cls._deliver(dict(row), target))
+            cls._tasks.add(task)
+            task.add_done_callback(cls._task_done)
+        if upcoming is None:
+            return POLL_INTERVAL
+        return min(POLL_INTERVAL, max(0.0, upcoming - now))
+
+    @classmethod
+    def _task_done(cls, task: asyncio.Task) -> None:
+        cls._tasks.discard(task)
+        cls.wake()
+
+    @classmethod
+    async def _update(cls, msg_id: int, sql: str, params: tuple) -> None:
+        await SubscribeStore._run(
+            lambda conn: conn.execute(
+                f"UPDATE outbox SET {sql} WHERE id = ?", (*params, msg_id)
+            )
+        )
+
+    @classmethod
+    async def _deliver(cls, row: Dict, target: str) -> None:
+        try:
+            bot = cls._pick_bot(row["bot_id"])
+            if bot is None:
+                return
+            last_sent = cls._last_sent.get(target, 0.0)
+            wait = last_sent + algo_config.algo_send_target_interval - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            await cls._bucket(bot).acquire(TokenBucket.BACKGROUND)
+
+            await cls._update(
+                row["id"],
+                "status = 'sending', attempts = attempts + 1, attempted_at = ?",
+                (time.time(),),
+            )
+            attempts = row["attempts"] + 1
+            try:
+                if row["target_type"] == "group":
+                    await bot.send_group_msg(
+                        group_id=row["target_id"], message=row["message"]
+                    )
+                else:
+                    await bot.send_private_msg(
+                        user_id=row["target_id"], message=row["message"]
+                    )
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"
+                if attempts >= algo_config.algo_send_max_attempts:
+                    cls.failed += 1
+                    logger.error(
+                        f"消息发送失败，已放弃({attempts}次): {target} ({error})"
+                    )
+                    await cls._update(
+                        row["id"], "status = 'failed', last_error = ?", (error,)
+                    )
+                else:
+                    cls.retried += 1
+                    delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (attempts - 1))
+                    delay *= random.uniform(0.8, 1.2)
+                    logger.warning(
+                        f"消息发送失败，{delay:.0f}s 后重试({attempts}次): "
+                        f"{target} ({error})"
+                    )
+                    await cls._update(
+                        row["id"],
+                        "status = 'pending', next_at = ?, last_error = ?",
+                        (time.time() + delay, error),
+                    )
+                return
+            finally:
+                cls._last_sent[target] = time.monotonic()
+
+            sent_at = time.time()
+            cls.sent += 1
+            cls._latency.append(sent_at - row["created_at"])
+            await cls._update(row["id"], "status = 'sent', sent_at = ?", (sent_at,))
+            logger.debug(f"消息已送达 {target}，耗时 {sent_at - row['created_at']:.1f}s")
+        except Exception as e:
+            logger.error(f"发件箱处理消息 {row['id']} 出错: {e}")
+        finally:
+            cls._busy.discard(target)
+
+    @classmethod
+    async def start(cls) -> None:
+        if cls._worker is None:
+            cls._wake_event = asyncio.Event()
+            cls._worker = asyncio.create_task(cls._run_worker())
+
+    @classmethod
+    async def stop(cls) -> None:
+        if cls._worker is not None:
+            cls._worker.cancel()
+            cls._worker = None
+        if cls._tasks:
+            # 等待发送中的消息得到结果，尽量避免重启后重复发送
+            _, pending = await asyncio.wait(set(cls._tasks), timeout=STOP_TIMEOUT)
+            # 仍未完成的消息保持 sending 状态，下次启动时重新发送
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.wait(pending)
+        cls._wake_event = None
+
+    @classmethod
+    async def counts(cls) -> Dict[str, int]:
+        """按状态统计发件箱中的消息数"""
+        if not cls._ready:
+            return {}
+        rows = await SubscribeStore._run(
+            lambda conn: conn.execute(
+                "SELECT status, COUNT(*) FROM outbox GROUP BY status"
+            ).fetchall()
+        )
+        return dict(rows)
+
+    @classmethod
+    def stats(cls) -> dict:
+        samples = list(cls._latency)
+        return {
+            "sent": cls.sent,
+            "retried": cls.retried,
+            "failed": cls.failed,
+            "sending": len(cls._tasks),
+            "resumed": cls.resumed,
+            "avg_latency": sum(samples) / len(samples) if samples else 0.0,
+            "max_latency": max(samples) if samples else 0.0,
+        }
+
+
+driver = get_driver()
+
+
+@driver.on_startup
+async def start_outbox():
+    await Outbox.start()
+
+
+@driver.on_bot_connect
+async def wake_outbox():
+    # Bot 上线后立即发送积压的消息
+    Outbox.wake()
+
+
+@driver.on_shutdown
+async def stop_outbox():
+    # 发送任务结束前仍会写回状态，必须先停止发件箱再关闭数据库；
+    # 两步放在同一个钩子里，不依赖各版本 NoneBot 执行关闭钩子的顺序
+    await Outbox.stop()
+    await close_subscribe_store()
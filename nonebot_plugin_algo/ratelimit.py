@@ -0,0 +1,95 @@
+import time
+import heapq
+import asyncio
+import itertools
+from collections import deque
+
+
+class TokenBucket:
+    """令牌桶限流器
+
+    按固定速率补充令牌，桶满时允许短时突发。令牌不足时调用方排队，
+    按 (优先级, 到达顺序) 依次放行：交互命令优先于后台任务，同优先级先到先得。
+    """
+
+    INTERACTIVE = 0
+    BACKGROUND = 1
+
+    instances: dict[str, "TokenBucket"] = {}
+
+    def __init__(self, name: str, rate: float, capacity: float):
+        self.name = name
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._waiters: list[tuple[int, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self._wake_handle: asyncio.TimerHandle | None = None
+        self.acquired = 0
+        self._wait_samples: deque = deque(maxlen=100)
+        TokenBucket.instances[name] = self
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        refilled = self._tokens + (now - self._updated) * self.rate
+        self._tokens = min(self.capacity, refilled)
+
+        self._updated = now
+
+    def _dispatch(self) -> None:
+        """按优先级把可用令牌发给排队者，令牌不足时预约下次唤醒"""
+        self._refill()
+        while self._waiters and self._tokens >= 1:
+            _, _, future = heapq.heappop(self._waiters)
+            if future.done():
+                # 已取消的等待者
+                continue
+            self._tokens -= 1
+            future.set_result(None)
+        if self._waiters and self._wake_handle is None:
+            delay = max(0.0, (1 - self._tokens) / self.rate)
+            self._wake_handle = asyncio.get_running_loop().call_later(delay, self._wake)
+
+    def _wake(self) -> None:
+        self._wake_handle = None
+        self._dispatch()
+
+    async def acquire(self, priority: int = INTERACTIVE) -> float:
+        """取得一个令牌，返回排队等待的秒数"""
+        begin = time.monotonic()
+        self._refill()
+        if not self._waiters and self._tokens >= 1:
+            self._tokens -= 1
+            return self._record(0.0)
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), future))
+        self._dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # 令牌已发放但调用方被取消，归还令牌
+                self._tokens += 1
+                self._dispatch()
+            raise
+        return self._record(time.monotonic() - begin)
+
+    def drain(self) -> None:
+        """上游提示限流时清空令牌，所有调用方按补充速率重新排队"""
+        self._refill()
+        self._tokens = min(self._tokens, 0)
+
+    def _record(self, wait: float) -> float:
+        self.acquired += 1
+        self._wait_samples.append(wait)
+        return wait
+
+    def stats(self) -> dict:
+        samples = list(self._wait_samples)
+        return {
+            "acquired": self.acquired,
+            "waiting": sum(1 for *_, f in self._waiters if not f.done()),
+            "avg_wait": sum(samples) / len(samples) if samples else 0.0,
+            "max_wait": max(samples) if samples else 0.0,
+        }
@@ -0,0 +1,397 @@
+import io
+import time
+import asyncio
+from collections import deque
+from importlib.util import find_spec
+from typing import Any
+from uuid import uuid4
+
+from nonebot import get_driver
+from nonebot.log import logger
+
+from .config import algo_config
+from .resources import AssetRegistry, ORIGIN
+from .util import StageTimer
+
+RENDER_BUSY_MESSAGE = "当前渲染的卡片太多啦,请稍后再试~"
+CARD_FORMATS = ("png", "jpeg", "webp")
+# 关闭页面的等待上限（秒）
+CLOSE_TIMEOUT = 5
+
+
+class RenderQueueFullError(Exception):
+    pass
+
+
+class Renderer:
+    """常驻 Chromium 卡片渲染服务
+
+    浏览器在 Bot 启动时拉起、关闭时销毁，页面以固定大小的池复用。
+    池中每个槽位为 (代数, 缩放倍数, context, page)，浏览器重启后旧代数的槽位、
+    或缩放倍数与本次渲染不同的槽位会被丢弃重建。
+    池大小即同时渲染的卡片数，超出的请求排队，排队数达到上限时直接拒绝。
+
+    页面导航到虚拟源 ORIGIN，HTML 与静态资源均由内存应答，不落临时文件；
+    其余外部请求一律拦截，渲染耗时不受网络影响。
+
+    模板在字体与图片解码完成后设置 window.__algoReady，渲染器据此立即截图；
+    整个渲染过程受 algo_render_timeout 约束，超时的页面直接关闭重建。
+
+    png / jpeg 由 Chromium 直接编码；webp 与调色板量化在截图后由 Pillow 转码。
+    """
+
+    _playwright: Any = None
+    _browser: Any = None
+    _generation: int = 0
+    _slots: asyncio.Queue | None = None
+    _launch_lock = asyncio.Lock()
+    _waiting: int = 0
+    _rejected: int = 0
+    _rendered: int = 0
+    _wait_samples: deque = deque(maxlen=100)
+    # 页面令牌 -> 待渲染的 HTML
+    _documents: dict[str, str] = {}
+    _blocked: int = 0
+    _timeouts: int = 0
+    # 渲染阶段 -> 最近的耗时样本
+    _stage_samples: dict[str, deque] = {}
+    _format: str | None = None
+    _quantize_enabled: bool | None = None
+
+    @classmethod
+    async def start(cls) -> bool:
+        """启动浏览器并初始化页面池"""
+        async with cls._launch_lock:
+            if cls._browser is not None and cls._browser.is_connected():
+                return True
+            try:
+                from playwright.async_api import async_playwright
+            except Exception as e:
+                logger.warning(f"未安装 Playwright：{e}")
+                return False
+            try:
+                if cls._playwright is None:
+                    cls._playwright = await async_playwright().start()
+                cls._browser = await cls._playwright.chromium.launch()
+                cls._browser.on("disconnected", cls._on_disconnected)
+            except Exception as e:
+                logger.error(f"启动 Chromium 失败: {e}")
+                cls._browser = None
+                return False
+            cls._generation += 1
+            if cls._slots is None:
+                size = max(1, algo_config.algo_render_pool_size)
+                cls._slots = asyncio.Queue(maxsize=size)
+                for _ in range(size):
+                    cls._slots.put_nowait(None)
+            logger.info(
+                f"卡片渲染服务已启动 (第 {cls._generation} 代,"
+                f" 页面池 {cls._slots.maxsize})"
+
+            )
+
+            return True
+
+    @classmethod
+    async def stop(cls) -> None:
+        """关闭浏览器与 Playwright"""
+        async with cls._launch_lock:
+            browser, cls._browser = cls._browser, None
+            pw, cls._playwright = cls._playwright, None
+            try:
+                if browser is not None:
+                    await browser.close()
+            except Exception as e:
+                logger.warning(f"关闭 Chromium 失败: {e}")
+            try:
+                if pw is not None:
+                    await pw.stop()
+            except Exception as e:
+                logger.warning(f"关闭 Playwright 失败: {e}")
+        logger.info("卡片渲染服务已关闭")
+
+    @classmethod
+    def _on_disconnected(cls, browser: Any) -> None:
+        if browser is cls._browser:
+            logger.warning("Chromium 连接已断开，将在下次渲染时重启")
+            cls._browser = None
+
+    @classmethod
+    async def health_check(cls) -> bool:
+        """检查浏览器存活状态，崩溃时自动重启"""
+        if cls._slots is None:
+            # 从未成功启动（如未安装 Playwright），交给首次渲染时再尝试
+            return False
+        browser = cls._browser
+        if browser is not None and browser.is_connected():
+            try:
+                # 新建并关闭一个空 context 作为探活
+                probe = await asyncio.wait_for(browser.new_context(), timeout=10)
+                await probe.close()
+                return True
+            except Exception as e:
+                logger.warning(f"Chromium 健康检查失败，准备重启: {e}")
+        await cls._relaunch()
+        return cls._browser is not None
+
+    @classmethod
+    async def _relaunch(cls) -> None:
+        browser = cls._browser
+        cls._browser = None
+        if browser is not None:
+            try:
+                await browser.close()
+            except Exception:
+                pass
+        await cls.start()
+
+    @classmethod
+    def is_busy(cls) -> bool:
+        """排队数是否已达上限"""
+        return cls._waiting >= algo_config.algo_render_queue_size
+
+    @classmethod
+    def stats(cls) -> dict:
+        """渲染队列状态，用于监控"""
+        samples = list(cls._wait_samples)
+        return {
+            "running": cls._browser is not None and cls._browser.is_connected(),
+            "generation": cls._generation,
+            "pool_size": cls._slots.maxsize if cls._slots else 0,
+            "idle": cls._slots.qsize() if cls._slots else 0,
+            "waiting": cls._waiting,
+            "queue_size": algo_config.algo_render_queue_size,
+            "rendered": cls._rendered,
+            "rejected": cls._rejected,
+            "blocked": cls._blocked,
+            "timeouts": cls._timeouts,
+            "stages": {
+                name: sum(samples) / len(samples)
+                for name, samples in cls._stage_samples.items() if samples
+            },
+            "avg_wait": sum(samples) / len(samples) if samples else 0.0,
+            "max_wait": max(samples) if samples else 0.0,
+        }
+
+    @classmethod
+    async def _acquire(cls) -> tuple | None:
+        """排队等待空闲槽位，排队数超限时抛出 RenderQueueFullError"""
+        assert cls._slots is not None
+        if cls._slots.empty() and cls.is_busy():
+            cls._rejected += 1
+            logger.warning(f"渲染队列已满({cls._waiting})，拒绝本次渲染")
+            raise RenderQueueFullError(RENDER_BUSY_MESSAGE)
+        cls._waiting += 1
+        begin = time.monotonic()
+        try:
+            return await cls._slots.get()
+        finally:
+            cls._waiting -= 1
+            cls._wait_samples.append(time.monotonic() - begin)
+
+    @classmethod
+    async def _open_slot(cls, slot: tuple | None, scale: float) -> tuple:
+        """取得可用槽位；空槽位、旧代数、缩放倍数不同或已关闭页面会被重建"""
+        if slot is not None:
+            generation, slot_scale, context, page = slot
+            if (
+                generation == cls._generation
+                and slot_scale == scale
+                and not page.is_closed()
+            ):
+                return slot
+            await cls._close_slot(slot)
+        context = await cls._browser.new_context(device_scale_factor=scale)
+        try:
+            await context.route("**/*", cls._handle_route)
+            page = await context.new_page()
+        except BaseException:
+            # 被看门狗取消或创建失败时在后台关闭，不阻塞调用方
+            asyncio.create_task(cls._close_slot((cls._generation, scale, context, None)))
+            raise
+        return cls._generation, scale, context, page
+
+    @classmethod
+    async def _handle_route(cls, route: Any) -> None:
+        """应答页面发出的请求：虚拟源下的 HTML 与资源取自内存，其余一律拦截"""
+        url = route.request.url
+        if not url.startswith(ORIGIN + "/"):
+            cls._blocked += 1
+            logger.debug(f"已拦截渲染页面的外部请求: {url}")
+            await route.abort("blockedbyclient")
+            return
+        path = url[len(ORIGIN):].split("?", 1)[0]
+        if path.startswith("/card/"):
+            document = cls._documents.get(path[len("/card/"):])
+            if document is not None:
+                await route.fulfill(
+                    status=200, content_type="text/html; charset=utf-8", body=document
+                )
+
+                return
+        else:
+            resource = AssetRegistry.resolve(path)
+            if resource is not None:
+                body, content_type = resource
+                await route.fulfill(status=200, content_type=content_type, body=body)
+                return
+        await route.fulfill(status=404, body="")
+
+    @staticmethod
+    async def _close_slot(slot: tuple | None) -> None:
+        if slot is None:
+            return
+        try:
+            # Chromium 卡死时关闭也可能无响应，限时放弃
+            await asyncio.wait_for(slot[2].close(), timeout=CLOSE_TIMEOUT)
+        except Exception:
+            pass
+
+    @classmethod
+    async def render(
+        cls, html: str, width: int, height: int | None, scale: float = 2
+    ) -> bytes | None:
+        """将 HTML 渲染为卡片图片字节，渲染队列已满时抛出 RenderQueueFullError"""
+        if cls._browser is None or not cls._browser.is_connected():
+            if not await cls.start():
+                return None
+
+        slot = await cls._acquire()
+        token = uuid4().hex
+        cls._documents[token] = html
+        timer = StageTimer()
+
+        async def run() -> bytes:
+            nonlocal slot
+            slot = await timer.track("open", cls._open_slot(slot, scale))
+            return await cls._render(slot[3], token, width, height, timer)
+
+        try:
+            # 看门狗：打开页面或渲染卡住时整体超时，由下方关闭该槽位
+            data = await asyncio.wait_for(run(), timeout=algo_config.algo_render_timeout)
+            cls._rendered += 1
+            for name, cost in timer.stages.items():
+                cls._stage_samples.setdefault(name, deque(maxlen=100)).append(cost)
+            logger.debug(f"卡片渲染耗时: {timer.summary()}")
+            return data
+        except asyncio.TimeoutError:
+            cls._timeouts += 1
+            logger.error(f"卡片渲染超时，已关闭页面: {timer.summary()}")
+            await cls._close_slot(slot)
+            slot = None
+            return None
+        except Exception as e:
+            logger.error(f"Playwright 截图失败: {e}")
+            await cls._close_slot(slot)
+            slot = None
+            if cls._browser is None or not cls._browser.is_connected():
+                await cls._relaunch()
+            return None
+        finally:
+            cls._slots.put_nowait(slot)  # type: ignore
+            cls._documents.pop(token, None)
+
+    @classmethod
+    async def _render(
+        cls, page: Any, token: str, width: int, height: int | None, timer: StageTimer
+    ) -> bytes:
+        await page.set_viewport_size({"width": int(width), "height": int(height or 1)})
+        # 页面与资源同属虚拟源，字体、图片均可正常加载
+        await timer.track(
+            "navigate", page.goto(f"{ORIGIN}/card/{token}", wait_until="domcontentloaded")
+        )
+        # 超时交给外层看门狗统一处理
+        await timer.track(
+            "ready", page.wait_for_function("window.__algoReady === true", timeout=0)
+        )
+        # 若未指定高度，则截图整页
+        if height is None:
+            options: dict = {"full_page": True}
+        else:
+            options = {"clip": {"x": 0, "y": 0, "width": width, "height": height}}
+        fmt = cls.output_format()
+        quality = max(1, min(100, algo_config.algo_card_quality))
+        if fmt == "jpeg":
+            options.update(type="jpeg", quality=quality)
+        else:
+            options.update(type="png")
+        data = await timer.track("screenshot", page.screenshot(**options))
+        if fmt == "webp" or (fmt == "png" and cls._quantize()):
+            data = await timer.track(
+                "encode",
+                asyncio.to_thread(cls.encode, data, fmt, quality, fmt == "png"),
+            )
+        return data
+
+    @classmethod
+    def _quantize(cls) -> bool:
+        """是否对 png 卡片做调色板量化，缺少 Pillow 时关闭"""
+        if cls._quantize_enabled is None:
+            cls._quantize_enabled = algo_config.algo_card_quantize
+            if cls._quantize_enabled and find_spec("PIL") is None:
+                logger.warning("未安装 Pillow，已跳过调色板量化 (pip install Pillow)")
+                cls._quantize_enabled = False
+        return cls._quantize_enabled
+
+    @classmethod
+    def output_format(cls) -> str:
+        """实际使用的卡片格式，配置无效或缺少 Pillow 时回退为 png"""
+        if cls._format is None:
+            fmt = algo_config.algo_card_format.lower()
+            fmt = "jpeg" if fmt == "jpg" else fmt
+            if fmt not in CARD_FORMATS:
+                logger.warning(
+                    f"不支持的卡片格式 {algo_config.algo_card_format}，已回退到 png"
+                )
+
+                fmt = "png"
+            elif fmt == "webp" and find_spec("PIL") is None:
+                logger.warning("未安装 Pillow，卡片格式已回退到 png (pip install Pillow)")
+                fmt = "png"
+            cls._format = fmt
+        return cls._format
+
+    @classmethod
+    def mimetype(cls) -> str:
+        return f"image/{cls.output_format()}"
+
+    @classmethod
+    def output_settings(cls) -> tuple:
+        """影响卡片图片内容的配置，纳入卡片缓存的摘要"""
+        return (
+            cls.output_format(),
+            algo_config.algo_card_quality,
+            cls._quantize(),
+            algo_config.algo_full_card_scale,
+            algo_config.algo_sample_card_scale,
+        )
+
+    @staticmethod
+    def encode(png: bytes, fmt: str, quality: int, quantize: bool) -> bytes:
+        """用 Pillow 把 PNG 截图转码为 webp，或量化为 256 色调色板 png"""
+        from PIL import Image
+
+        buffer = io.BytesIO()
+        with Image.open(io.BytesIO(png)) as image:
+            image = image.convert("RGB")
+            if fmt == "webp":
+                image.save(buffer, "WEBP", quality=quality, method=4)
+            elif quantize:
+                image = image.quantize(colors=256, method=Image.Quantize.FASTOCTREE)
+                image.save(buffer, "PNG", optimize=True)
+            else:
+                image.save(buffer, "PNG")
+        return buffer.getvalue()
+
+
+driver = get_driver()
+
+
+@driver.on_startup
+async def start_renderer():
+    await Renderer.start()
+
+
+@driver.on_shutdown
+async def stop_renderer():
+    await Renderer.stop()
@@ -0,0 +1,192 @@
+import random
+import asyncio
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict
+
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader, Template
+from nonebot import get_driver
+from nonebot.log import logger
+
+from .config import algo_config, plugin_cache_dir
+from .image_cache import RemoteImageCache
+
+ASSETS_PATH = Path(__file__).resolve().parent / "assets"
+TEMPLATE_DIR = ASSETS_PATH / "template"
+BACKGROUND_DIR = ASSETS_PATH / "background"
+FONT_DIR = ASSETS_PATH / "fonts"
+
+# 渲染页面使用的虚拟源，该源下的请求全部由内存中的资源应答
+ORIGIN = "https://algo.local"
+# 内存中保留的远程图片数量
+REMOTE_LIMIT = 64
+
+MIME_TYPES = {
+    ".webp": "image/webp",
+    ".png": "image/png",
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".ttf": "font/ttf",
+}
+
+FONT_FACES = (
+    # (字体族, 文件名, 字重)
+    ("Baloo 2", "Baloo2-Regular.ttf", "400 800"),
+    ("Noto Sans CJK SC", "NotoSansSC-Regular.ttf", "400"),
+    ("Noto Sans CJK SC", "NotoSansSC-Bold.ttf", "700"),
+)
+
+
+class AssetRegistry:
+    """卡片模板与静态资源注册表
+
+    模板由共享的 jinja2.Environment 编译并缓存字节码；logo、字体、背景图读入内存，
+    以虚拟源 ORIGIN 下的地址交给模板引用，渲染时由 Renderer 拦截请求直接应答。
+    远程图片经 RemoteImageCache 取得后同样以虚拟源地址引用，渲染过程不再访问外网。
+    开启 algo_asset_reload 后按文件修改时间自动重新加载，便于调试模板。
+    """
+
+    _bytecode_dir = plugin_cache_dir / "jinja"
+    _bytecode_dir.mkdir(parents=True, exist_ok=True)
+    env = Environment(
+        loader=FileSystemLoader(str(TEMPLATE_DIR)),
+        bytecode_cache=FileSystemBytecodeCache(str(_bytecode_dir)),
+        auto_reload=algo_config.algo_asset_reload,
+    )
+    # 相对路径 -> (修改时间, 内容, MIME)
+    _files: Dict[str, tuple[float, bytes, str]] = {}
+    # 远程地址摘要 -> (内容, MIME)
+    _remote: "OrderedDict[str, tuple[bytes, str]]" = OrderedDict()
+    _font_faces: str | None = None
+    _backgrounds: list[Path] | None = None
+
+    @classmethod
+    def template(cls, name: str) -> Template:
+        return cls.env.get_template(name)
+
+    @classmethod
+    def render_style(cls, name: str, context: Dict) -> str:
+        return cls.template(name).render(**context)
+
+    @classmethod
+    def _load(cls, rel: str) -> tuple[float, bytes, str] | None:
+        """读取 assets 下的文件到内存，未开启自动重载时只读取一次"""
+        cached = cls._files.get(rel)
+        if cached is not None and not algo_config.algo_asset_reload:
+            return cached
+        path = (ASSETS_PATH / rel).resolve()
+        if ASSETS_PATH not in path.parents:
+            return None
+        try:
+            mtime = path.stat().st_mtime
+            if cached is not None and cached[0] == mtime:
+                return cached
+            mime = MIME_TYPES.get(path.suffix.lower(), "application/octet-stream")
+            entry = (mtime, path.read_bytes(), mime)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"读取本地资源失败: {path} ({e})")
+            return None
+        cls._files[rel] = entry
+        return entry
+
+    @classmethod
+    def url_for(cls, path: Path) -> str:
+        """把本地资源读入内存并返回其虚拟源地址，文件不存在时返回空字符串"""
+        rel = path.resolve().relative_to(ASSETS_PATH).as_posix()
+        if cls._load(rel) is None:
+            return ""
+        return f"{ORIGIN}/assets/{rel}"
+
+    @classmethod
+    def resolve(cls, path: str) -> tuple[bytes, str] | None:
+        """按虚拟源下的路径取出内存中的资源"""
+        if path.startswith("/assets/"):
+            entry = cls._load(path[len("/assets/"):])
+            return (entry[1], entry[2]) if entry is not None else None
+        if path.startswith("/remote/"):
+            key = path[len("/remote/"):]
+            entry = cls._remote.get(key)
+            if entry is not None:
+                cls._remote.move_to_end(key)
+            return entry
+        return None
+
+    @classmethod
+    def register_remote(cls, url: str, content: bytes, mime: str) -> str:
+        """登记已下载的远程图片，返回其虚拟源地址"""
+        key = RemoteImageCache.key(url)
+        cls._remote[key] = (content, mime)
+        cls._remote.move_to_end(key)
+        while len(cls._remote) > REMOTE_LIMIT:
+            cls._remote.popitem(last=False)
+        return f"{ORIGIN}/remote/{key}"
+
+    @classmethod
+    async def fetch_remote(cls, url: str) -> str:
+        """取得远程图片并登记到内存，失败时返回空字符串（模板显示占位）"""
+        if not url:
+            return ""
+        if url.startswith("//"):
+            url = "https:" + url
+        key = RemoteImageCache.key(url)
+        if key in cls._remote and RemoteImageCache.touch(url):
+            # 内存中已有且未过期，连磁盘都不必读取
+            cls._remote.move_to_end(key)
+            return f"{ORIGIN}/remote/{key}"
+        image = await RemoteImageCache.get(url)
+        if image is None:
+            return ""
+        return cls.register_remote(url, *image)
+
+    @classmethod
+    def logo(cls, name: str) -> str:
+        return cls.url_for(ASSETS_PATH / name)
+
+    @classmethod
+    def random_background(cls) -> str:
+        if cls._backgrounds is None or algo_config.algo_asset_reload:
+            cls._backgrounds = sorted(BACKGROUND_DIR.glob("*.webp"))
+        backgrounds = cls._backgrounds
+        if not backgrounds:
+            return ""
+        return cls.url_for(random.choice(backgrounds))
+
+    @classmethod
+    def font_faces(cls) -> str:
+        if cls._font_faces is None or algo_config.algo_asset_reload:
+            faces = []
+            for family, filename, weight in FONT_FACES:
+                url = cls.url_for(FONT_DIR / filename)
+                if not url:
+                    # 缺少的字体交给系统字体回退
+                    continue
+                faces.append(
+                    f"@font-face{{font-family:'{family}';"
+                    f"src:url('{url}') format('truetype');"
+                    f"font-weight:{weight};font-style:normal;font-display:block;}}"
+
+                )
+            cls._font_faces = "".join(faces)
+        return cls._font_faces
+
+    @classmethod
+    def preload(cls) -> None:
+        """预编译模板并把全部静态资源读入内存"""
+        for path in TEMPLATE_DIR.iterdir():
+            if path.suffix in (".html", ".css"):
+                cls.template(path.name)
+        cls._backgrounds = sorted(BACKGROUND_DIR.glob("*.webp"))
+        for path in (*ASSETS_PATH.glob("*.webp"), *cls._backgrounds):
+            cls.url_for(path)
+        cls.font_faces()
+        logger.info(f"卡片资源已预加载，共 {len(cls._files)} 个文件")
+
+
+driver = get_driver()
+
+
+@driver.on_startup
+async def preload_assets():
+    await asyncio.to_thread(AssetRegistry.preload)
@@ -1,103 +1,97 @@
-import shutil
-from pathlib import Path
-from nonebot import require, get_bot
+from datetime import datetime
+from nonebot import require
 from nonebot.log import logger
-from .config import luogu_save_path, cf_save_path
+from .config import algo_config
+from .cache import CardCache
+from .util import ContestIndex
+from .render import Renderer
+from .subscribe import Subscribe
+from .oj.cf.ratings import RatingWatcher
 require("nonebot_plugin_apscheduler")
 from nonebot_plugin_apscheduler import scheduler
 
-luogu_cards_path = luogu_save_path / "cards"
-cf_cards_path = cf_save_path / "cards"
-
-
-async def cleanup_luogu_cards():
-    """清理洛谷卡片文件"""
-    try:
-        if luogu_cards_path.exists():
-            shutil.rmtree(luogu_cards_path)
-            luogu_cards_path.mkdir(parents=True, exist_ok=True)
-            logger.info(f"已清理洛谷卡片目录: {luogu_cards_path}")
-        else:
-            logger.info("洛谷卡片目录不存在，无需清理")
-    except Exception as e:
-        logger.error(f"清理洛谷卡片时发生错误: {e}")
-
-
-async def cleanup_cf_cards():
-    """清理 CF 卡片文件"""
-    try:
-        if cf_cards_path.exists():
-            shutil.rmtree(cf_cards_path)
-            cf_cards_path.mkdir(parents=True, exist_ok=True)
-            logger.info(f"已清理 CF 卡片目录: {cf_cards_path}")
-        else:
-            logger.info("CF 卡片目录不存在，无需清理")
-    except Exception as e:
-        logger.error(f"清理 CF 卡片时发生错误: {e}")
+async def sweep_card_caches():
+    """按保留时间与大小上限清理卡片目录"""
+    for cache in CardCache.instances.values():
+        try:
+            removed = await cache.sweep()
+            if removed:
+                logger.info(f"卡片目录({cache.name})已淘汰 {removed} 张卡片")
+        except Exception as e:
+            logger.error(f"清理卡片目录({cache.name})时发生错误: {e}")
 
 
 def init_scheduler():
     """初始化定时任务"""
-    # 每天3次执行洛谷清理任务
+    # 每 30 分钟按保留时间与大小上限清理卡片目录
     scheduler.add_job(
-        cleanup_luogu_cards,
-        "cron",
-        hour=2,
-        minute=0,
-        id="cleanup_luogu_cards_2",
-        name="清理洛谷卡片(2点)",
-        replace_existing=True,
-    )
-    scheduler.add_job(
-        cleanup_luogu_cards,
-        "cron",
-        hour=10,
-        minute=0,
-        id="cleanup_luogu_cards_10",
-        name="清理洛谷卡片(10点)",
-        replace_existing=True,
-    )
-    scheduler.add_job(
-        cleanup_luogu_cards,
-        "cron",
-        hour=18,
-        minute=0,
-        id="cleanup_luogu_cards_18",
-        name="清理洛谷卡片(18点)",
+        sweep_card_caches,
+        "interval",
+        minutes=30,
+        id="algo_card_cache_sweep",
+        name="清理卡片目录",
         replace_existing=True,
     )
 
-    # 每天3次执行 CF 清理任务
+    # 每 5 分钟检查一次渲染浏览器，崩溃时自动重启
     scheduler.add_job(
-        cleanup_cf_cards,
-        "cron",
-        hour=2,
-        minute=0,
-        id="cleanup_cf_cards_2",
-        name="清理CF卡片(2点)",
+        Renderer.health_check,
+        "interval",
+        minutes=5,
+        id="algo_renderer_health_check",
+        name="卡片渲染服务健康检查",
         replace_existing=True,
     )
+
+    # 每 30 分钟把进入提醒窗口的订阅注册为定时任务
     scheduler.add_job(
-        cleanup_cf_cards,
-        "cron",
-        hour=10,
-        minute=0,
-        id="cleanup_cf_cards_10",
-        name="清理CF卡片(10点)",
+        Subscribe.fill_reminder_window,
+        "interval",
+        minutes=30,
+        id="algo_remind_window_fill",
+        name="补充比赛提醒任务",
         replace_existing=True,
     )
+
+    # 每 10 分钟清理一次比赛已结束的订阅
     scheduler.add_job(
-        cleanup_cf_cards,
-        "cron",
-        hour=18,
-        minute=0,
-        id="cleanup_cf_cards_18",
-        name="清理CF卡片(18点)",
+        Subscribe.cleanup_expired_subscriptions,
+        "interval",
+        minutes=10,
+        id="algo_subscribe_expiry_sweep",
+        name="清理过期订阅",
         replace_existing=True,
     )
 
-    logger.info("洛谷卡片清理定时任务已启动，每天2点、10点、18点执行")
-    logger.info("CF卡片清理定时任务已启动，每天2点、10点、18点执行")
+    # 每 10 分钟检查已结束的 CF 比赛是否公布了 rating 变化
+    if (
+        algo_config.algo_cf_rating_notify
+        and algo_config.algo_contest_refresh > 0
+        and algo_config.clist_api_key
+    ):
+
+        scheduler.add_job(
+            RatingWatcher.tick,
+            "interval",
+            minutes=10,
+            id="algo_cf_rating_watch",
+            name="CF rating 变化通知",
+            replace_existing=True,
+        )
+
+    # 定时刷新比赛索引，启动后立即执行一次
+    if algo_config.algo_contest_refresh > 0 and algo_config.clist_api_key:
+        scheduler.add_job(
+            ContestIndex.refresh,
+            "interval",
+            minutes=algo_config.algo_contest_refresh,
+            next_run_time=datetime.now(),
+            id="algo_contest_index_refresh",
+            name="刷新比赛索引",
+            replace_existing=True,
+        )
+
+    logger.info("卡片目录清理定时任务已启动，每 30 分钟执行")
 
 
 # 在模块导入时自动初始化定时任务
@@ -0,0 +1,46 @@
+import asyncio
+from typing import Awaitable, Callable, Hashable, TypeVar
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    """合并并发的相同请求
+
+    同一个键同一时刻只执行一次，执行期间到达的调用方共享同一个结果（或异常）。
+    """
+
+    instances: dict[str, "SingleFlight"] = {}
+
+    def __init__(self, name: str):
+        self.name = name
+        self._calls: dict[Hashable, asyncio.Future] = {}
+        self.executed = 0
+        self.shared = 0
+        SingleFlight.instances[name] = self
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[T]]) -> T:
+        future = self._calls.get(key)
+        if future is not None:
+            self.shared += 1
+        else:
+            self.executed += 1
+            future = asyncio.ensure_future(func())
+            self._calls[key] = future
+            future.add_done_callback(lambda f: self._forget(key, f))
+        # shield：某个调用方被取消时不影响其他共享结果的调用方
+        return await asyncio.shield(future)
+
+    def _forget(self, key: Hashable, future: asyncio.Future) -> None:
+        if self._calls.get(key) is future:
+            del self._calls[key]
+        if not future.cancelled():
+            # 标记异常已被读取，避免所有调用方都取消时输出未处理异常警告
+            future.exception()
+
+    def stats(self) -> dict:
+        return {
+            "executed": self.executed,
+            "shared": self.shared,
+            "in_flight": len(self._calls),
+        }
@@ -1,31 +1,20 @@
-import json
-import os
 from datetime import timedelta, datetime
 from typing import Dict, List, Optional, Union
 from nonebot.log import logger
 from nonebot import require
 require("nonebot_plugin_apscheduler")
 from nonebot_plugin_apscheduler import scheduler
-from .config import algo_config,subscribe_save_path
+from .config import algo_config
 from .util import Util
+from .subscribe_store import SubscribeManager
+from .outbox import Outbox
 
 class Subscribe:
-    # 订阅数据文件路径
-    save_path = subscribe_save_path
-
-    def __init__(self):
-        self._ensure_data_dir()
-        self.subscribes = self._load_subscribes()
-    
     @staticmethod
     def _get_key(group_id: str, user_id: Optional[str] = None) -> str:
         """获取存储键：私聊场景使用用户ID，群聊使用群ID"""
         return user_id if group_id == "null" and user_id else group_id
     
-    def _ensure_data_dir(self):
-        """确保数据目录存在"""
-        os.makedirs(os.path.dirname(self.save_path), exist_ok=True)
-    
     @staticmethod
     def _parse_datetime(dt_str: Union[str, datetime]) -> Optional[datetime]:
         """统一解析日期时间"""
@@ -41,44 +30,19 @@ class Subscribe:
             except ValueError:
                 return None
 
-    def _load_subscribes(self) -> Dict[str, List[Dict]]:
-        """加载订阅数据"""
-        try:
-            if os.path.exists(self.save_path):
-                with open(self.save_path, 'r', encoding='utf-8') as f:
-                    return json.load(f)
-        except Exception as e:
-            logger.error(f"加载订阅数据失败: {e}")
-        return {}
-    
-    def _save_subscribes(self):
-        """保存订阅数据"""
-        try:
-            with open(self.save_path, 'w', encoding='utf-8') as f:
-                json.dump(self.subscribes, f, ensure_ascii=False, indent=2)
-            logger.info(f"订阅数据已保存: {self.save_path}")
-        except Exception as e:
-            logger.error(f"保存订阅数据失败: {e} (path={self.save_path})")
-    
-    def add_subscribe(
-        self, 
+    @classmethod
+    async def add_subscribe(
+        cls,
         group_id: str, 
         contest_id: str, 
         event: str, 
         start_time: datetime, 
         user_id: Optional[str] = None, 
-        href: Optional[str] = None
+        href: Optional[str] = None,
+        end_time: Optional[datetime] = None
     ):
         """添加订阅"""
-        key = self._get_key(group_id, user_id)
-        if key not in self.subscribes:
-            self.subscribes[key] = [] #type: ignore
-        
-        # 检查是否已订阅
-        for sub in self.subscribes[key]: #type: ignore
-            if sub.get('contest_id') == contest_id:
-                return False, "该比赛已订阅"
-        
+        key = cls._get_key(group_id, user_id)
         subscribe_info = {
             'contest_id': contest_id,
             'event': event,
@@ -87,105 +51,142 @@ class Subscribe:
             'user_id': user_id,
             'group_id': group_id,
             'remind_time': (start_time - timedelta(minutes=algo_config.algo_remind_pre)).isoformat(),
-            'href': href
+            'href': href,
+            'end_time': end_time.isoformat() if end_time else None
         }
         
-        self.subscribes[key].append(subscribe_info) #type: ignore
-        self._save_subscribes()
+        # 主键为 (会话键, 比赛id)，重复订阅不会写入
+        if not await SubscribeManager.add(key, subscribe_info):
+            return False, "该比赛已订阅"
         return True, "订阅成功"
     
-    def remove_subscribe(
-        self, 
+    @classmethod
+    async def remove_subscribe(
+        cls,
         group_id: str, 
         contest_id: str, 
         user_id: Optional[str] = None
     ) -> bool:
         """取消订阅"""
-        key = self._get_key(group_id, user_id)
-        if key not in self.subscribes:
-            return False
-        
-        for i, sub in enumerate(self.subscribes[key]):
-            if sub.get('contest_id') == contest_id:
-                del self.subscribes[key][i]
-                self._save_subscribes()
-                return True
-        return False
+        key = cls._get_key(group_id, user_id)
+        return await SubscribeManager.remove(key, contest_id) is not None
     
-    def get_group_subscribes(
-        self, 
+    @classmethod
+    async def get_group_subscribes(
+        cls,
         group_id: str, 
         user_id: Optional[str] = None
     ) -> List[Dict]:
         """获取订阅列表"""
-        key = self._get_key(group_id, user_id)
-        return self.subscribes.get(key, []) #type: ignore
+        key = cls._get_key(group_id, user_id)
+        return await SubscribeManager.list_chat(key)
     
-    def clear_group_subscribes(
-        self, 
+    @classmethod
+    async def clear_group_subscribes(
+        cls,
         group_id: str, 
         user_id: Optional[str] = None
-    ) -> bool:
-        """清空所有订阅"""
-        key = self._get_key(group_id, user_id)
-        if key in self.subscribes:
-            del self.subscribes[key]
-            self._save_subscribes()
-            return True
-        return False
+    ) -> List[Dict]:
+        """清空所有订阅，返回被清空的订阅"""
+        key = cls._get_key(group_id, user_id)
+        return await SubscribeManager.clear(key)
+
+    @staticmethod
+    def _job_id(contest_id: str) -> str:
+        return f"contest_reminder_{contest_id}"
+
+    @staticmethod
+    def _window_end() -> datetime:
+        """滚动窗口的终点，只有提醒时间在此之前的比赛才注册定时任务"""
+        window = timedelta(hours=algo_config.algo_remind_window)
+        return datetime.now().astimezone() + window
 
     @classmethod
-    async def send_contest_reminder(cls, contest_info: dict):
-        """发送比赛提醒"""
-        logger.info(f"比赛提醒: {contest_info['event']}")
-        
+    def _schedule_contest(cls, contest_id: str, remind_time: datetime) -> None:
+        """为比赛注册唯一的提醒任务，触发时向全部订阅者发送"""
+        job = scheduler.get_job(cls._job_id(contest_id))
+        next_run = job.next_run_time if job is not None else None
+        if next_run is not None and next_run <= remind_time:
+
+            # 已有更早的任务，触发时会为较晚的订阅重新注册
+            return
+        scheduler.add_job(
+            func=cls.send_contest_reminders,
+            args=(contest_id,),
+            trigger="date",
+            run_date=remind_time,
+            id=cls._job_id(contest_id),
+            replace_existing=True
+        )
+
+    @classmethod
+    async def _unschedule_if_empty(cls, contest_id: str) -> None:
+        """比赛已无订阅者时删除其提醒任务"""
+        if await SubscribeManager.subscribers(contest_id):
+            return
+        try:
+            scheduler.remove_job(cls._job_id(contest_id))
+        except Exception:
+            pass
+
+    @classmethod
+    async def send_contest_reminders(cls, contest_id: str):
+        """把某场比赛到期的提醒批量写入发件箱，并批量移除对应订阅"""
+        subscribers = await SubscribeManager.subscribers(contest_id)
+        # 留出少量余量，避免调度误差导致漏发
+        deadline = datetime.now().astimezone() + timedelta(minutes=1)
+        due, later = [], []
+        for key, sub in subscribers:
+            remind_time = cls._parse_datetime(sub['remind_time'])
+            if remind_time is not None and remind_time.tzinfo is None:
+                remind_time = remind_time.astimezone()
+            if remind_time is not None and remind_time > deadline:
+                later.append(remind_time)
+            else:
+                due.append((key, sub))
+
+        # 提醒写入发件箱后即视为完成，由发件箱负责限流、重试与重启后的续发
+        built = (cls.build_reminder(key, sub) for key, sub in due)
+        queued = await Outbox.enqueue([msg for msg in built if msg])
+        removed = await SubscribeManager.remove_many(
+            [(key, sub["contest_id"]) for key, sub in due]
+        )
+        logger.info(f"比赛 {contest_id} 提醒已入队 {queued} 条，移除订阅 {removed} 个")
+
+        # 比赛改期后新订阅的提醒时间更晚，按最早的一个重新注册任务
+        if later:
+            cls._schedule_contest(contest_id, min(later))
+
+    @classmethod
+    def build_reminder(cls, key: str, contest_info: dict) -> Optional[Dict]:
+        """构造单个会话的比赛提醒消息，无法确定发送目标时返回 None"""
         # 获取本地时间
         dt = cls._parse_datetime(contest_info['start_time'])
         local_time = dt.strftime('%Y-%m-%d %H:%M') if dt else str(contest_info['start_time'])
         
         # 构建提醒消息
-        message = f"🔔比赛提醒\n\n"
+        message = "🔔比赛提醒\n\n"
         message += f"🏆比赛名称: {contest_info['event']}\n"
         message += f"⏰开始时间: {local_time}\n"
-        message += f"🔗比赛链接: {contest_info.get('href', '无链接')}"
+        message += f"🔗比赛链接: {contest_info.get('href') or '无链接'}"
         
-        try:
-            # 使用 Bot 发送消息
-            from nonebot import get_bot
-            bot = get_bot()
-            
-            # 根据是否有群组ID决定发送方式
-            if contest_info.get("group_id") and contest_info.get("group_id") != "null":
-                await bot.send_group_msg(
-                    group_id=contest_info["group_id"],
-                    message=message
-                )
-            elif contest_info.get("user_id"):
-                await bot.send_private_msg(
-                    user_id=contest_info["user_id"],
-                    message=message
-                )
-            
-            # 发送成功后，移除该场比赛的订阅记录
-            try:
-                subscribe_manager = Subscribe()
-                group_id = contest_info.get("group_id", "null")
-                user_id = contest_info.get("user_id")
-                contest_id = str(contest_info.get("contest_id", ""))
-                if contest_id:
-                    removed = subscribe_manager.remove_subscribe(group_id, contest_id, user_id)
-                    if removed:
-                        logger.info(f"已移除订阅: {contest_info.get('event')} (contest_id={contest_id})")
-                    else:
-                        logger.info(f"未找到订阅以移除: {contest_info.get('event')} (contest_id={contest_id})")
-            except Exception as e:
-                logger.error(f"发送后移除订阅失败: {e}")
+        # 根据是否有群组ID决定发送方式
+        if contest_info.get("group_id") and contest_info.get("group_id") != "null":
+            target_type, target_id = "group", contest_info["group_id"]
+        elif contest_info.get("user_id"):
+            target_type, target_id = "private", contest_info["user_id"]
+        else:
+            return None
+        return {
+            "target_type": target_type,
+            "target_id": target_id,
+            "message": message,
+            # 同一会话同一次提醒只入队一次
+            "dedup_key": (
+                f"remind:{key}:{contest_info['contest_id']}:{contest_info['remind_time']}"
+            ),
 
-            # 发送成功后，清理已过期的订阅
-            await cls.cleanup_expired_subscriptions()
-            
-        except Exception as e:
-            logger.error(f"发送比赛提醒失败: {e}")
+        }
 
     @classmethod
     async def subscribe_contest(
@@ -216,22 +217,6 @@ class Subscribe:
             if contest is None:
                 return False, f"未找到{algo_config.algo_remind_pre}分钟后的比赛，无法订阅"
             
-            # 创建订阅实例
-            subscribe_manager = Subscribe()
-            
-            # 添加订阅
-            success, msg = subscribe_manager.add_subscribe(
-                group_id=group_id,
-                contest_id=str(contest['id']),
-                event=contest['event'],
-                start_time=Util.utc_to_local(contest['start']),
-                user_id=user_id,
-                href=contest.get('href')
-            )
-            
-            if not success:
-                return False, msg
-            
             # 设置定时提醒
             remind_time = local_start_time - timedelta(minutes=algo_config.algo_remind_pre) #type: ignore
             
@@ -245,25 +230,33 @@ class Subscribe:
             if remind_time <= current_time: #type: ignore
                 return False, "比赛即将开始，无法订阅"
             
-            # 添加定时任务
-            key = cls._get_key(group_id, user_id)
-            job_id = f"contest_reminder_{key}_{contest['id']}"
-            scheduler.add_job(
-                func=cls.send_contest_reminder,
-                args=({
-                    'group_id': group_id,
-                    'user_id': user_id,
-                    'contest_id': str(contest['id']),
-                    'event': contest['event'],
-                    'start_time': Util.utc_to_local(contest['start']),
-                    'href': contest.get('href', '')
-                },),
-                trigger="date",
-                run_date=remind_time,
-                id=job_id,
-                replace_existing=True
+            # 结束时间用于清理过期订阅，优先使用 clist 提供的结束时间或时长
+            if contest.get('end'):
+                end_time = Util.utc_to_local(contest['end'])
+            elif contest.get('duration'):
+                end_time = local_start_time + timedelta(seconds=int(contest['duration']))
+            else:
+                end_time = None
+
+            # 添加订阅
+            success, msg = await cls.add_subscribe(
+                group_id=group_id,
+                contest_id=str(contest['id']),
+                event=contest['event'],
+                start_time=Util.utc_to_local(contest['start']),
+                user_id=user_id,
+                href=contest.get('href'),
+                end_time=end_time
             )
             
+            if not success:
+                return False, msg
+
+            # 每场比赛只有一个提醒任务，订阅者在触发时统一读取；
+            # 窗口之外的提醒留在索引中，由定时补充任务在进入窗口时注册
+            if remind_time <= cls._window_end():
+                cls._schedule_contest(str(contest['id']), remind_time)
+
             return True, f"订阅成功！比赛：{contest['event']}，将在 {remind_time.strftime('%Y-%m-%d %H:%M')} 提醒" #type: ignore
             
         except Exception as e:
@@ -279,17 +272,10 @@ class Subscribe:
     ) -> tuple[bool, str]:
         """取消订阅比赛"""
         try:
-            subscribe_manager = Subscribe()
-            
             # 取消订阅
-            if subscribe_manager.remove_subscribe(group_id, contest_id, user_id):
-                # 删除定时任务
-                key = Subscribe._get_key(group_id, user_id)
-                job_id = f"contest_reminder_{key}_{contest_id}"
-                try:
-                    scheduler.remove_job(job_id)
-                except:
-                    pass
+            if await cls.remove_subscribe(group_id, contest_id, user_id):
+                # 没有其他订阅者时删除定时任务
+                await cls._unschedule_if_empty(contest_id)
                 return True, "取消订阅成功"
             else:
                 return False, "未找到该订阅"
@@ -306,8 +292,7 @@ class Subscribe:
     ) -> str:
         """列出订阅"""
         try:
-            subscribe_manager = Subscribe()
-            subscribes = subscribe_manager.get_group_subscribes(group_id, user_id)
+            subscribes = await cls.get_group_subscribes(group_id, user_id)
             
             if not subscribes:
                 return "当前暂无订阅"
@@ -344,79 +329,50 @@ class Subscribe:
     ) -> tuple[bool, str]:
         """清空所有订阅"""
         try:
-            subscribe_manager = Subscribe()
-            
-            # 获取当前订阅
-            subscribes = subscribe_manager.get_group_subscribes(group_id, user_id)
-            
-            # 删除所有定时任务
-            key = Subscribe._get_key(group_id, user_id)
-            for sub in subscribes:
-                job_id = f"contest_reminder_{key}_{sub['contest_id']}"
-                try:
-                    scheduler.remove_job(job_id)
-                except:
-                    pass
-            
             # 清空订阅
-            if subscribe_manager.clear_group_subscribes(group_id, user_id):
-                return True, f"已清空 {len(subscribes)} 个订阅"
-            else:
+            subscribes = await cls.clear_group_subscribes(group_id, user_id)
+            if not subscribes:
                 return False, "当前暂无订阅"
+            
+            # 删除已无订阅者的比赛的定时任务
+            for sub in subscribes:
+                await cls._unschedule_if_empty(sub['contest_id'])
+            return True, f"已清空 {len(subscribes)} 个订阅"
                 
         except Exception as e:
             logger.exception(f"清空订阅失败: {e}")
             return False, f"清空订阅失败：{str(e)}"
 
+    @classmethod
+    async def fill_reminder_window(cls) -> int:
+        """把提醒时间进入滚动窗口的订阅注册为定时任务，返回新注册的比赛数"""
+        now = datetime.now().astimezone()
+        contests: Dict[str, tuple[datetime, str]] = {}
+        # 索引按提醒时间排序，每场比赛第一次出现的就是最早的提醒时间
+        for key, sub in await SubscribeManager.take_reminders(cls._window_end()):
+            remind_time = cls._parse_datetime(sub['remind_time'])
+            if remind_time is not None and remind_time.tzinfo is None:
+                remind_time = remind_time.astimezone()
+            # 关闭期间错过的提醒不再补发，由过期清理删除
+            if not remind_time or remind_time <= now or sub['contest_id'] in contests:
+                continue
+            contests[sub['contest_id']] = (remind_time, sub['event'])
+
+        scheduled_count = 0
+        for contest_id, (remind_time, event) in contests.items():
+            try:
+                cls._schedule_contest(contest_id, remind_time)
+                scheduled_count += 1
+                logger.debug(f"注册定时任务: {event} -> {remind_time}")
+            except Exception as e:
+                logger.error(f"注册定时任务失败 {event}: {e}")
+        return scheduled_count
+
     @classmethod
     async def restore_scheduled_jobs(cls):
-        """恢复所有定时任务"""
+        """恢复滚动窗口内的定时任务"""
         try:
-            subscribe_manager = Subscribe()
-            restored_count = 0
-            
-            # 遍历所有订阅
-            for key, subscribes in subscribe_manager.subscribes.items():
-                for sub in subscribes:
-                    try:
-                        # 解析提醒时间
-                        remind_time = cls._parse_datetime(sub['remind_time'])
-                        if not remind_time:
-                            continue
-                            
-                        # 检查是否已经过了提醒时间
-                        if remind_time.tzinfo is None:
-                            now = datetime.now()
-                        else:
-                            now = datetime.now(remind_time.tzinfo)
-                        if remind_time <= now:
-                            logger.info(f"跳过已过期的定时任务: {sub['event']}")
-                            continue
-                        
-                        # 重新创建定时任务
-                        job_id = f"contest_reminder_{key}_{sub['contest_id']}"
-                        scheduler.add_job(
-                            func=cls.send_contest_reminder,
-                            args=({
-                                'group_id': sub.get('group_id'),
-                                'user_id': sub.get('user_id'),
-                                'contest_id': sub.get('contest_id'),
-                                'event': sub['event'],
-                                'start_time': datetime.fromisoformat(sub['start_time']).strftime('%Y-%m-%d %H:%M'),
-                                'href': sub.get('href', '')
-                            },),
-                            trigger="date",
-                            run_date=remind_time,
-                            id=job_id,
-                            replace_existing=True
-                        )
-                        restored_count += 1
-                        logger.info(f"恢复定时任务: {sub['event']} -> {remind_time}")
-                        
-                    except Exception as e:
-                        logger.error(f"恢复定时任务失败 {sub.get('event', 'unknown')}: {e}")
-                        continue
-            
+            restored_count = await cls.fill_reminder_window()
             logger.info(f"成功恢复 {restored_count} 个定时任务")
             return restored_count
             
@@ -428,43 +384,11 @@ class Subscribe:
     async def cleanup_expired_subscriptions(cls):
         """清理已过期的订阅"""
         try:
-            subscribe_manager = Subscribe()
-            cleaned_count = 0
-            
-            # 遍历所有订阅
-            for key, subscribes in list(subscribe_manager.subscribes.items()):
-                # 使用列表副本进行迭代，以便在迭代过程中删除元素
-                for sub in list(subscribes):
-                    try:
-                        # 解析比赛开始时间
-                        start_time = cls._parse_datetime(sub['start_time'])
-                        if not start_time:
-                            continue
-                        
-                        # 检查比赛是否已经结束（假设比赛持续2小时）
-                        end_time = start_time + timedelta(hours=2)
-                        if start_time.tzinfo is None:
-                            now = datetime.now()
-                        else:
-                            now = datetime.now(start_time.tzinfo)
-                        
-                        if end_time < now:
-                            # 比赛已结束，删除订阅
-                            subscribes.remove(sub)
-                            cleaned_count += 1
-                            logger.info(f"清理过期订阅: {sub['event']}")
-                            
-                    except Exception as e:
-                        logger.error(f"清理订阅时出错 {sub.get('event', 'unknown')}: {e}")
-                        continue
-                
-                # 如果该键下没有订阅了，删除整个键
-                if not subscribes:
-                    del subscribe_manager.subscribes[key]
-            
-            # 保存更改
+            # 按比赛结束时间排序的索引只取出已结束的订阅
+            now = datetime.now().astimezone()
+            cleaned_count = await SubscribeManager.remove_expired(now)
+
             if cleaned_count > 0:
-                subscribe_manager._save_subscribes()
                 logger.info(f"清理了 {cleaned_count} 个过期订阅")
             
             return cleaned_count
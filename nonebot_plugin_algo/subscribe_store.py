@@ -0,0 +1,460 @@
+import json
+import time
+import heapq
+import sqlite3
+import asyncio
+import threading
+from datetime import datetime
+from typing import Callable, Dict, List, TypeVar
+
+from nonebot.log import logger
+
+from .config import subscribe_db_path, subscribe_save_path
+
+T = TypeVar("T")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS subscribes (
+    chat_key TEXT NOT NULL,
+    contest_id TEXT NOT NULL,
+    event TEXT NOT NULL,
+    start_time TEXT NOT NULL,
+    start_at REAL NOT NULL,
+    remind_time TEXT NOT NULL,
+    remind_at REAL NOT NULL,
+    subscribe_time TEXT NOT NULL,
+    group_id TEXT,
+    user_id TEXT,
+    href TEXT,
+    end_time TEXT,
+    end_at REAL,
+    PRIMARY KEY (chat_key, contest_id)
+);
+CREATE INDEX IF NOT EXISTS idx_subscribes_contest ON subscribes (contest_id);
+CREATE INDEX IF NOT EXISTS idx_subscribes_remind ON subscribes (remind_at);
+"""
+
+COLUMNS = (
+    "chat_key",
+    "contest_id",
+    "event",
+    "start_time",
+    "start_at",
+    "remind_time",
+    "remind_at",
+    "subscribe_time",
+    "group_id",
+    "user_id",
+    "href",
+    "end_time",
+    "end_at",
+)
+UPSERT_SQL = (
+    f"INSERT OR REPLACE INTO subscribes ({', '.join(COLUMNS)}) "
+    f"VALUES ({', '.join('?' for _ in COLUMNS)})"
+)
+
+# clist 未提供比赛时长时按 2 小时估计结束时间
+DEFAULT_DURATION = 2 * 3600
+
+# 与旧版 subscribes.json 中每条订阅相同的字段
+FIELDS = (
+    "contest_id",
+    "event",
+    "start_time",
+    "subscribe_time",
+    "user_id",
+    "group_id",
+    "remind_time",
+    "href",
+    "end_time",
+)
+
+
+class SubscribeStore:
+    """订阅数据的 SQLite 存储
+
+    使用 WAL 模式，主键为 (会话键, 比赛id)，另按比赛id与提醒时间建索引。
+    所有读写在线程中执行，不阻塞事件循环；首次启动时自动导入旧版 subscribes.json。
+    业务代码通过 SubscribeManager 访问，这里只负责整体读取与批量写入。
+    """
+
+    _conn: sqlite3.Connection | None = None
+    _closed = False
+    _lock = threading.Lock()
+
+    @staticmethod
+    def _timestamp(value: str) -> float:
+        dt = datetime.fromisoformat(value)
+        if dt.tzinfo is None:
+            dt = dt.astimezone()
+        return dt.timestamp()
+
+    @classmethod
+    def remind_at(cls, sub: Dict) -> float:
+        return cls._timestamp(sub["remind_time"])
+
+    @classmethod
+    def end_at(cls, sub: Dict) -> float:
+        """订阅比赛的结束时间戳，旧数据没有结束时间时按开始时间估计"""
+        if sub.get("end_time"):
+            return cls._timestamp(sub["end_time"])
+        return cls._timestamp(sub["start_time"]) + DEFAULT_DURATION
+
+    @classmethod
+    def _row(cls, chat_key: str, sub: Dict) -> tuple:
+        return (
+            chat_key,
+            str(sub["contest_id"]),
+            sub["event"],
+            sub["start_time"],
+            cls._timestamp(sub["start_time"]),
+            sub["remind_time"],
+            cls._timestamp(sub["remind_time"]),
+            sub["subscribe_time"],
+            sub.get("group_id"),
+            sub.get("user_id"),
+            sub.get("href"),
+            sub.get("end_time"),
+            cls.end_at(sub),
+        )
+
+    @staticmethod
+    def _to_dict(row: sqlite3.Row) -> Dict:
+        return {field: row[field] for field in FIELDS}
+
+    @classmethod
+    def _connect(cls) -> sqlite3.Connection:
+        if cls._conn is None:
+            if cls._closed:
+                # 关闭后不再悄悄重新打开，避免迁移与导入重跑、连接泄漏
+                raise RuntimeError("订阅数据库已关闭")
+            subscribe_db_path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(subscribe_db_path, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(SCHEMA)
+            cls._migrate(conn)
+            cls._import_json(conn)
+            cls._conn = conn
+        return cls._conn
+
+    @classmethod
+    def _migrate(cls, conn: sqlite3.Connection) -> None:
+        """为旧版数据库补充比赛结束时间列"""
+        columns = {row["name"] for row in conn.execute("PRAGMA table_info(subscribes)")}
+        if "end_at" not in columns:
+            with conn:
+                conn.execute("ALTER TABLE subscribes ADD COLUMN end_time TEXT")
+                conn.execute("ALTER TABLE subscribes ADD COLUMN end_at REAL")
+                conn.execute(
+                    "UPDATE subscribes SET end_at = start_at + ?", (DEFAULT_DURATION,)
+                )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_subscribes_end ON subscribes (end_at)"
+        )
+
+
+    @classmethod
+    def _import_json(cls, conn: sqlite3.Connection) -> None:
+        """导入旧版 subscribes.json，导入后重命名为 .bak"""
+        if not subscribe_save_path.exists():
+            return
+        try:
+            with open(subscribe_save_path, "r", encoding="utf-8") as f:
+                data: Dict[str, List[Dict]] = json.load(f)
+            rows = []
+            for chat_key, subs in data.items():
+                for sub in subs:
+                    try:
+                        rows.append(cls._row(chat_key, sub))
+                    except (KeyError, TypeError, ValueError) as e:
+                        event = sub.get("event", "unknown")
+                        logger.warning(f"跳过无法导入的订阅 {event}: {e}")
+
+            with conn:
+                conn.executemany(UPSERT_SQL.replace("OR REPLACE", "OR IGNORE"), rows)
+            subscribe_save_path.replace(subscribe_save_path.with_suffix(".json.bak"))
+            logger.info(f"已从 {subscribe_save_path.name} 导入 {len(rows)} 条订阅")
+        except Exception as e:
+            logger.error(f"导入旧版订阅数据失败: {e}")
+
+    @classmethod
+    def _call(cls, func: Callable[[sqlite3.Connection], T]) -> T:
+        with cls._lock:
+            conn = cls._connect()
+            with conn:
+                return func(conn)
+
+    @classmethod
+    async def _run(cls, func: Callable[[sqlite3.Connection], T]) -> T:
+        return await asyncio.to_thread(cls._call, func)
+
+    @classmethod
+    def _load_all(cls, conn: sqlite3.Connection) -> List[tuple[str, Dict]]:
+        rows = conn.execute("SELECT * FROM subscribes").fetchall()
+        return [(row["chat_key"], cls._to_dict(row)) for row in rows]
+
+    @classmethod
+    async def load_all(cls) -> List[tuple[str, Dict]]:
+        """读取全部订阅，返回 (会话键, 订阅) 列表"""
+        return await cls._run(cls._load_all)
+
+    @classmethod
+    async def apply(
+        cls, upserts: List[tuple[str, Dict]], deletes: List[tuple[str, str]]
+    ) -> None:
+        """在同一个事务中写入与删除一批订阅"""
+        rows = [cls._row(chat_key, sub) for chat_key, sub in upserts]
+
+        def apply(conn: sqlite3.Connection) -> None:
+            if deletes:
+                conn.executemany(
+                    "DELETE FROM subscribes WHERE chat_key = ? AND contest_id = ?",
+                    deletes,
+                )
+
+            if rows:
+                conn.executemany(UPSERT_SQL, rows)
+
+        await cls._run(apply)
+
+    @classmethod
+    def close(cls) -> None:
+        with cls._lock:
+            cls._closed = True
+            if cls._conn is not None:
+                cls._conn.close()
+                cls._conn = None
+
+
+class SubscribeManager:
+    """进程内常驻的订阅管理器
+
+    启动后从 SubscribeStore 读取一次全部订阅，之后的读取都在内存中完成。
+    写入先修改内存并记入待写队列，同一订阅的多次修改只保留最后一次，
+    由后台任务延迟 FLUSH_DELAY 秒后在一个事务中批量落盘；Bot 关闭时保证全部写入。
+    内存修改均在事件循环内同步完成，并发命令不会互相覆盖。
+    """
+
+    FLUSH_DELAY = 1.0
+
+    # 会话键 -> 比赛id -> 订阅
+    _subs: Dict[str, Dict[str, Dict]] = {}
+    # 比赛id -> 订阅了该比赛的会话键
+    _by_contest: Dict[str, set[str]] = {}
+    # (比赛结束时间戳, 会话键, 比赛id) 小根堆，删除订阅时不移除，出堆时再核对
+    _expiry: List[tuple[float, str, str]] = []
+    # (提醒时间戳, 会话键, 比赛id) 小根堆，取出后即由调度器负责，同样在出堆时核对
+    _reminders: List[tuple[float, str, str]] = []
+    _loaded = False
+    _load_lock = asyncio.Lock()
+    _flush_lock = asyncio.Lock()
+    # (会话键, 比赛id) -> 订阅，None 表示删除
+    _dirty: Dict[tuple[str, str], Dict | None] = {}
+    _flush_handle: asyncio.TimerHandle | None = None
+    _flush_task: asyncio.Task | None = None
+    flushes = 0
+
+    @classmethod
+    async def load(cls) -> None:
+        if cls._loaded:
+            return
+        async with cls._load_lock:
+            if cls._loaded:
+                return
+            subs: Dict[str, Dict[str, Dict]] = {}
+            by_contest: Dict[str, set[str]] = {}
+            for chat_key, sub in await SubscribeStore.load_all():
+                subs.setdefault(chat_key, {})[sub["contest_id"]] = sub
+                by_contest.setdefault(sub["contest_id"], set()).add(chat_key)
+            cls._subs = subs
+            cls._by_contest = by_contest
+            cls._expiry = cls._heap(SubscribeStore.end_at)
+            cls._reminders = cls._heap(SubscribeStore.remind_at)
+            cls._loaded = True
+            logger.info(f"订阅数据已加载，共 {sum(len(v) for v in subs.values())} 条")
+
+    @classmethod
+    def _mark(cls, chat_key: str, contest_id: str, sub: Dict | None) -> None:
+        cls._dirty[(chat_key, contest_id)] = sub
+        if cls._flush_handle is None:
+            cls._flush_handle = asyncio.get_running_loop().call_later(
+                cls.FLUSH_DELAY, cls._schedule_flush
+            )
+
+    @classmethod
+    def _schedule_flush(cls) -> None:
+        cls._flush_handle = None
+        cls._flush_task = asyncio.create_task(cls.flush())
+
+    @classmethod
+    async def flush(cls) -> None:
+        """把待写队列在一个事务中写入数据库，失败时放回队列等待下次写入"""
+        async with cls._flush_lock:
+            if not cls._dirty:
+                return
+            batch, cls._dirty = cls._dirty, {}
+            upserts = [(key[0], sub) for key, sub in batch.items() if sub is not None]
+            deletes = [key for key, sub in batch.items() if sub is None]
+            try:
+                await SubscribeStore.apply(upserts, deletes)
+                cls.flushes += 1
+            except Exception as e:
+                logger.error(f"订阅数据写入失败，稍后重试: {e}")
+                # 写入期间产生的新修改更新，保留新修改
+                cls._dirty = {**batch, **cls._dirty}
+                if cls._flush_handle is None:
+                    cls._flush_handle = asyncio.get_running_loop().call_later(
+                        cls.FLUSH_DELAY * 5, cls._schedule_flush
+                    )
+
+    @classmethod
+    async def add(cls, chat_key: str, sub: Dict) -> bool:
+        """添加订阅，已订阅时返回 False"""
+        await cls.load()
+        chat = cls._subs.setdefault(chat_key, {})
+        contest_id = str(sub["contest_id"])
+        if contest_id in chat:
+            return False
+        chat[contest_id] = sub
+        cls._by_contest.setdefault(contest_id, set()).add(chat_key)
+        heapq.heappush(cls._expiry, (SubscribeStore.end_at(sub), chat_key, contest_id))
+        remind_at = SubscribeStore.remind_at(sub)
+        heapq.heappush(cls._reminders, (remind_at, chat_key, contest_id))
+        cls._mark(chat_key, contest_id, sub)
+        return True
+
+    @classmethod
+    def _unindex(cls, chat_key: str, contest_id: str) -> None:
+        chats = cls._by_contest.get(contest_id)
+        if chats is not None:
+            chats.discard(chat_key)
+            if not chats:
+                del cls._by_contest[contest_id]
+
+    @classmethod
+    async def remove(cls, chat_key: str, contest_id: str) -> Dict | None:
+        """删除订阅，返回被删除的订阅"""
+        await cls.load()
+        chat = cls._subs.get(chat_key)
+        sub = chat.pop(contest_id, None) if chat else None
+        if sub is None:
+            return None
+        if not chat:
+            del cls._subs[chat_key]
+        cls._unindex(chat_key, contest_id)
+        cls._mark(chat_key, contest_id, None)
+        return sub
+
+    @classmethod
+    async def remove_many(cls, keys: List[tuple[str, str]]) -> int:
+        """批量删除 (会话键, 比赛id)，随同一次落盘写入，返回删除数量"""
+        removed = 0
+        for chat_key, contest_id in keys:
+            if await cls.remove(chat_key, contest_id) is not None:
+                removed += 1
+        return removed
+
+    @classmethod
+    async def subscribers(cls, contest_id: str) -> List[tuple[str, Dict]]:
+        """订阅了某场比赛的全部 (会话键, 订阅)"""
+        await cls.load()
+        return [
+            (chat_key, cls._subs[chat_key][contest_id])
+            for chat_key in cls._by_contest.get(contest_id, ())
+        ]
+
+    @classmethod
+    async def list_chat(cls, chat_key: str) -> List[Dict]:
+        await cls.load()
+        subs = list(cls._subs.get(chat_key, {}).values())
+        return sorted(subs, key=lambda sub: SubscribeStore._timestamp(sub["start_time"]))
+
+    @classmethod
+    async def clear(cls, chat_key: str) -> List[Dict]:
+        """清空会话的全部订阅，返回被删除的订阅"""
+        await cls.load()
+        chat = cls._subs.pop(chat_key, {})
+        for contest_id in chat:
+            cls._unindex(chat_key, contest_id)
+            cls._mark(chat_key, contest_id, None)
+        return list(chat.values())
+
+    @classmethod
+    def _heap(
+        cls, key: Callable[[Dict], float], after: float = float("-inf")
+    ) -> List[tuple[float, str, str]]:
+        heap = [
+            (key(sub), chat_key, contest_id)
+            for chat_key, chat in cls._subs.items()
+            for contest_id, sub in chat.items()
+            if key(sub) > after
+        ]
+        heapq.heapify(heap)
+        return heap
+
+    @classmethod
+    def _pop_until(
+        cls,
+        heap: List[tuple[float, str, str]],
+        until: float,
+        key: Callable[[Dict], float],
+    ) -> List[tuple[str, str]]:
+        """弹出堆中时间不晚于 until 的条目，已删除或重新订阅过的条目直接丢弃"""
+        items: List[tuple[str, str]] = []
+        while heap and heap[0][0] <= until:
+            ts, chat_key, contest_id = heapq.heappop(heap)
+            sub = cls._subs.get(chat_key, {}).get(contest_id)
+            if sub is not None and key(sub) == ts:
+                items.append((chat_key, contest_id))
+        return items
+
+    @classmethod
+    def _compact(cls) -> None:
+        """已删除订阅留下的条目过多时重建堆"""
+        limit = 2 * sum(len(chat) for chat in cls._subs.values()) + 64
+        if len(cls._expiry) > limit:
+            cls._expiry = cls._heap(SubscribeStore.end_at)
+        if len(cls._reminders) > limit:
+            cls._reminders = cls._heap(SubscribeStore.remind_at, after=time.time())
+
+    @classmethod
+    async def take_reminders(cls, until: datetime) -> List[tuple[str, Dict]]:
+        """取出提醒时间不晚于 until 且尚未取出过的订阅，按提醒时间排序"""
+        await cls.load()
+        keys = cls._pop_until(cls._reminders, until.timestamp(), SubscribeStore.remind_at)
+        cls._compact()
+        return [
+            (chat_key, cls._subs[chat_key][contest_id]) for chat_key, contest_id in keys
+        ]
+
+
+    @classmethod
+    async def remove_expired(cls, now: datetime) -> int:
+        """删除比赛已结束的订阅，只弹出堆顶到期的条目，返回删除数量"""
+        await cls.load()
+        expired = cls._pop_until(cls._expiry, now.timestamp(), SubscribeStore.end_at)
+        removed = await cls.remove_many(expired)
+        cls._compact()
+        return removed
+
+    @classmethod
+    def stats(cls) -> dict:
+        return {
+            "chats": len(cls._subs),
+            "contests": len(cls._by_contest),
+            "subscribes": sum(len(chat) for chat in cls._subs.values()),
+            "dirty": len(cls._dirty),
+            "flushes": cls.flushes,
+        }
+
+
+async def close_subscribe_store():
+    """写入待落盘的订阅并关闭数据库，由发件箱的关闭钩子在停止发送后调用"""
+    if SubscribeManager._flush_handle is not None:
+        SubscribeManager._flush_handle.cancel()
+        SubscribeManager._flush_handle = None
+    await SubscribeManager.flush()
+    await asyncio.to_thread(SubscribeStore.close)
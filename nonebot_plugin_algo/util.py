@@ -1,13 +1,84 @@
+import os
+import time
 import asyncio
+import tempfile
+from pathlib import Path
 from datetime import datetime, timezone, timedelta
-from typing import List, Dict, Union
+from typing import Awaitable, List, Dict, Optional, TypeVar, Union
 
 import httpx
 from nonebot.log import logger
 
 from .config import algo_config
+from .singleflight import SingleFlight
+from .http_client import HttpClients
+
+CONTEST_URL = "https://clist.by/api/v4/contest/"
+# 比赛索引单次拉取的数量上限
+INDEX_LIMIT = 500
+# 索引刷新失败后的重试间隔：RETRY_BASE * 2^(连续失败次数-1)，不超过 RETRY_MAX（秒）
+RETRY_BASE = 60
+RETRY_MAX = 30 * 60
+
+T = TypeVar("T")
+
+class StageTimer:
+    """记录一次请求中各阶段的耗时"""
+
+    def __init__(self):
+        self._begin = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+
+    async def track(self, name: str, awaitable: Awaitable[T]) -> T:
+        begin = time.perf_counter()
+        try:
+            return await awaitable
+        finally:
+            self.stages[name] = time.perf_counter() - begin
+
+    def summary(self) -> str:
+        parts = [f"{name}={cost * 1000:.0f}ms" for name, cost in self.stages.items()]
+        parts.append(f"total={(time.perf_counter() - self._begin) * 1000:.0f}ms")
+        return " ".join(parts)
+
 
 class Util:
+    _request_flight = SingleFlight("clist")
+
+    @staticmethod
+    def discard_tasks(*tasks: Optional[asyncio.Task]) -> None:
+        """丢弃不再需要的后台任务：未完成的取消，已完成的读取异常避免告警"""
+        for task in tasks:
+            if task is None:
+                continue
+            if not task.done():
+                task.cancel()
+            elif not task.cancelled():
+                task.exception()
+
+    @staticmethod
+    def write_atomic(path: Path, text: str) -> None:
+        """先写临时文件并落盘再替换，进程崩溃不会留下写了一半的文件"""
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # 每次写入使用独立的临时文件，并发写同一文件时不会互相替换掉对方的临时文件
+        fd, tmp_name = tempfile.mkstemp(
+            prefix=path.name + ".", suffix=".tmp", dir=path.parent
+        )
+
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(text)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_name, path)
+        except BaseException:
+            Path(tmp_name).unlink(missing_ok=True)
+            raise
+
+    @staticmethod
+    def unlink_all(paths: List[Path]) -> None:
+        for path in paths:
+            path.unlink(missing_ok=True)
     
     @staticmethod
     def utc_to_local(time: str) -> datetime:
@@ -16,16 +87,21 @@ class Util:
         local_time = start_time.astimezone()
         return local_time
     
+    @classmethod
+    async def _make_request(cls, url: str, params: dict) -> Union[List[Dict], int]:
+        """统一的HTTP请求方法，并发的相同查询只请求一次"""
+        key = (url, tuple(sorted((k, str(v)) for k, v in params.items())))
+        return await cls._request_flight.do(key, lambda: cls._send_request(url, params))
+
     @staticmethod
-    async def _make_request(url: str, params: dict) -> Union[List[Dict], int]:
-        """统一的HTTP请求方法"""
+    async def _send_request(url: str, params: dict) -> Union[List[Dict], int]:
         timeout = httpx.Timeout(10.0)
+        client = HttpClients.get(url)
         for attempt in range(3):
             try:
-                async with httpx.AsyncClient(timeout=timeout) as client:
-                    response = await client.get(url, params=params)
-                    response.raise_for_status()
-                    return response.json().get("objects", [])
+                response = await client.get(url, params=params, timeout=timeout)
+                response.raise_for_status()
+                return response.json().get("objects", [])
             except httpx.ReadTimeout:
                 wait_time = min(2 ** attempt, 5)
                 logger.warning(f"[Attempt {attempt + 1}/3] Timeout, retrying in {wait_time}s...")
@@ -108,8 +184,11 @@ class Util:
         cls,
         id=None, #比赛id
     ) -> Union[List[Dict], int]:
+        contest = await ContestIndex.get(id) if id is not None else None
+        if contest is not None:
+            return [contest]
         params = cls.build_contest_params(id=id)
-        return await cls._make_request("https://clist.by/api/v4/contest/", params)
+        return await cls._make_request(CONTEST_URL, params)
 
     @classmethod
     async def get_upcoming_contests(
@@ -118,8 +197,12 @@ class Util:
         id=None, #比赛id
         days:int= algo_config.algo_days #查询天数
     ) -> Union[List[Dict], int]:
+        if id is None:
+            contests = await ContestIndex.query(resource_id=resource_id, days=days)
+            if contests is not None:
+                return contests
         params = cls.build_contest_params(resource_id=resource_id, id=id, days=days)
-        return await cls._make_request("https://clist.by/api/v4/contest/", params)
+        return await cls._make_request(CONTEST_URL, params)
 
     @classmethod
     async def get_problems_by_contest(
@@ -145,3 +228,156 @@ class Util:
         """
         params = cls.build_problem_params(contest_ids, url)
         return await cls._make_request("https://clist.by/api/v4/problem/", params)
+
+
+class ContestIndex:
+    """clist 比赛本地索引
+
+    定时按 oj_include 整体拉取尚未结束的比赛，各类比赛查询直接在内存中筛选；
+    数据过期时后台刷新并继续返回旧数据，clist 不可用时同样使用旧数据兜底。
+    """
+
+    _contests: List[Dict] = []
+    _by_id: Dict[int, Dict] = {}
+    _window_end: datetime | None = None
+    _updated_at: float = 0.0
+    _failed_at: float = 0.0
+    _failures = 0
+    _refresh_lock = asyncio.Lock()
+    _refresh_task: asyncio.Task | None = None
+
+    @staticmethod
+    def _start_of(contest: Dict) -> datetime:
+        return datetime.fromisoformat(contest["start"]).replace(tzinfo=timezone.utc)
+
+    @classmethod
+    async def refresh(cls) -> bool:
+        """从 clist 整体拉取比赛并重建索引"""
+        async with cls._refresh_lock:
+            now = datetime.now(timezone.utc)
+            window_end = now + timedelta(days=algo_config.algo_contest_index_days)
+            params = Util._normalize_params({
+                **algo_config.default_params,
+                "end__gte": now,
+                "start__lte": window_end,
+                "order_by": "start",
+                "limit": INDEX_LIMIT,
+            })
+            result = await Util._make_request(CONTEST_URL, params)
+            if isinstance(result, int):
+                cls._failed_at = time.time()
+                cls._failures += 1
+                logger.warning(
+                    f"比赛索引刷新失败(状态码{result})，继续使用旧数据，"
+                    f"{cls._retry_delay():.0f}s 内不再重试"
+                )
+                return False
+            contests = sorted(result, key=cls._start_of)
+            if len(contests) >= INDEX_LIMIT:
+                # 达到数量上限时最后一个开始时间之后可能还有比赛，
+                # 把索引窗口收缩到该时间之前，超出部分走实时查询
+                last_start = cls._start_of(contests[-1])
+                contests = [c for c in contests if cls._start_of(c) < last_start]
+                window_end = last_start - timedelta(seconds=1)
+                logger.warning(
+                    f"比赛索引达到 {INDEX_LIMIT} 场上限，"
+                    f"只覆盖到 {window_end.astimezone()}"
+
+                )
+            cls._failures = 0
+            cls._contests = contests
+            cls._by_id = {int(c["id"]): c for c in contests}
+            cls._window_end = window_end
+            cls._updated_at = time.time()
+            logger.info(f"比赛索引已刷新，共 {len(contests)} 场比赛")
+            return True
+
+    @classmethod
+    def is_stale(cls) -> bool:
+        return time.time() - cls._updated_at > algo_config.algo_contest_refresh * 60
+
+    @classmethod
+    def _retry_delay(cls) -> float:
+        if cls._failures == 0:
+            return 0.0
+        return min(RETRY_MAX, RETRY_BASE * 2 ** (cls._failures - 1))
+
+    @classmethod
+    def _cooling_down(cls) -> bool:
+        """刷新失败后按退避间隔暂停重试，避免 clist 故障期间按查询频率请求"""
+        return time.time() - cls._failed_at < cls._retry_delay()
+
+    @classmethod
+    async def _ensure(cls) -> bool:
+        """首次使用时同步加载；过期时后台刷新，期间继续使用旧数据"""
+        if cls._window_end is None:
+            # 首次加载失败后的退避期内直接走实时查询
+            if not cls._cooling_down():
+                await cls.refresh()
+            return cls._window_end is not None
+        if (
+            cls.is_stale()
+            and not cls._cooling_down()
+            and (cls._refresh_task is None or cls._refresh_task.done())
+        ):
+            cls._refresh_task = asyncio.create_task(cls.refresh())
+        return True
+
+    @classmethod
+    def _sort(cls, contests: List[Dict]) -> List[Dict]:
+        order_by = algo_config.algo_order_by
+        field = order_by.lstrip("-")
+        if field == "start" or not all(field in c for c in contests):
+            return sorted(contests, key=cls._start_of, reverse=order_by.startswith("-"))
+        return sorted(contests, key=lambda c: c[field], reverse=order_by.startswith("-"))
+
+    @classmethod
+    async def query(
+        cls,
+        resource_id=None,
+        days: int = algo_config.algo_days,
+    ) -> List[Dict] | None:
+        """按平台与天数筛选即将开始的比赛，索引无法覆盖时返回 None"""
+        if not algo_config.algo_contest_refresh or not await cls._ensure():
+            return None
+        # 与 Util.build_contest_params 相同的查询窗口
+        now_local = datetime.now().astimezone()
+        end_local = (now_local + timedelta(days=days)).replace(
+            hour=0, minute=0, second=0, microsecond=0
+        ) - timedelta(seconds=1)
+        if cls._window_end is None or end_local > cls._window_end:
+            return None
+        contests = [
+            c for c in cls._contests
+            if now_local <= cls._start_of(c) <= end_local
+            and (resource_id is None or c.get("resource_id") == resource_id)
+        ]
+        return cls._sort(contests)[:algo_config.algo_limit]
+
+    @classmethod
+    async def contests(cls, resource_id=None) -> List[Dict]:
+        """索引中尚未结束的全部比赛，索引不可用时返回空列表"""
+        if not algo_config.algo_contest_refresh or not await cls._ensure():
+            return []
+        if resource_id is None:
+            return list(cls._contests)
+        return [c for c in cls._contests if c.get("resource_id") == resource_id]
+
+
+    @classmethod
+    async def get(cls, id) -> Dict | None:
+        """按比赛 id 查找，索引中没有时返回 None"""
+        if not algo_config.algo_contest_refresh or not await cls._ensure():
+            return None
+        try:
+            return cls._by_id.get(int(id))
+        except (TypeError, ValueError):
+            return None
+
+    @classmethod
+    def stats(cls) -> dict:
+        return {
+            "contests": len(cls._contests),
+            "updated_at": cls._updated_at,
+            "stale": cls.is_stale(),
+        }
@@ -0,0 +1,98 @@
+"""卡片图片编码基准
+
+对已渲染的 PNG 卡片（默认 docs/eg*.png）按各组编码设置重新编码，
+比较文件大小、编码耗时与相对原图的均方根误差，用于选择
+algo_card_format / algo_card_quality / algo_card_quantize / 缩放倍数。
+
+jpeg 在插件中由 Chromium 直接编码，这里用 Pillow 近似其体积与耗时。
+
+用法:
+    pip install Pillow
+    python scripts/bench_card_encoding.py [card.png ...] [--repeat 5]
+"""
+
+import io
+import sys
+import time
+import argparse
+from pathlib import Path
+from statistics import median
+
+from PIL import Image, ImageChops, ImageStat
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# (名称, 格式, 参数, 缩放比例)，缩放比例相对截图的 device_scale_factor=2
+SETTINGS = [
+    ("png", "PNG", {}, 1.0),
+    ("png optimize", "PNG", {"optimize": True}, 1.0),
+    ("png quantize", "PNG", {"optimize": True, "quantize": True}, 1.0),
+    ("jpeg q70", "JPEG", {"quality": 70}, 1.0),
+    ("jpeg q85", "JPEG", {"quality": 85}, 1.0),
+    ("jpeg q95", "JPEG", {"quality": 95}, 1.0),
+    ("webp q75", "WEBP", {"quality": 75, "method": 4}, 1.0),
+    ("webp q85", "WEBP", {"quality": 85, "method": 4}, 1.0),
+    ("webp q95", "WEBP", {"quality": 95, "method": 4}, 1.0),
+    ("png scale1.5", "PNG", {}, 0.75),
+    ("jpeg q85 scale1.5", "JPEG", {"quality": 85}, 0.75),
+    ("webp q85 scale1.5", "WEBP", {"quality": 85, "method": 4}, 0.75),
+]
+
+
+def encode(image: Image.Image, fmt: str, options: dict, ratio: float) -> bytes:
+    if ratio != 1.0:
+        size = (round(image.width * ratio), round(image.height * ratio))
+        image = image.resize(size, Image.Resampling.LANCZOS)
+    options = dict(options)
+    if options.pop("quantize", False):
+        image = image.quantize(colors=256, method=Image.Quantize.FASTOCTREE)
+    buffer = io.BytesIO()
+    image.save(buffer, fmt, **options)
+    return buffer.getvalue()
+
+
+def rms_error(original: Image.Image, data: bytes) -> float:
+    """解码后放大回原尺寸，与原图逐像素比较"""
+    with Image.open(io.BytesIO(data)) as decoded:
+        decoded = decoded.convert("RGB")
+        if decoded.size != original.size:
+            decoded = decoded.resize(original.size, Image.Resampling.LANCZOS)
+        stat = ImageStat.Stat(ImageChops.difference(original, decoded))
+        rms = sum(v ** 0.5 for v in stat.sum2) / len(stat.sum2)
+        return rms / (original.width * original.height) ** 0.5
+
+
+
+def bench(path: Path, repeat: int) -> None:
+    with Image.open(path) as source:
+        image = source.convert("RGB")
+    original = path.stat().st_size
+    print(f"\n{path.name} {image.width}x{image.height} 原始 {original / 1024:.0f} KiB")
+    print(f"{'设置':<20}{'大小(KiB)':>10}{'压缩比':>8}{'耗时(ms)':>10}{'RMS误差':>9}")
+    for name, fmt, options, ratio in SETTINGS:
+        costs = []
+        data = b""
+        for _ in range(repeat):
+            begin = time.perf_counter()
+            data = encode(image, fmt, options, ratio)
+            costs.append(time.perf_counter() - begin)
+        print(
+            f"{name:<20}{len(data) / 1024:>10.0f}{len(data) / original:>8.0%}"
+            f"{median(costs) * 1000:>10.0f}{rms_error(image, data):>9.2f}"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("cards", nargs="*", type=Path)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    cards = args.cards or sorted((ROOT / "docs").glob("eg*.png"))
+    if not cards:
+        sys.exit("未找到卡片图片")
+    for card in cards:
+        bench(card, max(1, args.repeat))
+
+
+if __name__ == "__main__":
+    main()